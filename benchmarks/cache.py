@@ -0,0 +1,52 @@
+"""
+Compares constructing a :class:`rattle.template.Template` by compiling the
+source against loading it from a
+:class:`rattle.cache.FileSystemBytecodeCache`.
+
+Run with::
+
+    python benchmarks/cache.py
+"""
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from rattle.cache import FileSystemBytecodeCache  # noqa: E402
+from rattle.template import Template  # noqa: E402
+
+
+SOURCE = (
+    '<table>{% for row in rows %}<tr>'
+    '{% for cell in row %}<td>{{ cell }}</td>{% endfor %}'
+    '{% if row.selected %}<td>{{ selected_label }}</td>{% endif %}'
+    '</tr>{% empty %}<tr><td>{{ empty_label }}</td></tr>{% endfor %}</table>'
+) * 5
+
+NUMBER = 200
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    try:
+        cache = FileSystemBytecodeCache(directory)
+        Template(SOURCE, bytecode_cache=cache)
+        compiled = min(timeit.repeat(
+            lambda: Template(SOURCE), number=NUMBER, repeat=3))
+        cached = min(timeit.repeat(
+            lambda: Template(SOURCE, bytecode_cache=cache),
+            number=NUMBER, repeat=3))
+    finally:
+        shutil.rmtree(directory)
+    print('compile: %9.1f us' % (compiled / NUMBER * 1e6))
+    print('cached:  %9.1f us' % (cached / NUMBER * 1e6))
+    print('speedup: %9.1fx' % (compiled / cached))
+
+
+if __name__ == '__main__':
+    main()
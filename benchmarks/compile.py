@@ -0,0 +1,160 @@
+"""
+Measures lexing and compiling large templates: pages of markup with
+large inline scripts and styles, and a sprinkling of variables and tags.
+
+The structure lexer is compared against the regular expression rules it
+replaced, run through rply. Those rules cannot lex newlines, or ``}}``
+outside of variables, so the comparison uses the template with newlines
+replaced, and the scripts avoid ``}}``.
+
+The structure parser is timed on its own, on long sequences of tags and on
+deeply nested ones, to show parse time grows linearly with both.
+
+Expressions are compiled with the filter parser and with the parser built
+on Python's own (``RATTLE_PYTHON_EXPRESSIONS``), and a template repeating
+its expressions is parsed with and without the expression cache.
+
+Run with::
+
+    python benchmarks/compile.py
+"""
+from __future__ import print_function
+
+import os
+import sys
+import timeit
+
+import rply
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from rattle.lexer import lexers  # noqa: E402
+from rattle.parser import parsers  # noqa: E402
+from rattle.parser.expression import parse_expression  # noqa: E402
+from rattle.template import Template  # noqa: E402
+from rattle.utils.parser import ParserState  # noqa: E402
+
+
+SCRIPT = (
+    '<script>\n'
+    'function update(items) {\n'
+    '  var out = {count: 0, names: {} };\n'
+    '  for (var i = 0; i < items.length; i++) {\n'
+    '    if (items[i].visible) { out.names[items[i].id] = {n: items[i].name}; }\n'
+    '  }\n'
+    '  return out;\n'
+    '}\n'
+    '</script>\n'
+)
+
+STYLE = (
+    '<style>\n'
+    '.item { color: #333; margin: 0 auto; }\n'
+    '.item:hover { color: #000; background: url("bg.png"); }\n'
+    '</style>\n'
+)
+
+ITEM_LIST = (
+    '<ul>{% for item in items %}<li class="item">{{ item.name }}</li>'
+    '{% endfor %}</ul>\n<p>{{ title }}</p>\n'
+)
+
+SECTION = SCRIPT * 20 + STYLE * 20 + ITEM_LIST
+
+
+def legacy_lexer():
+    lg = rply.LexerGenerator()
+    lg.add('VS', r'\{\{\s*')
+    lg.add('VE', r'\s*\}\}')
+    lg.add('TS', r'\{%')
+    lg.add('TE', r'\s*%\}')
+    lg.add('CS', r'\{#\s*')
+    lg.add('CE', r'\s*#\}')
+    lg.add('CONTENT', r'(?<!(\{[{%#])).*?(?=(\{[{%#])|(\s*[#%}]\})|$)')
+    lg.add('IF', r'\s*if\s+')
+    lg.add('ENDIF', r'\s*endif\s+')
+    lg.add('ELSE', r'\s*else\s+')
+    lg.add('FOR', r'\s*for\s+')
+    lg.add('ENDFOR', r'\s*endfor\s+')
+    lg.add('EMPTY', r'\s*empty\s+')
+    return lg.build()
+
+
+def best(func, number=3):
+    return min(timeit.repeat(func, number=number, repeat=3)) / number
+
+
+def parse(source):
+    return parsers.sp.parse(lexers.sl.lex(source), ParserState())
+
+
+def parse_scaling():
+    item = '{% if a %}<p>{{ b }}</p>{% else %}-{% endif %}'
+    print('%8s %12s %12s' % ('tags', 'sequential', 'nested'))
+    for count in (50, 100, 200, 400):
+        sequential = item * count
+        nested = '{% if a %}<p>{{ b }}' * count + '</p>{% endif %}' * count
+        print('%8d %9.2f ms %9.2f ms' % (
+            count,
+            best(lambda: parse(sequential)) * 1e3,
+            best(lambda: parse(nested)) * 1e3,
+        ))
+
+
+EXPRESSIONS = (
+    'a',
+    'item.name',
+    'title|upper',
+    'user.name|default:"anonymous"|escape',
+    'a + b * 2 > c',
+    'format(price, 2) + currency.symbol|lower',
+    'items[0].tags|join(", ", last=" and ")',
+)
+
+
+def expressions():
+    print('%-42s %10s %10s' % ('expression', 'filter', 'python'))
+    for source in EXPRESSIONS:
+        lr = best(lambda: parsers.fp.parse(lexers.fl.lex(source)), 1000)
+        python = best(lambda: parse_expression(source), 1000)
+        print('%-42s %7.1f us %7.1f us' % (source, lr * 1e6, python * 1e6))
+
+
+def expression_cache():
+    source = (
+        '{% for item in items %}<li>{{ item.name|title }} '
+        '{% if item.price > 0 %}{{ item.price|floatformat:2 }}{% endif %}'
+        '</li>{% endfor %}'
+    ) * 50
+    cache = parsers.expression_cache
+    max_size = cache.max_size
+    cache.max_size = 0
+    uncached = best(lambda: parse(source))
+    cache.max_size = max_size
+    cache.clear()
+    cached = best(lambda: parse(source))
+    print('expression cache: %.2f ms without, %.2f ms with, hit rate %.0f%%'
+          % (uncached * 1e3, cached * 1e3, cache.info().hit_rate * 100))
+
+
+def main():
+    legacy = legacy_lexer()
+    print('%8s %12s %12s %12s' % ('size', 'lex', 'lex (regex)', 'compile'))
+    for sections in (1, 10, 50):
+        source = SECTION * sections
+        flat = source.replace('\n', ' ')
+        lex = best(lambda: list(lexers.sl.lex(flat)))
+        regex = best(lambda: list(legacy.lex(flat)))
+        compiled = best(lambda: Template(source), number=1)
+        print('%7dK %9.2f ms %9.2f ms %9.2f ms' % (
+            len(source) // 1024, lex * 1e3, regex * 1e3, compiled * 1e3))
+    print()
+    parse_scaling()
+    print()
+    expressions()
+    print()
+    expression_cache()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""
+Measures how the cost of :meth:`rattle.template.Template.render` grows with
+the size of the caller's context.
+
+The "copy + update" column shows what building a per-render ``dict`` used to
+cost on its own; the "render" column is a complete render with the layered
+:class:`rattle.context.Context`, which references the caller's mapping
+instead of copying it.
+
+Run with::
+
+    python benchmarks/context.py
+"""
+from __future__ import print_function
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from rattle.template import Template  # noqa: E402
+
+
+SIZES = (10, 100, 1000)
+
+NUMBER = 20000
+
+
+def copy_update(context, defaults):
+    ctx = context.copy()
+    ctx.update(defaults)
+    return ctx
+
+
+def main():
+    tmpl = Template('{% for a in b %}{{ a }}{% endfor %}{{ key0 }}')
+    print('%-6s %16s %16s' % ('keys', 'copy + update', 'render'))
+    for size in SIZES:
+        context = dict(('key%d' % i, i) for i in range(size))
+        context['b'] = [1, 2, 3]
+        copy = min(timeit.repeat(
+            lambda: copy_update(context, tmpl.default_context),
+            number=NUMBER, repeat=3))
+        render = min(timeit.repeat(
+            lambda: tmpl.render(context), number=NUMBER, repeat=3))
+        print('%-6d %13.2f us %13.2f us' % (
+            size, copy / NUMBER * 1e6, render / NUMBER * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Compares the output escaping used for every ``{{ }}`` against the previous
+implementation, which always chained five ``str.replace`` calls and wrapped
+the result in :class:`rattle.template.SafeData`.
+
+Each distribution is a list of values as they might appear on a page; the
+times are per value.
+
+Run with::
+
+    python benchmarks/escape.py
+"""
+from __future__ import print_function
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from rattle.template import SafeData, auto_escape  # noqa: E402
+
+
+def old_escape(text):
+    if isinstance(text, SafeData):
+        return text
+    if not isinstance(text, str):
+        text = str(text)
+    return SafeData(
+        text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+            .replace('"', '&quot;').replace("'", '&#39;')
+    )
+
+
+def old_auto_escape(s):
+    if isinstance(s, SafeData):
+        return s
+    return old_escape(s)
+
+
+DISTRIBUTIONS = (
+    ('table', [1, 42, 3.5, 'Smith', 'john@example.com', True, None,
+               '2014-10-25', 1999, 'Widget'] * 10),
+    ('names', ['John Smith', "O'Brien", 'Tom & Jerry', 'Ann', 'Bob Jones',
+               'Zoe', 'Mary-Jane', 'Li', 'Ana Lopez', 'Sam'] * 10),
+    ('prose', ['Lorem ipsum dolor sit amet, consectetur adipiscing elit ' * 4,
+               'Sed do eiusmod tempor "incididunt" ut labore et dolore ' * 4,
+               'Ut enim ad minim veniam, quis nostrud exercitation ' * 4] * 10),
+    ('markup', ['<b>bold</b>', SafeData('<i>safe</i>'), '<a href="/">x</a>',
+                'a < b && c > d', SafeData('&nbsp;')] * 10),
+)
+
+NUMBER = 2000
+
+
+def run(func, values):
+    for value in values:
+        func(value)
+
+
+def main():
+    print('%-8s %12s %12s %8s' % ('values', 'before', 'after', 'speedup'))
+    for name, values in DISTRIBUTIONS:
+        for value in values:
+            assert old_auto_escape(value) == auto_escape(value)
+        before = min(timeit.repeat(
+            lambda: run(old_auto_escape, values), number=NUMBER, repeat=3))
+        after = min(timeit.repeat(
+            lambda: run(auto_escape, values), number=NUMBER, repeat=3))
+        count = NUMBER * len(values)
+        print('%-8s %9.3f us %9.3f us %7.2fx' % (
+            name, before / count * 1e6, after / count * 1e6, before / after))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Compares resolving template names by probing every template directory with
+resolving them through a :class:`rattle.loader.TemplateIndex`.
+
+Forty directories are created, each template lives in only one of them, and
+lookups use fallback lists whose first candidates do not exist.
+
+Run with::
+
+    python benchmarks/loader.py
+"""
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from rattle.loader import Loader  # noqa: E402
+
+
+DIRS = 40
+TEMPLATES = 20
+
+NUMBER = 500
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    try:
+        dirs = []
+        for i in range(DIRS):
+            path = os.path.join(directory, 'dir%d' % i)
+            os.makedirs(path)
+            dirs.append(path)
+        for i in range(TEMPLATES):
+            with open(os.path.join(dirs[-1 - i], 'page%d.html' % i), 'w') as f:
+                f.write('page')
+        lookups = [
+            ['custom/page%d.html' % i, 'theme/page%d.html' % i, 'page%d.html' % i]
+            for i in range(TEMPLATES)
+        ]
+
+        def resolve(loader):
+            for names in lookups:
+                loader.find_template(names)
+
+        print('%-12s %12s' % ('resolution', 'per lookup'))
+        for name, loader in (
+                ('probing', Loader(dirs)),
+                ('index, 0s', Loader(dirs, use_index=True, index_check_interval=0)),
+                ('index', Loader(dirs, use_index=True))):
+            t = min(timeit.repeat(
+                lambda: resolve(loader), number=NUMBER, repeat=3))
+            print('%-12s %9.2f us' % (name, t / NUMBER / TEMPLATES * 1e6))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Compares the peak memory of :meth:`rattle.template.Template.render` and
+:meth:`rattle.template.Template.render_to` as the output grows.
+
+Requires Python 3.4+ for :mod:`tracemalloc`.
+
+Run with::
+
+    python benchmarks/memory.py
+"""
+from __future__ import print_function
+
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from rattle.template import Template  # noqa: E402
+
+
+ROWS = (1000, 10000, 100000)
+
+
+class NullWriter(object):
+
+    def write(self, data):
+        pass
+
+
+def peak(func):
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    tmpl = Template(
+        '<table>{% for row in rows %}<tr><td>{{ row }}</td>'
+        '<td>{{ label }}</td></tr>{% endfor %}</table>'
+    )
+    print('%-8s %12s %12s %12s' % ('rows', 'output', 'render', 'render_to'))
+    for rows in ROWS:
+        ctx = {'rows': range(rows), 'label': 'Tom & Jerry'}
+        size = len(tmpl.render(ctx))
+        render = peak(lambda: tmpl.render(ctx))
+        render_to = peak(lambda: tmpl.render_to(NullWriter(), ctx))
+        print('%-8d %9d KB %9d KB %9d KB' % (
+            rows, size // 1024, render // 1024, render_to // 1024))
+
+
+if __name__ == '__main__':
+    main()
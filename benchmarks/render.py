@@ -0,0 +1,63 @@
+"""
+Measures the per-render overhead of :meth:`rattle.template.Template.render`.
+
+The "module exec" numbers reproduce the previous render path, which executed
+the whole compiled module (class creation, instantiation and join) for every
+render. The "bound root" numbers use the current path, which only calls the
+``root`` generator bound at construction time.
+
+Run with::
+
+    python benchmarks/render.py
+"""
+from __future__ import print_function
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from rattle.template import Template  # noqa: E402
+
+
+TEMPLATES = (
+    ('static', 'Hello world!', {}),
+    ('var', 'Hello {{ name }}!', {'name': 'world'}),
+    ('loop', '{% for a in b %}<li>{{ a }}</li>{% endfor %}',
+     {'b': list(range(10))}),
+)
+
+NUMBER = 20000
+
+
+def module_exec_render(tmpl, context):
+    """
+    Renders the way ``Template.render`` used to: by executing the compiled
+    module in a fresh namespace and joining the output.
+    """
+    ctx = tmpl._make_context(context)
+    global_ctx = tmpl._make_globals()
+    exec(tmpl.func, global_ctx)
+    return ''.join(global_ctx['Template']().root(ctx))
+
+
+def main():
+    print('%-8s %16s %16s %8s' % ('template', 'module exec', 'bound root', 'speedup'))
+    for name, source, context in TEMPLATES:
+        tmpl = Template(source)
+        assert module_exec_render(tmpl, context) == tmpl.render(context)
+        before = min(timeit.repeat(
+            lambda: module_exec_render(tmpl, context), number=NUMBER, repeat=3))
+        after = min(timeit.repeat(
+            lambda: tmpl.render(context), number=NUMBER, repeat=3))
+        print('%-8s %13.2f us %13.2f us %7.2fx' % (
+            name,
+            before / NUMBER * 1e6,
+            after / NUMBER * 1e6,
+            before / after,
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Measures the time a fresh process takes to import rattle and compile its
+first template, with and without the LR parser tables cached by rply.
+
+Every sample runs in a new interpreter. The tables are kept in a private
+temporary directory, which starts out empty, so the first sample has to
+generate them.
+
+Run with::
+
+    python benchmarks/startup.py
+"""
+from __future__ import print_function
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+SCRIPT = '''
+import json, time
+timer = getattr(time, 'perf_counter', time.time)
+start = timer()
+from rattle import Template
+imported = timer()
+Template('<ul>{% for a in b %}<li>{{ a.name }}</li>{% endfor %}</ul>')
+compiled = timer()
+print(json.dumps([imported - start, compiled - imported]))
+'''
+
+REPEAT = 5
+
+
+def sample(env):
+    out = subprocess.check_output(
+        [sys.executable, '-W', 'ignore', '-c', SCRIPT], cwd=ROOT, env=env)
+    return json.loads(out.decode('ascii'))
+
+
+def report(label, samples):
+    imported = min(s[0] for s in samples)
+    compiled = min(s[1] for s in samples)
+    print('%-8s import: %7.1f ms  first compile: %7.1f ms  total: %7.1f ms' % (
+        label, imported * 1e3, compiled * 1e3, (imported + compiled) * 1e3))
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    env = dict(os.environ, TMPDIR=directory, TEMP=directory, TMP=directory)
+    try:
+        report('cold', [sample(env)])
+        report('cached', [sample(env) for _ in range(REPEAT)])
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
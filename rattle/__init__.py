@@ -1,7 +1,9 @@
 import sys
 
+__version__ = '0.0.0'
 
 PY3 = sys.version_info[0] == 3
 
 
 from rattle.template import library, Template  # noqa
+from rattle.compiler import precompile  # noqa
@@ -0,0 +1,127 @@
+"""
+Command line interface::
+
+    python -m rattle compile <dirs> -o <package>
+    python -m rattle precompile <paths> [-j <workers>] [--cache <dir>]
+"""
+from __future__ import print_function
+
+import argparse
+import sys
+from importlib import import_module
+
+
+def import_modules(args):
+    # Filters are registered when the modules defining them are imported
+    for name in args.imports or ():
+        import_module(name)
+
+
+def compile_command(args):
+    from .compiler import CompileError, compile_dirs
+
+    import_modules(args)
+    try:
+        names = compile_dirs(args.dirs, args.output, args.extensions)
+    except CompileError as e:
+        print('Error compiling %s' % e, file=sys.stderr)
+        return 1
+    if not args.quiet:
+        print('Compiled %d templates into %s' % (len(names), args.output))
+    return 0
+
+
+def precompile_command(args):
+    from .cache import FileSystemBytecodeCache
+    from .compiler import precompile
+
+    import_modules(args)
+    cache = None
+    if args.cache is not None:
+        cache = FileSystemBytecodeCache(args.cache)
+    results = precompile(args.paths, args.workers, cache)
+    errors = [result for result in results if result.error is not None]
+    if not args.quiet:
+        for result in results[:args.top]:
+            print('%10.2fms  %s' % (result.time * 1000, result.path))
+        print('Compiled %d templates, %d errors' % (len(results), len(errors)))
+    for result in errors:
+        print('%s: %s' % (result.location(), result.error), file=sys.stderr)
+    return 1 if errors else 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m rattle')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    compile_parser = commands.add_parser(
+        'compile',
+        help='Compile template directories into a package of Python modules.',
+    )
+    compile_parser.add_argument(
+        'dirs', nargs='+', metavar='DIR',
+        help='Template directories, in lookup order.',
+    )
+    compile_parser.add_argument(
+        '-o', '--output', required=True, metavar='PACKAGE',
+        help='Directory of the package to write the modules to.',
+    )
+    compile_parser.add_argument(
+        '-e', '--extension', dest='extensions', action='append',
+        metavar='EXT',
+        help='Only compile files ending in EXT. May be given several times.',
+    )
+    compile_parser.add_argument(
+        '-i', '--import', dest='imports', action='append', metavar='MODULE',
+        help='Import MODULE first, to register its filters. May be given '
+             'several times.',
+    )
+    compile_parser.add_argument(
+        '-q', '--quiet', action='store_true',
+        help='Only report errors.',
+    )
+    compile_parser.set_defaults(func=compile_command)
+
+    precompile_parser = commands.add_parser(
+        'precompile',
+        help='Compile templates in parallel, to check them and fill a '
+             'bytecode cache.',
+    )
+    precompile_parser.add_argument(
+        'paths', nargs='+', metavar='PATH',
+        help='Template files and directories.',
+    )
+    precompile_parser.add_argument(
+        '-j', '--workers', type=int, metavar='N',
+        help='Number of processes. Defaults to the number of CPUs.',
+    )
+    precompile_parser.add_argument(
+        '-c', '--cache', metavar='DIR',
+        help='Store the compiled templates in a bytecode cache in DIR.',
+    )
+    precompile_parser.add_argument(
+        '-t', '--top', type=int, default=10, metavar='N',
+        help='Show the N slowest templates. Defaults to 10.',
+    )
+    precompile_parser.add_argument(
+        '-i', '--import', dest='imports', action='append', metavar='MODULE',
+        help='Import MODULE first, to register its filters. May be given '
+             'several times.',
+    )
+    precompile_parser.add_argument(
+        '-q', '--quiet', action='store_true',
+        help='Only report errors.',
+    )
+    precompile_parser.set_defaults(func=precompile_command)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,230 @@
+"""
+Async rendering support.
+
+The async variant of a template is compiled from the same AST that
+:meth:`rattle.template.Template.parse` builds for synchronous rendering. The
+``root`` function is rewritten into an async generator, value lookups are
+awaited when they produce awaitables and ``for`` loops become ``async for``
+loops over :func:`auto_aiter`.
+
+This module requires Python 3.6 or newer and is only imported on demand.
+"""
+import ast
+import inspect
+
+from .metrics import count, observe, timer
+
+
+async def auto_await(value):
+    """
+    Returns ``value``, awaiting it first if it is awaitable.
+    """
+    if inspect.isawaitable(value):
+        return await value
+    return value
+
+
+async def resolve(context, name):
+    """
+    Looks up ``name`` in the ``context``. Awaitable values are awaited once
+    and the result is stored back, so repeated lookups of a coroutine are
+    safe.
+    """
+    value = context[name]
+    if inspect.isawaitable(value):
+        value = await value
+        context.replace(name, value)
+    return value
+
+
+async def auto_aiter(iterable):
+    """
+    Iterates over ``iterable`` asynchronously, whether it is a regular or an
+    async iterable.
+    """
+    if hasattr(iterable, '__aiter__'):
+        async for item in iterable:
+            yield item
+    else:
+        for item in iterable:
+            yield item
+
+
+def build_await(func, args):
+    """
+    Constructs an :class:`ast.Await` node that awaits the call of the global
+    helper ``func`` with the positional arguments ``args``.
+
+    This is equivalent to::
+
+        await func(*args)
+    """
+    return ast.Await(value=ast.Call(
+        func=ast.Name(id=func, ctx=ast.Load()),
+        args=args,
+        keywords=[],
+    ))
+
+
+# Globals of compiled templates that are never awaited
+SYNC_FUNCS = {'auto_escape', 'profile_timer', 'profile_record'}
+
+
+def is_context_lookup(node):
+    if not isinstance(node.value, ast.Name) or node.value.id != 'context':
+        return False
+    return isinstance(node.slice, ast.Index) and isinstance(node.slice.value, ast.Str)
+
+
+class AwaitTransformer(ast.NodeTransformer):
+    """
+    Rewrites the body of the ``root`` function so that every value lookup,
+    attribute access and call result is awaited if it is awaitable, and every
+    ``for`` loop iterates asynchronously.
+    """
+
+    def visit_Subscript(self, node):
+        self.generic_visit(node)
+        if not isinstance(node.ctx, ast.Load):
+            return node
+        if is_context_lookup(node):
+            return ast.copy_location(build_await('resolve', [
+                ast.Name(id='context', ctx=ast.Load()),
+                node.slice.value,
+            ]), node)
+        return ast.copy_location(build_await('auto_await', [node]), node)
+
+    def visit_Attribute(self, node):
+        self.generic_visit(node)
+        if not isinstance(node.ctx, ast.Load):
+            return node
+        return ast.copy_location(build_await('auto_await', [node]), node)
+
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        if isinstance(node.func, ast.Name) and node.func.id in SYNC_FUNCS:
+            return node
+        return ast.copy_location(build_await('auto_await', [node]), node)
+
+    def visit_With(self, node):
+        # Only scope handling uses ``with``; the context manager is sync.
+        node.body = [self.visit(stmt) for stmt in node.body]
+        return node
+
+    def visit_For(self, node):
+        self.generic_visit(node)
+        if isinstance(node.target, ast.Name):
+            # Loop targets are locals, so awaitable items are resolved once
+            # when they are bound.
+            node.body.insert(0, ast.copy_location(ast.Assign(
+                targets=[ast.Name(id=node.target.id, ctx=ast.Store())],
+                value=build_await('auto_await', [
+                    ast.Name(id=node.target.id, ctx=ast.Load())
+                ]),
+            ), node))
+        return ast.copy_location(ast.AsyncFor(
+            target=node.target,
+            iter=ast.Call(
+                func=ast.Name(id='auto_aiter', ctx=ast.Load()),
+                args=[node.iter],
+                keywords=[],
+            ),
+            body=node.body,
+            orelse=node.orelse,
+        ), node)
+
+
+class AsyncRootTransformer(ast.NodeTransformer):
+    """
+    Turns the template's ``root`` method into an async generator.
+    """
+
+    def visit_FunctionDef(self, node):
+        if node.name != 'root':
+            return node
+        transformer = AwaitTransformer()
+        body = [transformer.visit(stmt) for stmt in node.body]
+        return ast.copy_location(ast.AsyncFunctionDef(
+            name=node.name,
+            args=node.args,
+            body=body,
+            decorator_list=node.decorator_list,
+            returns=None,
+        ), node)
+
+
+def compile_async(template):
+    """
+    Compiles the async variant of ``template``.
+
+    :param template: A :class:`rattle.template.Template`.
+    :returns: The bound ``root`` async generator function.
+    """
+    code = AsyncRootTransformer().visit(template.parse())
+    ast.fix_missing_locations(code)
+    func = compile(code, filename="<template>", mode="exec")
+    global_ctx = template._make_globals()
+
+    # Templates rendered from this one are rendered asynchronously too
+    def include_template(name, context, bindings):
+        return template.get_template(name).async_root(
+            template.include_context(context, bindings))
+
+    def extend_template(name, context):
+        return template.get_extended(name).async_root(context)
+
+    global_ctx.update({
+        'auto_await': auto_await,
+        'auto_aiter': auto_aiter,
+        'resolve': resolve,
+        'include_template': include_template,
+        'extend_template': extend_template,
+    })
+    exec(func, global_ctx)
+    return global_ctx['root']
+
+
+def measure_root(origin, root):
+    """
+    Wraps the async ``root`` function of a template, reporting its renders
+    to the metrics sinks under the template's ``origin``, like
+    :func:`rattle.metrics.measure_render`.
+    """
+    async def measured(context):
+        chunks = root(context).__aiter__()
+        elapsed = 0.0
+        size = 0
+        while True:
+            start = timer()
+            try:
+                chunk = await chunks.__anext__()
+            except StopAsyncIteration:
+                break
+            except Exception:
+                count('render_error', origin)
+                raise
+            finally:
+                elapsed += timer() - start
+            size += len(chunk)
+            yield chunk
+        observe('render_time', origin, elapsed)
+        observe('output_size', origin, size)
+    return measured
+
+
+async def render_async(root, context):
+    return ''.join([s async for s in root(context)])
+
+
+async def stream_async(root, context, chunk_size):
+    buf = []
+    size = 0
+    async for s in root(context):
+        buf.append(s)
+        size += len(s)
+        if size >= chunk_size:
+            yield ''.join(buf)
+            buf = []
+            size = 0
+    if size:
+        yield ''.join(buf)
@@ -0,0 +1,419 @@
+"""
+Benchmark suite::
+
+    python -m rattle.bench [-k PATTERN] [-o results.json]
+                           [-b baseline.json] [-t PERCENT]
+
+Times importing rattle in a fresh interpreter, and lexing, parsing,
+compiling and rendering a set of representative templates:
+
+``small``
+    A line of text with a few variables.
+``large``
+    A page of markup, with long runs of text and a sprinkling of variables
+    and tags.
+``loops``
+    A table built by nested loops, with conditions.
+``filters``
+    A list whose every item goes through several filters.
+
+Each benchmark calls its function often enough for a sample to take at
+least ``--min-time`` seconds, takes ``--repeat`` samples, and reports the
+fastest and the median time per call. The templates and their contexts are
+fixed, so results only vary with the machine and the code.
+
+Results are written as JSON with ``--output``. Given a ``--baseline``, a
+file written earlier, every benchmark whose fastest time grew by more than
+``--threshold`` percent is reported as a regression, and the command exits
+with status 1.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+import timeit
+from collections import namedtuple
+from contextlib import contextmanager
+
+import rattle
+from .template import Library, Template, library
+
+# Highest resolution clock available
+timer = getattr(time, 'perf_counter', time.time)
+
+#: Version of the JSON format of the results
+FORMAT = 1
+
+#: Default percentage a benchmark may slow down by before it is reported
+THRESHOLD = 10.0
+
+IMPORT_SCRIPT = '''
+import json, time
+timer = getattr(time, 'perf_counter', time.time)
+start = timer()
+import rattle
+print(json.dumps(timer() - start))
+'''
+
+
+Item = namedtuple('Item', 'id name price tags visible note')
+
+ITEMS = [
+    Item(i, 'item number %d' % i, i * 1.25, ['tag%d' % (i % 7), 'all'],
+         i % 3 != 0, '')
+    for i in range(200)
+]
+
+# Filters of the ``filters`` template, kept out of the shared library so
+# they never clash with filters of the same names registered elsewhere
+bench_library = Library()
+
+
+@bench_library.register_filter
+def title(value):
+    return value.title()
+
+
+@bench_library.register_filter
+def truncate(value, length):
+    if len(value) <= length:
+        return value
+    return value[:length - 3] + '...'
+
+
+@bench_library.register_filter
+def money(value, currency='$'):
+    return '%s%.2f' % (currency, value)
+
+
+@bench_library.register_filter
+def join_all(value, sep):
+    return sep.join(value)
+
+
+@bench_library.register_filter
+def default(value, fallback):
+    return value or fallback
+
+
+@contextmanager
+def bench_filters():
+    """
+    Makes the filters of the benchmark templates available to the templates
+    compiled in the block, in place of any of the same names.
+    """
+    filters = dict(library.filters)
+    library.filters.update(bench_library.filters)
+    try:
+        yield
+    finally:
+        library.filters.clear()
+        library.filters.update(filters)
+
+
+SCRIPT = (
+    '<script>\n'
+    'function toggle(id) {\n'
+    '  var el = document.getElementById(id);\n'
+    '  el.className = el.className ? "" : "open";\n'
+    '}\n'
+    '</script>\n'
+)
+
+SECTION = (
+    '<section class="section">\n'
+    '  <h2>{{ title }}</h2>\n'
+    '  <p>Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do\n'
+    '  eiusmod tempor incididunt ut labore et dolore magna aliqua.</p>\n'
+    '  {% if user %}<p class="user">Signed in as {{ user.name }}</p>'
+    '{% else %}<p><a href="/login">Sign in</a></p>{% endif %}\n'
+    '  <ul>{% for link in links %}<li>{{ link }}</li>{% endfor %}</ul>\n'
+    '</section>\n'
+)
+
+#: ``(source, context)`` of the templates, by name
+TEMPLATES = {
+    'small': (
+        'Hello {{ user.name }}, you have {{ count }} new messages.',
+        {'user': ITEMS[1], 'count': 3},
+    ),
+    'large': (
+        '<html><head>' + SCRIPT * 5 + '</head><body>\n' + SECTION * 40 + '</body></html>\n',
+        {'title': 'Section', 'user': ITEMS[1],
+         'links': ['Home', 'About', 'Contact']},
+    ),
+    'loops': (
+        '<table>{% for row in rows %}<tr>'
+        '{% for cell in row.tags %}<td>{{ cell }}</td>{% endfor %}'
+        '{% for cell in columns %}<td>{% if row.visible %}{{ cell }}'
+        '{% else %}-{% endif %}</td>{% endfor %}'
+        '</tr>{% empty %}<tr><td>None</td></tr>{% endfor %}</table>',
+        {'rows': ITEMS, 'columns': list(range(10))},
+    ),
+    'filters': (
+        '<ul>{% for item in items %}<li id="item-{{ item.id }}">'
+        '{{ item.name|title|truncate:12 }} {{ item.price|money:"EUR " }} '
+        '{{ item.tags|join_all:", " }} {{ item.note|default:"-" }}'
+        '</li>{% endfor %}</ul>',
+        {'items': ITEMS},
+    ),
+}
+
+
+class Result(namedtuple('Result', 'best median number repeat')):
+    """
+    Times of one benchmark, in seconds per call.
+    """
+
+
+def measure(func, repeat, min_time):
+    """
+    Times ``func``, calling it often enough for each of the ``repeat``
+    samples to take at least ``min_time`` seconds.
+
+    :rtype: :class:`Result`
+    """
+    number = 1
+    while True:
+        elapsed = timeit.timeit(func, timer=timer, number=number)
+        if elapsed >= min_time:
+            break
+        if elapsed <= 0:
+            number *= 10
+        else:
+            number = int(number * min_time * 1.1 / elapsed) + 1
+    samples = [elapsed]
+    samples.extend(timeit.repeat(
+        func, timer=timer, number=number, repeat=repeat - 1))
+    return summarize([t / number for t in samples], number)
+
+
+def summarize(times, number):
+    times = sorted(times)
+    middle = len(times) // 2
+    if len(times) % 2:
+        median = times[middle]
+    else:
+        median = (times[middle - 1] + times[middle]) / 2.0
+    return Result(times[0], median, number, len(times))
+
+
+def measure_import(repeat):
+    """
+    Times importing rattle in ``repeat`` fresh interpreters.
+    """
+    times = []
+    for _ in range(repeat):
+        out = subprocess.check_output(
+            [sys.executable, '-W', 'ignore', '-c', IMPORT_SCRIPT])
+        times.append(json.loads(out.decode('ascii')))
+    return summarize(times, 1)
+
+
+def build_benchmarks():
+    """
+    Returns the functions to time, by benchmark name, in running order.
+    """
+    from .lexer import lexers
+    from .parser import parsers
+    from .utils.parser import ParserState
+
+    def lex(source, context):
+        return lambda: list(lexers.sl.lex(source))
+
+    # Expressions are compiled afresh every time, as in a process compiling
+    # the template for the first time
+    def parse(source, context):
+        tokens = list(lexers.sl.lex(source))
+
+        def func():
+            parsers.expression_cache.clear()
+            parsers.sp.parse(tokens, ParserState())
+        return func
+
+    def build(source, context):
+        def func():
+            parsers.expression_cache.clear()
+            Template(source)
+        return func
+
+    def render(source, context):
+        template = Template(source)
+        return lambda: template.render(context)
+
+    benchmarks = [('import', None)]
+    for stage, builder in (('lex', lex), ('parse', parse),
+                           ('compile', build), ('render', render)):
+        for name in sorted(TEMPLATES):
+            source, context = TEMPLATES[name]
+            benchmarks.append(
+                ('%s/%s' % (stage, name), builder(source, context)))
+    return benchmarks
+
+
+def selected(name, patterns):
+    return not patterns or any(pattern in name for pattern in patterns)
+
+
+def run(patterns=(), repeat=5, min_time=0.2, report=None):
+    """
+    Runs the benchmarks whose names contain any of ``patterns``, or all of
+    them.
+
+    :param report: Called with the name and :class:`Result` of each
+        benchmark as it finishes.
+    :returns: The results, in the JSON format.
+    """
+    results = {}
+    with bench_filters():
+        benchmarks = build_benchmarks()
+        for name, func in benchmarks:
+            if not selected(name, patterns):
+                continue
+            if func is None:
+                result = measure_import(repeat)
+            else:
+                result = measure(func, repeat, min_time)
+            results[name] = result._asdict()
+            if report is not None:
+                report(name, result)
+    return {
+        'format': FORMAT,
+        'rattle': rattle.__version__,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'benchmarks': results,
+    }
+
+
+def compare(results, baseline, threshold=THRESHOLD):
+    """
+    Compares the fastest times of the benchmarks in both ``results`` and
+    ``baseline``.
+
+    :returns: A list of ``(name, baseline time, time, percentage change,
+        regressed)`` tuples, by name.
+    """
+    changes = []
+    current = results['benchmarks']
+    previous = baseline.get('benchmarks', {})
+    for name in sorted(current):
+        if name not in previous:
+            continue
+        before, after = previous[name]['best'], current[name]['best']
+        change = (after - before) * 100.0 / before if before else 0.0
+        changes.append((name, before, after, change, change > threshold))
+    return changes
+
+
+def format_time(seconds):
+    for unit, scale in (('s', 1), ('ms', 1e3), ('us', 1e6)):
+        if seconds >= 1 / scale:
+            return '%.2f %s' % (seconds * scale, unit)
+    return '%.2f ns' % (seconds * 1e9)
+
+
+def print_result(name, result, out=None):
+    out = out or sys.stdout
+    print('%-18s %12s %12s %10d' % (
+        name, format_time(result.best), format_time(result.median),
+        result.number), file=out)
+    out.flush()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m rattle.bench')
+    parser.add_argument(
+        '-k', '--select', dest='patterns', action='append',
+        metavar='PATTERN',
+        help='Only run benchmarks whose names contain PATTERN. May be given '
+             'several times.',
+    )
+    parser.add_argument(
+        '-l', '--list', action='store_true',
+        help='List the benchmarks and exit.',
+    )
+    parser.add_argument(
+        '-r', '--repeat', type=int, default=5, metavar='N',
+        help='Number of samples per benchmark. Defaults to 5.',
+    )
+    parser.add_argument(
+        '--min-time', type=float, default=0.2, metavar='SECONDS',
+        help='Minimum duration of a sample. Defaults to 0.2.',
+    )
+    parser.add_argument(
+        '-o', '--output', metavar='FILE',
+        help='Write the results to FILE as JSON; "-" writes to the '
+             'standard output.',
+    )
+    parser.add_argument(
+        '-b', '--baseline', metavar='FILE',
+        help='Compare the results against those in FILE.',
+    )
+    parser.add_argument(
+        '-t', '--threshold', type=float, default=THRESHOLD,
+        metavar='PERCENT',
+        help='Report benchmarks slower than the baseline by more than '
+             'PERCENT as regressions. Defaults to %g.' % THRESHOLD,
+    )
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.list:
+        with bench_filters():
+            benchmarks = build_benchmarks()
+        for name, _ in benchmarks:
+            if selected(name, args.patterns):
+                print(name)
+        return 0
+    if args.repeat < 1:
+        print('--repeat must be at least 1', file=sys.stderr)
+        return 2
+
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    # The tables go to stderr when the JSON takes stdout
+    out = sys.stderr if args.output == '-' else sys.stdout
+    print('%-18s %12s %12s %10s' % ('benchmark', 'best', 'median', 'calls'),
+          file=out)
+    results = run(args.patterns, args.repeat, args.min_time,
+                  lambda name, result: print_result(name, result, out))
+
+    if args.output == '-':
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print()
+    elif args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+    if baseline is None:
+        return 0
+    changes = compare(results, baseline, args.threshold)
+    print(file=out)
+    print('%-18s %12s %12s %9s' % ('benchmark', 'baseline', 'best',
+                                   'change'), file=out)
+    for name, before, after, change, regressed in changes:
+        print('%-18s %12s %12s %+8.1f%%%s' % (
+            name, format_time(before), format_time(after), change,
+            '  REGRESSION' if regressed else ''), file=out)
+    regressions = [change for change in changes if change[-1]]
+    if regressions:
+        print('%d of %d benchmarks regressed by more than %g%%' % (
+            len(regressions), len(changes), args.threshold), file=out)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,281 @@
+import errno
+import hashlib
+import marshal
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+import rattle
+
+
+#: Number of fragments kept by :data:`fragment_cache`
+FRAGMENT_CACHE_SIZE = int(os.environ.get('RATTLE_FRAGMENT_CACHE_SIZE', 1000))
+
+# Expiry times are not affected by changes of the system clock
+monotonic = getattr(time, 'monotonic', time.time)
+
+
+class CacheInfo(namedtuple('CacheInfo', 'hits misses max_size size')):
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / float(lookups) if lookups else 0.0
+
+
+class BytecodeCache(object):
+    """
+    Base class for caches of compiled template code.
+
+    Entries are keyed by a hash of the template source, the rattle version
+    and the Python implementation and version, so a cache can be shared by
+    different deployments without ever loading incompatible code.
+
+    Subclasses implement :meth:`load_bytes` and :meth:`dump_bytes`.
+    """
+
+    #: Marks the start of every entry
+    MAGIC = b'rattle-bc\x02'
+
+    def get_key(self, source, options=''):
+        if not isinstance(source, bytes):
+            source = source.encode('utf-8')
+        h = hashlib.sha1()
+        h.update(('%s|%s|%s|%d\n' % (
+            rattle.__version__,
+            platform.python_implementation(),
+            '.'.join(str(v) for v in sys.version_info[:3]),
+            marshal.version,
+        )).encode('ascii'))
+        if options:
+            h.update(('%s\n' % options).encode('ascii'))
+        h.update(source)
+        return h.hexdigest()
+
+    def load(self, source, options=''):
+        """
+        Returns the cached ``(code, static, filter_names, dependencies)``
+        tuple for ``source`` compiled with ``options``, or ``None`` if there
+        is no usable entry.
+        """
+        data = self.load_bytes(self.get_key(source, options))
+        if data is None or not data.startswith(self.MAGIC):
+            return None
+        try:
+            code, static, filter_names, dependencies = marshal.loads(
+                data[len(self.MAGIC):])
+        except (EOFError, ValueError, TypeError):
+            return None
+        return code, static, filter_names, dependencies
+
+    def store(self, source, code, static, filter_names, dependencies=(),
+              options=''):
+        """
+        Stores the compiled module ``code`` of ``source``, along with the
+        static output of the template (or ``None``), the mapping of the
+        globals the code expects to the filter names they are bound to, and
+        the ``(name, digest)`` pairs of the templates compiled into it.
+
+        :param str options: The options the code was compiled with, see
+            :meth:`rattle.template.Template.compile_options`.
+        """
+        data = self.MAGIC + marshal.dumps(
+            (code, static, filter_names, tuple(dependencies)))
+        self.dump_bytes(self.get_key(source, options), data)
+
+    def load_bytes(self, key):
+        raise NotImplementedError
+
+    def dump_bytes(self, key, data):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class FileSystemBytecodeCache(BytecodeCache):
+    """
+    Stores compiled templates as files in ``directory``, which is created if
+    it does not exist.
+
+    Entries are written to a temporary file and renamed into place, so any
+    number of processes can share one directory without reading partially
+    written entries. Failures to write are ignored; the template is simply
+    compiled again next time.
+    """
+
+    suffix = '.rattlec'
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def get_path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def load_bytes(self, key):
+        try:
+            with open(self.get_path(key), 'rb') as f:
+                return f.read()
+        except (IOError, OSError):
+            return None
+
+    def dump_bytes(self, key, data):
+        try:
+            os.makedirs(self.directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                return
+        try:
+            fd, tmp_path = tempfile.mkstemp(
+                suffix='.tmp', prefix=key, dir=self.directory)
+        except (IOError, OSError):
+            return
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            replace(tmp_path, self.get_path(key))
+        except (IOError, OSError):
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def clear(self):
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            if name.endswith(self.suffix):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+
+class FragmentCache(object):
+    """
+    Base class for caches of rendered template fragments, used by the
+    ``{% cache key ttl %}`` tag.
+
+    Fragments are strings, stored under the value of the tag's key
+    expression combined with the template and the position of the tag, see
+    :meth:`rattle.template.Template.fragment_key`.
+
+    Subclasses implement :meth:`load`, :meth:`dump` and :meth:`clear`; the
+    hits and misses are counted here.
+
+    :param default_ttl: Seconds fragments are kept for if the tag gives no
+        time, ``None`` to keep them until they are evicted.
+    """
+
+    def __init__(self, default_ttl=None):
+        self.default_ttl = default_ttl
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns the fragment stored under ``key``, or ``None``.
+        """
+        value = self.load(key)
+        with self._stats_lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        """
+        Stores the fragment ``value`` under ``key`` for ``ttl`` seconds.
+        """
+        if ttl is None:
+            ttl = self.default_ttl
+        self.dump(key, value, ttl)
+
+    def info(self):
+        """
+        Returns the :class:`CacheInfo` of the cache. The size is ``None`` if
+        the backend does not know it.
+        """
+        return CacheInfo(self.hits, self.misses, None, None)
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self.hits = 0
+            self.misses = 0
+
+    def load(self, key):
+        raise NotImplementedError
+
+    def dump(self, key, value, ttl):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class MemoryFragmentCache(FragmentCache):
+    """
+    Keeps fragments in a dictionary of the process.
+
+    :param int max_size: At most this many fragments are kept; the least
+        recently used are evicted first.
+    :param default_ttl: See :class:`FragmentCache`.
+    """
+
+    def __init__(self, max_size=FRAGMENT_CACHE_SIZE, default_ttl=None):
+        super(MemoryFragmentCache, self).__init__(default_ttl)
+        self.max_size = max_size
+        # Maps keys to ``(expires, value)``; ``expires`` is None for
+        # fragments that never expire
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, key):
+        with self._lock:
+            entry = self._cache.pop(key, None)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires is not None and expires <= monotonic():
+                return None
+            self._cache[key] = entry
+            return value
+
+    def dump(self, key, value, ttl):
+        if not self.max_size:
+            return
+        expires = None if ttl is None else monotonic() + ttl
+        with self._lock:
+            self._cache.pop(key, None)
+            self._cache[key] = (expires, value)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    def info(self):
+        return CacheInfo(self.hits, self.misses, self.max_size,
+                         len(self._cache))
+
+    def clear(self):
+        """
+        Drops all fragments and resets the statistics.
+        """
+        with self._lock:
+            self._cache.clear()
+        self.reset_stats()
+
+
+#: Fragment cache of templates not given their own
+fragment_cache = MemoryFragmentCache()
+
+
+# os.replace overwrites the target atomically on all platforms, but is only
+# available from Python 3.3; os.rename does the same on POSIX.
+replace = getattr(os, 'replace', os.rename)
@@ -0,0 +1,355 @@
+"""
+Ahead-of-time compilation of templates.
+
+:func:`precompile` compiles templates in bulk across a pool of processes, to
+fill a bytecode cache or loader and report templates that fail to compile.
+
+:func:`compile_dirs` compiles template directories into Python modules.
+
+Every template is compiled into a module of its own, holding the template's
+code along with its source and static output. The package the modules are
+written to also gets an ``__init__`` module mapping template names to module
+names, which :class:`rattle.loader.PrecompiledLoader` uses to load templates
+without lexing or parsing them.
+
+The output only depends on the templates and the filters they use, so it can
+be committed or cached along with the code using it.
+"""
+import ast
+import hashlib
+import io
+import os
+import re
+import sys
+import time
+from importlib import import_module
+
+from .template import RUNTIME_HELPERS, Template, func_name
+from .utils.codegen import to_source
+
+# Highest resolution clock available
+timer = getattr(time, 'perf_counter', time.time)
+
+#: Prefix of the generated template modules
+MODULE_PREFIX = 'tmpl_'
+
+HEADER = '''\
+# -*- coding: utf-8 -*-
+# Generated by rattle.compiler from %r. Do not edit.'''
+
+
+class CompileError(Exception):
+    """
+    Raised when a template cannot be compiled ahead of time.
+    """
+
+    def __init__(self, name, error):
+        super(CompileError, self).__init__('%s: %s' % (name, error))
+        self.name = name
+        self.error = error
+
+
+class ModuleTemplate(Template):
+    """
+    Keeps the module AST built by :meth:`Template.parse`, so it can be
+    turned into source.
+    """
+
+    def parse(self):
+        self.module = super(ModuleTemplate, self).parse()
+        return self.module
+
+
+def find_templates(template_dirs, extensions=None):
+    """
+    Returns sorted ``(name, path)`` pairs for all templates in
+    ``template_dirs``. As with the loader, a name found in several
+    directories resolves to the first.
+
+    :param extensions: If given, only files ending in one of these are
+        included.
+    """
+    found = {}
+    for tdir in template_dirs:
+        tdir = os.path.abspath(tdir)
+        for dirpath, dirnames, filenames in os.walk(tdir):
+            dirnames.sort()
+            rel = os.path.relpath(dirpath, tdir)
+            for filename in sorted(filenames):
+                if extensions and not filename.endswith(tuple(extensions)):
+                    continue
+                if rel == os.curdir:
+                    name = filename
+                else:
+                    name = '/'.join(rel.split(os.sep) + [filename])
+                found.setdefault(name, os.path.join(dirpath, filename))
+    return sorted(found.items())
+
+
+def module_name(name):
+    """
+    Returns the name of the module generated for the template ``name``.
+
+    A hash of the name keeps module names unique when different template
+    names sanitize to the same identifier.
+    """
+    ident = re.sub(r'\W', '_', name)
+    digest = hashlib.sha1(name.encode('utf-8')).hexdigest()[:8]
+    return '%s%s_%s' % (MODULE_PREFIX, ident, digest)
+
+
+def filter_import(global_name, func):
+    """
+    Returns the import statement binding ``func`` to ``global_name``, making
+    sure it actually imports the function.
+    """
+    module, _, attr = func_name(func).rpartition('.')
+    try:
+        imported = getattr(import_module(module), attr)
+    except (ImportError, AttributeError):
+        imported = None
+    if imported is not func:
+        raise ValueError(
+            'Filter %s cannot be imported from its module' % func_name(func))
+    return 'from %s import %s as %s' % (module, attr, global_name)
+
+
+def compile_source(name, source, loader=None):
+    """
+    Compiles the template ``source`` and returns the source of its module.
+
+    :param str name: The template name, stored as ``origin`` in the module.
+    :param loader: The loader of the templates it includes or extends.
+    """
+    template = ModuleTemplate(source, name, loader=loader)
+    module = template.module
+    lines = [
+        HEADER % (name,),
+        '',
+        'from rattle.optimizer import missing',
+        'from rattle.template import auto_escape',
+    ]
+    filter_names = sorted(template.filter_funcs)
+    lines.extend(
+        filter_import(global_name, template.filter_funcs[global_name])
+        for global_name in filter_names
+    )
+    # Bound to the template's methods when it is loaded
+    used = set(
+        node.id for node in ast.walk(module) if isinstance(node, ast.Name))
+    lines.extend(
+        '%s = None' % helper for helper in RUNTIME_HELPERS if helper in used
+    )
+    lines.extend([
+        '',
+        'origin = %r' % (name,),
+        'source = %r' % (source,),
+        'static = %r' % (template.static,),
+        'compiled_tags = []',
+        'filter_funcs = {%s}' % ', '.join(
+            '%r: %s' % (global_name, global_name)
+            for global_name in filter_names
+        ),
+        '',
+        '',
+    ])
+    ast.fix_missing_locations(module)
+    return '\n'.join(lines) + to_source(module)
+
+
+def write_file(path, content):
+    # Unchanged files are left alone, so their modification times (and
+    # anything derived from them) stay the same.
+    try:
+        with io.open(path, 'r', encoding='utf-8') as f:
+            if f.read() == content:
+                return
+    except (IOError, OSError):
+        pass
+    with io.open(path, 'w', encoding='utf-8') as f:
+        f.write(content)
+
+
+def compile_dirs(template_dirs, output, extensions=None):
+    """
+    Compiles all templates in ``template_dirs`` into modules in the package
+    directory ``output``, which is created if needed. Modules generated
+    before for templates that no longer exist are removed.
+
+    :returns: The sorted list of template names compiled.
+    :raises CompileError: If a template cannot be compiled. Nothing is
+        written in that case.
+    """
+    from .loader import Loader
+    loader = Loader(template_dirs)
+    modules = {}
+    sources = {}
+    for name, path in find_templates(template_dirs, extensions):
+        with io.open(path, 'r', encoding='utf-8') as f:
+            source = f.read()
+        if sys.version_info[0] == 2:
+            source = source.encode('utf-8')
+        try:
+            sources[name] = compile_source(name, source, loader)
+        except Exception as e:
+            raise CompileError(name, e)
+        modules[name] = module_name(name)
+
+    if not os.path.isdir(output):
+        os.makedirs(output)
+
+    for name, code in sources.items():
+        write_file(os.path.join(output, modules[name] + '.py'), code)
+
+    index = [
+        '# -*- coding: utf-8 -*-',
+        '# Generated by rattle.compiler. Do not edit.',
+        '',
+        'TEMPLATES = {',
+    ]
+    index.extend(
+        '    %r: %r,' % (name, modules[name]) for name in sorted(modules)
+    )
+    index.append('}')
+    write_file(os.path.join(output, '__init__.py'), '\n'.join(index) + '\n')
+
+    current = set(modules.values())
+    for filename in os.listdir(output):
+        base, ext = os.path.splitext(filename)
+        stale = base.startswith(MODULE_PREFIX) and base not in current
+        if stale and ext in ('.py', '.pyc'):
+            os.remove(os.path.join(output, filename))
+
+    return sorted(modules)
+
+
+class PrecompileResult(object):
+    """
+    The outcome of compiling one template with :func:`precompile`.
+
+    :ivar str path: Path of the template file.
+    :ivar float time: Seconds spent reading and compiling the template.
+    :ivar str error: Description of the error, or ``None`` on success.
+    :ivar int line: Line of the error in the template, if known.
+    :ivar int column: Column of the error in the template, if known.
+    """
+
+    __slots__ = ('path', 'time', 'error', 'line', 'column')
+
+    def __init__(self, path, time, error=None, line=None, column=None):
+        self.path = path
+        self.time = time
+        self.error = error
+        self.line = line
+        self.column = column
+
+    def __repr__(self):
+        if self.error is None:
+            return '<PrecompileResult %s %.6fs>' % (self.path, self.time)
+        return '<PrecompileResult %s: %s>' % (self.location(), self.error)
+
+    def location(self):
+        """
+        Returns ``path:line:column``, leaving out what is unknown.
+        """
+        parts = [self.path]
+        if self.line is not None:
+            parts.append(str(self.line))
+            if self.column is not None:
+                parts.append(str(self.column))
+        return ':'.join(parts)
+
+
+def compile_path(job):
+    """
+    Compiles the template file at ``path``, storing the result in
+    ``bytecode_cache`` if one is given. Errors are returned, not raised.
+
+    :param tuple job: ``(path, template_class, bytecode_cache,
+        template_dirs, collapse_whitespace)``; ``template_dirs`` are the
+        directories of the templates included or extended, or ``None`` for
+        the default loader.
+    :rtype: :class:`PrecompileResult`
+    """
+    path, template_class, bytecode_cache, template_dirs, collapse = job
+    start = timer()
+    try:
+        with open(path, 'r') as f:
+            source = f.read()
+        loader = None
+        if template_dirs is not None:
+            from .loader import Loader
+            loader = Loader(template_dirs, collapse_whitespace=collapse)
+        template = template_class(source, path, loader=loader,
+                                  collapse_whitespace=collapse)
+        if bytecode_cache is not None:
+            template.store_bytecode(bytecode_cache)
+    except Exception as e:
+        result = PrecompileResult(
+            path, timer() - start, '%s: %s' % (e.__class__.__name__, e))
+        pos = getattr(e, 'source_pos', None)
+        if pos is not None:
+            result.line, result.column = pos.lineno, pos.colno
+        return result
+    return PrecompileResult(path, timer() - start)
+
+
+def precompile(paths, workers=None, bytecode_cache=None, loader=None):
+    """
+    Compiles many templates at once, spread over ``workers`` processes.
+
+    Compiled templates are stored in ``bytecode_cache``, and then loaded
+    into ``loader`` if one is given. The loader's own bytecode cache is used
+    if no other is given; without any, templates compiled by other
+    processes have to be compiled again to fill the loader.
+
+    :param paths: Template files and directories of template files.
+    :param int workers: Number of processes. Defaults to the number of CPUs;
+        ``1`` compiles in the calling process.
+    :param bytecode_cache: A :class:`rattle.cache.BytecodeCache`.
+    :param loader: A :class:`rattle.loader.Loader`.
+    :returns: A list of :class:`PrecompileResult`, slowest first.
+    """
+    if bytecode_cache is None and loader is not None:
+        bytecode_cache = loader.bytecode_cache
+    template_class = Template if loader is None else loader.template_class
+    # Loaders hold locks, so workers get one of their own
+    template_dirs = None if loader is None else loader.template_dirs
+    collapse = loader is not None and loader.collapse_whitespace
+
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(found for _, found in find_templates([path]))
+        else:
+            files.append(os.path.abspath(path))
+    jobs = [
+        (path, template_class, bytecode_cache, template_dirs, collapse)
+        for path in files
+    ]
+
+    if workers is None:
+        import multiprocessing
+        workers = multiprocessing.cpu_count()
+    if workers > 1 and len(jobs) > 1:
+        import multiprocessing
+        # Build the parsers once, so forked workers inherit them
+        from .parser import parsers
+        parsers.sp
+        parsers.fp
+        pool = multiprocessing.Pool(min(workers, len(jobs)))
+        try:
+            results = pool.map(compile_path, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [compile_path(job) for job in jobs]
+
+    if loader is not None:
+        for result in results:
+            if result.error is None:
+                loader.get_template(result.path)
+
+    results.sort(key=lambda result: result.time, reverse=True)
+    return results
@@ -0,0 +1,78 @@
+class Context(object):
+    """
+    A stack of mappings used as the template context during rendering.
+
+    Lookups search the scopes from the innermost outwards. The mappings passed
+    in are referenced, never copied or written to; all assignments go to the
+    innermost scope, which is a fresh ``dict`` per render or per pushed scope.
+
+    Used as a context manager, :meth:`push` opens a new scope that is
+    discarded again on exit::
+
+        with context.push():
+            context['item'] = value
+    """
+
+    def __init__(self, *maps):
+        self.maps = [{}]
+        self.maps.extend(maps)
+        # The number of mappings that are never written to
+        self._readonly = len(maps)
+
+    def __getitem__(self, key):
+        for m in self.maps:
+            if key in m:
+                return m[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        self.maps[0][key] = value
+
+    def __contains__(self, key):
+        for m in self.maps:
+            if key in m:
+                return True
+        return False
+
+    def get(self, key, default=None):
+        for m in self.maps:
+            if key in m:
+                return m[key]
+        return default
+
+    def replace(self, key, value):
+        """
+        Rebinds ``key`` in the innermost writable scope that defines it. If
+        it is only defined in a read-only mapping, it is shadowed in the
+        render scope instead.
+        """
+        writable = self.maps[:-self._readonly or None]
+        for m in writable:
+            if key in m:
+                m[key] = value
+                return
+        writable[-1][key] = value
+
+    def push(self):
+        self.maps.insert(0, {})
+        return self
+
+    def pop(self):
+        if len(self.maps) <= self._readonly + 1:
+            raise IndexError('pop from the render scope')
+        return self.maps.pop(0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.pop()
+
+    def flatten(self):
+        """
+        Returns a single ``dict`` holding the currently visible values.
+        """
+        flat = {}
+        for m in reversed(self.maps):
+            flat.update(m)
+        return flat
@@ -1,5 +1,7 @@
 import rply
 
+from .structure import StructureLexer
+
 
 __all__ = ('lexers',)
 
@@ -8,7 +10,6 @@ class Lexers(object):
 
     def __init__(self):
         self.flg = rply.LexerGenerator()
-        self.slg = rply.LexerGenerator()
         self._fl = None
         self._sl = None
 
@@ -21,11 +22,10 @@ class Lexers(object):
     @property
     def sl(self):
         if self._sl is None:
-            self._sl = self.slg.build()
+            self._sl = StructureLexer()
         return self._sl
 
 
 lexers = Lexers()
 
 from .filter import flg  # noqa
-from .structure import slg  # noqa
@@ -1,32 +1,135 @@
-from . import lexers
+"""
+Structure lexer.
 
+Splits a template into static text and the contents of ``{{ }}``, ``{% %}``
+and ``{# #}`` blocks. Rather than trying a list of regular expressions at
+every position, the lexer jumps from one ``{`` to the next with
+:meth:`str.find`, so static text of any length (inline scripts and styles
+included) is passed over in a single step.
 
-slg = lexers.slg
+The tokens produced are:
 
-slg.add('VS', r'\{\{\s*')
-slg.add('VE', r'\s*\}\}')
+* ``CONTENT`` for static text, and for the contents of a block
+* ``VS``/``VE``, ``TS``/``TE`` and ``CS``/``CE`` for the start and end of
+  variables, tags and comments. Whitespace inside the delimiters belongs to
+  these tokens.
+* the name of a tag, including the whitespace around it, as a token named
+  after the tag in upper case (``IF``, ``ENDFOR``, ...). Which tags exist
+  is up to the parser.
+"""
+import re
 
-# we cannot add "\s*" here because CONTENT would then be mached instead of e.g.
-# "if" or "for"
-slg.add('TS', r'\{%')
-slg.add('TE', r'\s*%\}')
+from rply import Token
+from rply.errors import LexingError
+from rply.token import SourcePosition
 
-slg.add('CS', r'\{#\s*')
-slg.add('CE', r'\s*#\}')
 
-# Matches everything that is ...
-# * not preceded by a start token (any of ``{{``, ``{%`` or ``{#``) AND
-# * is followed by any of:
-#   * a start token (matches right before a tag/var/comment starts)
-#   * a end token (any of ``}}``, ``%}`` or ``#}``) (everything inside a tag
-#     except the tag name)
-#   * End of string
-slg.add('CONTENT', r'(?<!(\{[{%#])).*?(?=(\{[{%#])|(\s*[#%}]\})|$)')
+# Maps the character following a "{" to the start token, end token and end
+# delimiter of the block it opens
+BLOCKS = {
+    '{': ('VS', 'VE', '}}'),
+    '%': ('TS', 'TE', '%}'),
+    '#': ('CS', 'CE', '#}'),
+}
 
-slg.add('IF', r'\s*if\s+')
-slg.add('ENDIF', r'\s*endif\s+')
-slg.add('ELSE', r'\s*else\s+')
+TAG_NAME = re.compile(r'\s*([a-zA-Z_][a-zA-Z0-9_]*)(?:\s+|(?=%\}))')
 
-slg.add('FOR', r'\s*for\s+')
-slg.add('ENDFOR', r'\s*endfor\s+')
-slg.add('EMPTY', r'\s*empty\s+')
+SPACE = re.compile(r'\s*')
+
+
+class StructureLexer(object):
+    """
+    Produces the structure tokens of a template. Has the same interface as
+    an rply lexer.
+    """
+
+    def lex(self, s):
+        return LexerStream(s)
+
+
+class LexerStream(object):
+    """
+    Iterates over the tokens of the template source ``s``.
+
+    Line and column numbers are updated as the lexer moves forward, so
+    positions cost no more than the newlines passed over.
+    """
+
+    def __init__(self, s):
+        self.s = s
+        self.idx = 0
+        self.lineno = 1
+        # Index of the first character of the current line
+        self.line_start = 0
+        self.tokens = self.scan()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.tokens)
+
+    next = __next__
+
+    def position(self, idx):
+        """
+        Returns the :class:`SourcePosition` of ``idx``, which must not lie
+        before the last position returned.
+        """
+        s = self.s
+        newlines = s.count('\n', self.idx, idx)
+        if newlines:
+            self.lineno += newlines
+            self.line_start = s.rfind('\n', self.idx, idx) + 1
+        self.idx = idx
+        return SourcePosition(idx, self.lineno, idx - self.line_start + 1)
+
+    def token(self, name, start, end):
+        return Token(name, self.s[start:end], self.position(start))
+
+    def find_block(self, pos):
+        """
+        Returns the index of the next block start at or after ``pos``, or the
+        length of the source if there is none.
+        """
+        s = self.s
+        start = s.find('{', pos)
+        while start != -1 and s[start + 1:start + 2] not in BLOCKS:
+            start = s.find('{', start + 1)
+        return len(s) if start == -1 else start
+
+    def scan(self):
+        s = self.s
+        size = len(s)
+        pos = 0
+        while pos < size:
+            start = self.find_block(pos)
+            if start > pos:
+                yield self.token('CONTENT', pos, start)
+            if start == size:
+                return
+
+            start_name, end_name, end_delim = BLOCKS[s[start + 1]]
+            if start_name == 'TS':
+                start_token = self.token(start_name, start, start + 2)
+                yield start_token
+                match = TAG_NAME.match(s, start + 2)
+                if match is None:
+                    raise LexingError('Invalid tag', self.position(start + 2))
+                pos = match.end()
+                yield self.token(match.group(1).upper(), start + 2, pos)
+            else:
+                pos = SPACE.match(s, start + 2).end()
+                start_token = self.token(start_name, start, pos)
+                yield start_token
+
+            end = s.find(end_delim, pos)
+            if end == -1:
+                raise LexingError('Unclosed %s' % start_token.getstr().strip(),
+                                  start_token.getsourcepos())
+            # Trailing whitespace belongs to the end token
+            content_end = pos + len(s[pos:end].rstrip())
+            if content_end > pos:
+                yield self.token('CONTENT', pos, content_end)
+            pos = end + 2
+            yield self.token(end_name, content_end, pos)
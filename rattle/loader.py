@@ -1,25 +1,426 @@
-
 import os
+import posixpath
+import threading
+import time
+from collections import OrderedDict
+from importlib import import_module
 
 from rattle import Template
+from rattle.metrics import count, sinks as metric_sinks
 
 TEMPLATE_DIRS = []
 
+# time.monotonic is not affected by system clock changes, but is only
+# available from Python 3.3
+monotonic = getattr(time, 'monotonic', time.time)
 
-def select_template(templates, template_dirs=None):
-    if template_dirs is None:
-        template_dirs = TEMPLATE_DIRS
-    if isinstance(templates, str):
-        templates = [templates]
-    for template in templates:
-        for tdir in template_dirs:
-            full_path = os.path.abspath(os.path.join(tdir, template))
-            if not full_path.startswith(tdir):
-                raise ValueError('Suspicious template name: %s [%s]' % (template, tdir))
-            try:
-                src = open(os.path.join(tdir, template), 'r').read()
-            except IOError:
-                pass
+# Default seconds between checks of the directories of a TemplateIndex
+INDEX_CHECK_INTERVAL = 2
+
+
+class TemplateNotFound(ValueError):
+    pass
+
+
+def scan_dir(path):
+    """
+    Returns ``(name, is_dir)`` pairs for the entries of the directory
+    ``path``, using :func:`os.scandir` where available.
+    """
+    if hasattr(os, 'scandir'):
+        return [(entry.name, entry.is_dir()) for entry in os.scandir(path)]
+    return [
+        (name, os.path.isdir(os.path.join(path, name)))
+        for name in os.listdir(path)
+    ]
+
+
+def normalize_name(template):
+    """
+    Returns the template name in the form used as index key, raising
+    ``ValueError`` for names that would escape the template directories.
+    """
+    name = posixpath.normpath(template.replace(os.sep, '/'))
+    if name == '..' or name.startswith('../') or posixpath.isabs(name):
+        raise ValueError('Suspicious template name: %s' % template)
+    return name
+
+
+class TemplateIndex(object):
+    """
+    Maps template names to the path of the file that wins resolution across
+    ``template_dirs``, so finding a template does not probe every directory.
+
+    The index is built by scanning the directories once. Every
+    ``check_interval`` seconds the modification times of all scanned
+    directories are compared with those seen during the scan, and the index
+    is rebuilt if any changed (a file was added, removed or renamed). ``0``
+    checks on every lookup, ``None`` never. As a check stats every scanned
+    directory, it defaults to :data:`INDEX_CHECK_INTERVAL`.
+
+    Symlinked directories are followed, except those leading back to a
+    directory they are in.
+
+    Names that are not in the index are answered without any system call,
+    so the index also serves as a negative cache.
+    """
+
+    def __init__(self, template_dirs, check_interval=INDEX_CHECK_INTERVAL):
+        self.template_dirs = list(template_dirs)
+        self.check_interval = check_interval
+        self.paths = {}
+        self.dir_mtimes = {}
+        self.checked = None
+        self.rebuild()
+
+    def rebuild(self):
+        paths = {}
+        dir_mtimes = {}
+        for tdir in self.template_dirs:
+            self._scan(os.path.abspath(tdir), '', paths, dir_mtimes, ())
+        self.paths, self.dir_mtimes = paths, dir_mtimes
+        self.checked = monotonic()
+
+    def _scan(self, path, prefix, paths, dir_mtimes, parents):
+        """
+        :param parents: ``(st_dev, st_ino)`` of the directories ``path`` is
+            in, so symlink loops are not followed.
+        """
+        try:
+            stat = os.stat(path)
+            entries = scan_dir(path)
+        except OSError:
+            return
+        dir_id = (stat.st_dev, stat.st_ino)
+        if dir_id in parents:
+            return
+        dir_mtimes[path] = stat.st_mtime
+        parents += (dir_id,)
+        for name, is_dir in entries:
+            full_path = os.path.join(path, name)
+            if is_dir:
+                self._scan(full_path, prefix + name + '/', paths, dir_mtimes,
+                           parents)
             else:
-                return Template(src, full_path)
-    raise ValueError('Not Found')
+                paths.setdefault(prefix + name, full_path)
+
+    def refresh(self):
+        """
+        Rebuilds the index if any of the scanned directories changed.
+        """
+        if self.check_interval is None:
+            return
+        now = monotonic()
+        if now - self.checked < self.check_interval:
+            return
+        for path, mtime in self.dir_mtimes.items():
+            try:
+                changed = os.stat(path).st_mtime != mtime
+            except OSError:
+                changed = True
+            if changed:
+                self.rebuild()
+                return
+        self.checked = now
+
+    def find(self, templates):
+        """
+        Returns the full path of the first of ``templates`` in the index.
+        """
+        if isinstance(templates, str):
+            templates = [templates]
+        self.refresh()
+        for template in templates:
+            path = self.paths.get(normalize_name(template))
+            if path is not None:
+                return path
+        raise TemplateNotFound('Not Found')
+
+
+class PendingCompile(object):
+    """
+    A template being compiled by one thread that others are waiting for.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.template = None
+        self.error = None
+
+
+class CacheEntry(object):
+
+    __slots__ = ('template', 'mtime', 'size', 'checked', 'dependencies')
+
+    def __init__(self, template, mtime, size, checked, dependencies=()):
+        self.template = template
+        self.mtime = mtime
+        self.size = size
+        self.checked = checked
+        # ``(path, mtime, size)`` of the templates compiled into this one
+        self.dependencies = dependencies
+
+
+class Loader(object):
+    """
+    Finds templates in a list of directories and keeps the compiled
+    templates in memory, keyed by their resolved path.
+
+    :param template_dirs: Directories to search, in order. Defaults to
+        :data:`TEMPLATE_DIRS` at lookup time.
+    :param int max_size: If given, at most this many templates are kept; the
+        least recently used are evicted first.
+    :param check_interval: Seconds after which a cached template is checked
+        against its file's modification time and size, and recompiled if
+        the file changed. ``0`` checks on every lookup, ``None`` never.
+    :param bytecode_cache: A :class:`rattle.cache.BytecodeCache` passed on to
+        the templates.
+    :param bool use_index: Resolve names through a :class:`TemplateIndex`
+        of the template directories instead of probing each directory.
+    :param index_check_interval: Seconds after which the index checks the
+        template directories for changes, see :class:`TemplateIndex`.
+    :param bool collapse_whitespace: Compile the templates with whitespace
+        collapsed, see :class:`rattle.template.Template`.
+    :param profiler: Compile the templates instrumented for this
+        :class:`rattle.profiler.Profiler`.
+
+    When several threads miss on the same template at once, one compiles it
+    and the others wait for the result.
+    """
+
+    template_class = Template
+
+    def __init__(self, template_dirs=None, max_size=None, check_interval=0,
+                 bytecode_cache=None, use_index=False,
+                 index_check_interval=INDEX_CHECK_INTERVAL,
+                 collapse_whitespace=False, profiler=None):
+        self.template_dirs = template_dirs
+        self.max_size = max_size
+        self.check_interval = check_interval
+        self.bytecode_cache = bytecode_cache
+        self.use_index = use_index
+        self.index_check_interval = index_check_interval
+        self.collapse_whitespace = collapse_whitespace
+        self.profiler = profiler
+        self._indexes = {}
+        self._cache = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def find_template(self, templates, template_dirs=None):
+        """
+        Returns the full path of the first of ``templates`` found in the
+        template directories.
+        """
+        if template_dirs is None:
+            template_dirs = self.template_dirs
+        if template_dirs is None:
+            template_dirs = TEMPLATE_DIRS
+        if self.use_index:
+            return self.get_index(template_dirs).find(templates)
+        if isinstance(templates, str):
+            templates = [templates]
+        for template in templates:
+            for tdir in template_dirs:
+                full_path = os.path.abspath(os.path.join(tdir, template))
+                if not full_path.startswith(os.path.join(os.path.abspath(tdir), '')):
+                    raise ValueError('Suspicious template name: %s [%s]' % (template, tdir))
+                if os.path.isfile(full_path):
+                    return full_path
+        raise TemplateNotFound('Not Found')
+
+    def get_index(self, template_dirs):
+        """
+        Returns the :class:`TemplateIndex` of ``template_dirs``, building it
+        on first use.
+        """
+        key = tuple(template_dirs)
+        index = self._indexes.get(key)
+        if index is None:
+            with self._lock:
+                index = self._indexes.get(key)
+                if index is None:
+                    index = self._indexes[key] = TemplateIndex(
+                        key, self.index_check_interval)
+        return index
+
+    def select_template(self, templates, template_dirs=None):
+        """
+        Returns the compiled template for the first of ``templates`` found in
+        the template directories.
+        """
+        return self.get_template(self.find_template(templates, template_dirs))
+
+    def get_source(self, name, template_dirs=None):
+        """
+        Returns the source of the template ``name`` and the path it was read
+        from, for templates compiled into others.
+        """
+        path = self.find_template(name, template_dirs)
+        with open(path, 'r') as f:
+            return f.read(), path
+
+    def get_template(self, path):
+        """
+        Returns the compiled template for the file at ``path``, from the cache
+        if it is there and fresh.
+        """
+        entry = self._cache.get(path)
+        if entry is not None and self._is_fresh(path, entry):
+            if self.max_size is not None:
+                with self._lock:
+                    if path in self._cache:
+                        self._cache[path] = self._cache.pop(path)
+            if metric_sinks:
+                count('loader_hit', path)
+            return entry.template
+        if metric_sinks:
+            count('loader_miss', path)
+
+        with self._lock:
+            pending = self._pending.get(path)
+            owner = pending is None
+            if owner:
+                pending = self._pending[path] = PendingCompile()
+
+        if not owner:
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.template
+
+        try:
+            entry = self._load(path)
+            pending.template = entry.template
+        except Exception as e:
+            pending.error = e
+            raise
+        else:
+            with self._lock:
+                self._cache.pop(path, None)
+                self._cache[path] = entry
+                if self.max_size is not None:
+                    while len(self._cache) > self.max_size:
+                        self._cache.popitem(last=False)
+            return entry.template
+        finally:
+            with self._lock:
+                del self._pending[path]
+            pending.done.set()
+
+    def clear(self):
+        """
+        Drops all cached templates and directory indexes.
+        """
+        with self._lock:
+            self._cache.clear()
+            self._indexes.clear()
+
+    def _load(self, path):
+        stat = os.stat(path)
+        with open(path, 'r') as f:
+            src = f.read()
+        template = self.template_class(
+            src, path, bytecode_cache=self.bytecode_cache, loader=self,
+            collapse_whitespace=self.collapse_whitespace,
+            profiler=self.profiler)
+        dependencies = []
+        for _, dep_path, _ in template.dependencies:
+            try:
+                dep_stat = os.stat(dep_path)
+            except OSError:
+                dep_stat = None
+            dependencies.append((
+                dep_path,
+                dep_stat and dep_stat.st_mtime,
+                dep_stat and dep_stat.st_size,
+            ))
+        return CacheEntry(template, stat.st_mtime, stat.st_size, monotonic(),
+                          dependencies)
+
+    def _is_fresh(self, path, entry):
+        if self.check_interval is None:
+            return True
+        now = monotonic()
+        if now - entry.checked < self.check_interval:
+            return True
+        # Templates compiled into this one count as part of it
+        files = [(path, entry.mtime, entry.size)]
+        files.extend(entry.dependencies)
+        for file_path, mtime, size in files:
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                return False
+            if stat.st_mtime != mtime or stat.st_size != size:
+                return False
+        entry.checked = now
+        return True
+
+
+class PrecompiledLoader(object):
+    """
+    Loads templates compiled ahead of time by :mod:`rattle.compiler` from
+    the package ``package``, by name. Template sources are never lexed or
+    parsed, so rply is not imported.
+
+    The module of a template is only imported on first use.
+
+    :param str package: The dotted name of the package.
+    """
+
+    template_class = Template
+
+    def __init__(self, package):
+        self.package = package
+        self.modules = import_module(package).TEMPLATES
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def find_template(self, templates):
+        """
+        Returns the name of the first of ``templates`` that was compiled.
+        """
+        if isinstance(templates, str):
+            templates = [templates]
+        for template in templates:
+            name = normalize_name(template)
+            if name in self.modules:
+                return name
+        raise TemplateNotFound('Not Found')
+
+    def select_template(self, templates):
+        """
+        Returns the template for the first of ``templates`` that was
+        compiled.
+        """
+        return self.get_template(self.find_template(templates))
+
+    def get_source(self, name):
+        """
+        Returns the source of the template ``name`` and its name, for
+        templates compiled into others at render time.
+        """
+        name = self.find_template(name)
+        return self.get_template(name).source, name
+
+    def get_template(self, name):
+        template = self._cache.get(name)
+        if metric_sinks:
+            count('loader_miss' if template is None else 'loader_hit', name)
+        if template is None:
+            with self._lock:
+                template = self._cache.get(name)
+                if template is None:
+                    module = import_module(
+                        '%s.%s' % (self.package, self.modules[name]))
+                    template = self._cache[name] = \
+                        self.template_class.from_module(module, self)
+        return template
+
+
+loader = Loader()
+
+
+def select_template(templates, template_dirs=None):
+    return loader.select_template(templates, template_dirs)
@@ -0,0 +1,173 @@
+"""
+Metrics of compiling, loading and rendering templates.
+
+Templates and loaders report to the sinks registered with
+:func:`add_sink`:
+
+================  =========  ===============================================
+Name              Kind       Reported
+================  =========  ===============================================
+``compile_time``  histogram  Seconds taken to compile a template
+``loader_hit``    counter    A loader returned a template from its cache
+``loader_miss``   counter    A loader had to compile or import a template
+``render_time``   histogram  Seconds a render took
+``output_size``   histogram  Characters a render produced
+``render_error``  counter    A render raised an exception
+================  =========  ===============================================
+
+Every event names the template by its origin, which is its path for
+templates read by a :class:`rattle.loader.Loader`, or ``None``.
+
+Render times only count the time the template itself runs: when output is
+streamed, the time the caller takes to handle each chunk is left out.
+
+With no sink registered, templates and loaders only check that the list of
+sinks is empty.
+"""
+import threading
+import time
+from collections import defaultdict, namedtuple
+
+# Highest resolution clock available
+timer = getattr(time, 'perf_counter', time.time)
+
+#: The registered sinks. Changed in place, as modules keep references to it.
+sinks = []
+
+# Matches all templates in :class:`MemorySink` queries
+ANY = object()
+
+
+def add_sink(sink):
+    """
+    Registers ``sink`` to receive all events.
+    """
+    if sink not in sinks:
+        sinks.append(sink)
+    return sink
+
+
+def remove_sink(sink):
+    """
+    Stops sending events to ``sink``.
+    """
+    if sink in sinks:
+        sinks.remove(sink)
+
+
+def count(name, template, value=1):
+    """
+    Adds ``value`` to the counter ``name`` of all sinks.
+    """
+    for sink in sinks:
+        sink.count(name, value, template)
+
+
+def observe(name, template, value):
+    """
+    Adds ``value`` to the histogram ``name`` of all sinks.
+    """
+    for sink in sinks:
+        sink.observe(name, value, template)
+
+
+def measure_render(template, chunks):
+    """
+    Yields the output ``chunks`` of a render of ``template``, reporting the
+    time taken to produce them, their total size, or the error raised.
+    """
+    chunks = iter(chunks)
+    elapsed = 0.0
+    size = 0
+    while True:
+        start = timer()
+        try:
+            chunk = next(chunks)
+        except StopIteration:
+            break
+        except Exception:
+            count('render_error', template)
+            raise
+        finally:
+            elapsed += timer() - start
+        size += len(chunk)
+        yield chunk
+    observe('render_time', template, elapsed)
+    observe('output_size', template, size)
+
+
+class Sink(object):
+    """
+    Base class for sinks, which receive the events of :data:`sinks`.
+    Subclasses override the methods for the events they record.
+    """
+
+    def count(self, name, value, template):
+        """
+        Adds ``value`` to the counter ``name`` of ``template``.
+        """
+
+    def observe(self, name, value, template):
+        """
+        Adds the sample ``value`` to the histogram ``name`` of ``template``.
+        """
+
+
+class Summary(namedtuple('Summary', 'count total min max')):
+    """
+    Aggregate of the samples of a histogram.
+    """
+
+    @property
+    def mean(self):
+        return self.total / float(self.count) if self.count else 0.0
+
+
+class MemorySink(Sink):
+    """
+    Keeps all events in memory, for tests and debugging.
+    """
+
+    def __init__(self):
+        self.counters = defaultdict(int)
+        self.samples = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def count(self, name, value, template):
+        with self._lock:
+            self.counters[name, template] += value
+
+    def observe(self, name, value, template):
+        with self._lock:
+            self.samples[name, template].append(value)
+
+    def counter(self, name, template=ANY):
+        """
+        Returns the counter ``name`` of ``template``, or of all templates.
+        """
+        with self._lock:
+            return sum(
+                value for (key, origin), value in self.counters.items()
+                if key == name and (template is ANY or origin == template)
+            )
+
+    def histogram(self, name, template=ANY):
+        """
+        Returns the :class:`Summary` of the histogram ``name`` of
+        ``template``, or of all templates.
+        """
+        with self._lock:
+            values = [
+                value
+                for (key, origin), samples in self.samples.items()
+                if key == name and (template is ANY or origin == template)
+                for value in samples
+            ]
+        if not values:
+            return Summary(0, 0, None, None)
+        return Summary(len(values), sum(values), min(values), max(values))
+
+    def clear(self):
+        with self._lock:
+            self.counters.clear()
+            self.samples.clear()
@@ -0,0 +1,514 @@
+"""
+Optimisation passes run over the AST of a template's ``root`` function before
+it is compiled.
+"""
+import ast
+
+from rattle import PY3
+
+
+MISSING_NAME = 'missing'
+
+# The function rendering templates included at render time
+INCLUDE_NAME = 'include_template'
+
+# Context variables whose values are fixed by ``Template.default_context``
+CONSTANT_NAMES = {
+    'True': True,
+    'False': False,
+    'None': None,
+}
+
+# Folded expressions producing longer strings are left to render time
+FOLD_MAX_LENGTH = 4096
+
+if PY3:
+    STRING_TYPES = (str,)
+    INTEGER_TYPES = (int,)
+    NUMBER_TYPES = (int, float)
+else:
+    STRING_TYPES = (str, unicode)  # noqa: F821
+    INTEGER_TYPES = (int, long)  # noqa: F821
+    NUMBER_TYPES = (int, long, float)  # noqa: F821
+
+SEQUENCE_TYPES = STRING_TYPES + (bytes, list, tuple)
+
+
+class Missing(object):
+    """
+    Type of the sentinel bound to the ``missing`` global of compiled
+    templates, marking hoisted values that have not been loaded yet.
+    """
+
+    def __repr__(self):
+        return '<missing>'
+
+
+missing = Missing()
+
+
+def context_lookup_name(node):
+    """
+    Returns the variable name if ``node`` is a ``context['name']`` lookup,
+    ``None`` otherwise.
+    """
+    if not isinstance(node, ast.Subscript):
+        return None
+    if not isinstance(node.value, ast.Name) or node.value.id != 'context':
+        return None
+    if not isinstance(node.slice, ast.Index):
+        return None
+    if not isinstance(node.slice.value, ast.Str):
+        return None
+    return node.slice.value.s
+
+
+def is_scope(node):
+    """
+    Returns ``True`` if ``node`` is a ``with context.push():`` statement as
+    built by :func:`rattle.utils.parser.build_scope`.
+    """
+    if not isinstance(node, ast.With):
+        return False
+    items = getattr(node, 'items', None)
+    expr = items[0].context_expr if items else node.context_expr
+    if not isinstance(expr, ast.Call):
+        return False
+    func = expr.func
+    if not isinstance(func, ast.Attribute) or func.attr != 'push':
+        return False
+    return isinstance(func.value, ast.Name) and func.value.id == 'context'
+
+
+def unconditional_names(node, names):
+    """
+    Adds the context variables ``node`` always looks up when it is evaluated
+    to the list ``names``, in order of appearance. The right hand operands of
+    ``and`` / ``or`` are skipped, as they may not be evaluated.
+    """
+    name = context_lookup_name(node)
+    if name is not None:
+        if isinstance(node.ctx, ast.Load) and name not in names:
+            names.append(name)
+        return
+    if isinstance(node, ast.BoolOp):
+        unconditional_names(node.values[0], names)
+        return
+    for child in ast.iter_child_nodes(node):
+        unconditional_names(child, names)
+
+
+def block_names(stmts):
+    """
+    Returns the context variables that are looked up whenever the block of
+    statements ``stmts`` is run, leaving out those used only in nested
+    blocks.
+    """
+    names = []
+    for stmt in stmts:
+        if is_scope(stmt):
+            names.extend(n for n in block_names(stmt.body) if n not in names)
+        elif isinstance(stmt, ast.For):
+            unconditional_names(stmt.iter, names)
+        elif isinstance(stmt, ast.If):
+            unconditional_names(stmt.test, names)
+        else:
+            unconditional_names(stmt, names)
+    return names
+
+
+def is_include(node):
+    """
+    Returns ``True`` if ``node`` is a call of the function rendering
+    templates included at render time.
+    """
+    if not isinstance(node, ast.Call):
+        return False
+    return isinstance(node.func, ast.Name) and node.func.id == INCLUDE_NAME
+
+
+class LocalsRewriter(ast.NodeTransformer):
+    """
+    Replaces ``context['name']`` lookups with the local variables ``scope``
+    maps the names to.
+
+    Templates included at render time only see the context, so the loop
+    variables among the locals (``loop_locals``) are passed to them.
+    """
+
+    def __init__(self, scope, loop_locals=()):
+        self.scope = scope
+        self.loop_locals = loop_locals
+
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        if is_include(node):
+            bindings = node.args[-1]
+            for name, local in sorted(self.scope.items()):
+                if local in self.loop_locals:
+                    bindings.keys.append(ast.Str(s=name))
+                    bindings.values.append(ast.Name(id=local, ctx=ast.Load()))
+        return node
+
+    def visit_Subscript(self, node):
+        name = context_lookup_name(node)
+        if name in self.scope and isinstance(node.ctx, ast.Load):
+            return ast.copy_location(
+                ast.Name(id=self.scope[name], ctx=ast.Load()),
+                node
+            )
+        self.generic_visit(node)
+        return node
+
+
+class LookupHoister(object):
+    """
+    Moves context lookups into function locals.
+
+    * Loop targets become locals of their own (``l<n>_<name>``) instead of
+      being stored in a context scope.
+    * A context variable that is looked up every time a block runs is loaded
+      into a local (``v_<name>``) once, at the start of that block. Inside a
+      loop the load is guarded, so it happens on the first iteration only.
+
+    Variables only used in code that may not run are not loaded early, so a
+    missing variable still only raises where it is actually used.
+    """
+
+    def __init__(self):
+        self.loop_count = 0
+        self.guarded = []
+        self.loop_locals = set()
+
+    def hoist(self, func):
+        """
+        Rewrites the body of the function definition ``func`` in place.
+        """
+        body = self.block(func.body, {}, False)
+        prelude = [
+            ast.Assign(
+                targets=[ast.Name(id=local, ctx=ast.Store())],
+                value=ast.Name(id=MISSING_NAME, ctx=ast.Load()),
+            )
+            for local in self.guarded
+        ]
+        func.body = prelude + body
+        return func
+
+    def block(self, stmts, scope, in_loop):
+        scope = dict(scope)
+        loads = []
+        for name in block_names(stmts):
+            if name in scope:
+                continue
+            local = scope[name] = 'v_%s' % name
+            load = ast.Assign(
+                targets=[ast.Name(id=local, ctx=ast.Store())],
+                value=ast.Subscript(
+                    value=ast.Name(id='context', ctx=ast.Load()),
+                    slice=ast.Index(value=ast.Str(s=name)),
+                    ctx=ast.Load(),
+                ),
+            )
+            if in_loop:
+                if local not in self.guarded:
+                    self.guarded.append(local)
+                load = ast.If(
+                    test=ast.Compare(
+                        left=ast.Name(id=local, ctx=ast.Load()),
+                        ops=[ast.Is()],
+                        comparators=[
+                            ast.Name(id=MISSING_NAME, ctx=ast.Load())
+                        ],
+                    ),
+                    body=[load],
+                    orelse=[],
+                )
+            loads.append(load)
+
+        # Nested blocks are hoisted from this loop rather than from a method
+        # per statement, so each level of nesting only takes one stack frame
+        body = []
+        pending = list(reversed(stmts))
+        while pending:
+            stmt = pending.pop()
+            if is_scope(stmt):
+                # Loop targets become locals, so the context scope is not needed
+                pending.extend(reversed(stmt.body))
+            elif isinstance(stmt, ast.For):
+                stmt.iter = self.rewrite(stmt.iter, scope)
+                name = context_lookup_name(stmt.target)
+                inner_scope = scope
+                if name is not None:
+                    local = 'l%d_%s' % (self.loop_count, name)
+                    self.loop_count += 1
+                    self.loop_locals.add(local)
+                    stmt.target = ast.copy_location(
+                        ast.Name(id=local, ctx=ast.Store()),
+                        stmt.target
+                    )
+                    inner_scope = dict(scope)
+                    inner_scope[name] = local
+                stmt.body = self.block(stmt.body, inner_scope, True)
+                stmt.orelse = self.block(stmt.orelse, scope, in_loop)
+                body.append(stmt)
+            elif isinstance(stmt, ast.If):
+                stmt.test = self.rewrite(stmt.test, scope)
+                stmt.body = self.block(stmt.body, scope, in_loop)
+                stmt.orelse = self.block(stmt.orelse, scope, in_loop)
+                body.append(stmt)
+            else:
+                body.append(self.rewrite(stmt, scope))
+        return loads + body
+
+    def rewrite(self, node, scope):
+        return LocalsRewriter(scope, self.loop_locals).visit(node)
+
+
+def hoist_lookups(func):
+    """
+    Runs the :class:`LookupHoister` over the function definition ``func``.
+    """
+    return LookupHoister().hoist(func)
+
+
+def build_constant(value):
+    """
+    Constructs an AST node for the constant ``value``.
+
+    :returns: An :class:`ast.Str`, :class:`ast.Num` or constant name node, or
+        ``None`` if ``value`` is of a type that cannot be represented
+        exactly.
+    """
+    if value is None or value is True or value is False:
+        if hasattr(ast, 'NameConstant'):
+            return ast.NameConstant(value=value)
+        return ast.Name(id=repr(value), ctx=ast.Load())
+    if type(value) in NUMBER_TYPES:
+        return ast.Num(n=value)
+    if type(value) in STRING_TYPES:
+        return ast.Str(s=value)
+    return None
+
+
+def is_constant(node):
+    if isinstance(node, (ast.Str, ast.Num)):
+        return True
+    if hasattr(ast, 'NameConstant') and isinstance(node, ast.NameConstant):
+        return True
+    return isinstance(node, ast.Name) and node.id in CONSTANT_NAMES
+
+
+def constant_value(node):
+    if isinstance(node, ast.Name):
+        return CONSTANT_NAMES[node.id]
+    return ast.literal_eval(node)
+
+
+def is_output(node):
+    """
+    Returns ``True`` if ``node`` is a call of the output escaping function.
+    """
+    if not isinstance(node, ast.Call):
+        return False
+    return isinstance(node.func, ast.Name) and node.func.id == 'auto_escape'
+
+
+def is_static_yield(stmt):
+    if not isinstance(stmt, ast.Expr) or not isinstance(stmt.value, ast.Yield):
+        return False
+    return isinstance(stmt.value.value, ast.Str)
+
+
+# Expression nodes that are pure if all their children are
+PURE_NODES = (
+    ast.BinOp, ast.BoolOp, ast.Compare, ast.UnaryOp, ast.Call,
+    ast.Attribute, ast.Subscript, ast.Index, ast.keyword,
+    ast.operator, ast.boolop, ast.cmpop, ast.unaryop, ast.expr_context,
+)
+
+
+def folded_too_large(node):
+    """
+    Returns ``True`` if ``node`` repeats a sequence into one longer than
+    :data:`FOLD_MAX_LENGTH`, estimating the length from the operands so the
+    result is never built. Repetitions of operands that could not be folded
+    are not folded either.
+    """
+    if not isinstance(node, ast.BinOp) or not isinstance(node.op, ast.Mult):
+        return False
+    if not (is_constant(node.left) and is_constant(node.right)):
+        return True
+    left, right = constant_value(node.left), constant_value(node.right)
+    if isinstance(left, INTEGER_TYPES):
+        left, right = right, left
+    if not isinstance(left, SEQUENCE_TYPES) or not isinstance(right, INTEGER_TYPES):
+        return False
+    return len(left) * right > FOLD_MAX_LENGTH
+
+
+class ConstantFolder(ast.NodeTransformer):
+    """
+    Evaluates expressions whose values are fixed at compile time.
+
+    An expression is folded when it only consists of literals, the constant
+    context variables ``True``, ``False`` and ``None``, and calls to the
+    functions in ``namespace`` (the output escaping function and the filters
+    used by the template), and evaluating it yields a string, number, boolean
+    or ``None``. Expressions that raise, and those that may build values
+    too large to keep in the compiled template, are left for render time.
+
+    :param dict namespace: Globals that may be called at compile time.
+    """
+
+    def __init__(self, namespace):
+        self.namespace = namespace
+        self.pure = set()
+
+    def generic_visit(self, node):
+        # Children are folded here rather than in an overridden visit, which
+        # would add a stack frame per level of nesting
+        for field, value in ast.iter_fields(node):
+            if isinstance(value, list):
+                for i, child in enumerate(value):
+                    if isinstance(child, ast.AST):
+                        value[i] = self.fold(self.visit(child))
+            elif isinstance(value, ast.AST):
+                setattr(node, field, self.fold(self.visit(value)))
+        return node
+
+    def visit_block(self, stmts):
+        """
+        Folds the expressions in the statements ``stmts``, in place.
+
+        Nested statements are walked with a stack of their own rather than
+        by recursion, so deeply nested blocks do not use up the stack.
+        """
+        stack = list(stmts)
+        while stack:
+            stmt = stack.pop()
+            for field, value in ast.iter_fields(stmt):
+                if isinstance(value, list):
+                    for i, child in enumerate(value):
+                        if isinstance(child, ast.stmt):
+                            stack.append(child)
+                        elif isinstance(child, ast.AST):
+                            value[i] = self.fold(self.visit(child))
+                elif isinstance(value, ast.AST):
+                    setattr(stmt, field, self.fold(self.visit(value)))
+        return stmts
+
+    def fold(self, node):
+        """
+        Returns the constant ``node`` evaluates to, or ``node`` itself if it
+        cannot be folded. Its children are folded already.
+        """
+        if not isinstance(node, ast.expr) or is_constant(node):
+            return node
+        if not self.is_pure(node) or folded_too_large(node):
+            return node
+        expr = ast.Expression(body=node)
+        ast.fix_missing_locations(expr)
+        try:
+            value = eval(
+                compile(expr, filename='<template>', mode='eval'),
+                dict(self.namespace)
+            )
+        except Exception:
+            return node
+        if isinstance(value, STRING_TYPES):
+            if len(value) > FOLD_MAX_LENGTH:
+                return node
+            if type(value) not in STRING_TYPES:
+                # Subclasses such as SafeData only matter until the output is
+                # escaped, so only the escaped result is folded.
+                if not is_output(node):
+                    return node
+                for string_type in STRING_TYPES:
+                    if isinstance(value, string_type):
+                        value = string_type(value)
+        constant = build_constant(value)
+        if constant is None:
+            return node
+        return ast.copy_location(constant, node)
+
+    def visit_Subscript(self, node):
+        name = context_lookup_name(node)
+        if name in CONSTANT_NAMES and isinstance(node.ctx, ast.Load):
+            return ast.copy_location(
+                build_constant(CONSTANT_NAMES[name]),
+                node
+            )
+        self.generic_visit(node)
+        return node
+
+    def is_pure(self, node):
+        if is_constant(node):
+            return True
+        if isinstance(node, ast.Name):
+            return node.id in self.namespace
+        if not isinstance(node, PURE_NODES):
+            return False
+        return all(self.is_pure(child) for child in ast.iter_child_nodes(node))
+
+
+def fold_block(stmts):
+    """
+    Drops branches of ``if`` statements with constant conditions, merges
+    adjacent static yields and drops empty ones.
+    """
+    body = []
+    for stmt in stmts:
+        if isinstance(stmt, ast.If) and is_constant(stmt.test):
+            branch = stmt.body if constant_value(stmt.test) else stmt.orelse
+            for inner in fold_block(branch):
+                append_folded(body, inner)
+            continue
+        if isinstance(stmt, ast.If):
+            stmt.body = fold_block(stmt.body) or [ast.Pass()]
+            stmt.orelse = fold_block(stmt.orelse)
+        elif isinstance(stmt, ast.For):
+            stmt.body = fold_block(stmt.body) or [ast.Pass()]
+            stmt.orelse = fold_block(stmt.orelse)
+        elif isinstance(stmt, ast.With):
+            stmt.body = fold_block(stmt.body) or [ast.Pass()]
+        append_folded(body, stmt)
+    return body
+
+
+def append_folded(body, stmt):
+    if is_static_yield(stmt):
+        if not stmt.value.value.s:
+            return
+        if body and is_static_yield(body[-1]):
+            previous = body[-1].value.value
+            previous.s = previous.s + stmt.value.value.s
+            return
+    body.append(stmt)
+
+
+def fold_constants(func, namespace):
+    """
+    Folds constant expressions and static output in the body of the
+    ``root`` function definition ``func``, in place.
+
+    The function always keeps at least one ``yield``, so it remains a
+    generator.
+
+    :param dict namespace: Globals that may be called at compile time.
+    """
+    folder = ConstantFolder(namespace)
+    func.body = fold_block(folder.visit_block(func.body))
+    if not any(isinstance(node, ast.Yield) for node in ast.walk(func)):
+        func.body.append(ast.Expr(value=ast.Yield(value=ast.Str(s=''))))
+    return func
+
+
+def static_text(func):
+    """
+    Returns the output of the ``root`` function definition ``func`` if it
+    only yields static text, ``None`` otherwise.
+    """
+    if all(is_static_yield(stmt) for stmt in func.body):
+        return ''.join(stmt.value.value.s for stmt in func.body)
+    return None
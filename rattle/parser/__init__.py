@@ -1,52 +1,170 @@
+import errno
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
 import rply
 
+import rattle
+from ..cache import CacheInfo
 from ..lexer import lexers
 
 
 __all__ = ('parsers',)
 
+#: Compile expressions with Python's own parser, see
+#: :mod:`rattle.parser.expression`
+PYTHON_EXPRESSIONS = bool(os.environ.get('RATTLE_PYTHON_EXPRESSIONS', False))
+
+#: Number of compiled expressions kept by :data:`parsers`, ``0`` disables
+#: the cache
+EXPRESSION_CACHE_SIZE = int(
+    os.environ.get('RATTLE_EXPRESSION_CACHE_SIZE', 1000))
+
+
+def build_parser(generator):
+    """
+    Builds the parser of ``generator``.
+
+    Generating the LR tables is by far the slowest part of the first
+    compile in a process. rply keeps the tables in a file named after the
+    generator's ``cache_id`` and a hash of the grammar, and only reuses them
+    if they match the grammar. Where the file lives depends on the rply
+    version: older releases use the temporary directory, newer ones the
+    user's cache directory.
+
+    Older releases also create the file exclusively, so a process building
+    the tables at the same time as another fails; it then reads the other's
+    tables.
+    """
+    try:
+        return generator.build()
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    except ValueError:
+        # The tables were read while being written
+        pass
+    time.sleep(0.05)
+    return generator.build()
+
+
+def cache_id(name):
+    # Tables are regenerated on upgrades even if the grammar hash matches
+    return 'rattle-%s-%s' % (rattle.__version__, name)
+
+
+class ExpressionCache(object):
+    """
+    Compiled template expressions, keyed by their source. The same
+    expressions, like ``user.name``, appear over and over across templates.
+
+    Each lookup returns a new copy of the AST, as compiling a template
+    changes its nodes. Entries are kept pickled, which is much faster to
+    copy from than a tree of nodes.
+
+    :param int max_size: At most this many expressions are kept; the least
+        recently used are evicted first.
+    """
+
+    def __init__(self, max_size=EXPRESSION_CACHE_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, source, parse):
+        """
+        Returns the AST of the expression ``source``, compiled with
+        ``parse(source)`` on a miss.
+        """
+        data = self._cache.get(source)
+        if data is not None:
+            with self._lock:
+                self.hits += 1
+                if source in self._cache:
+                    self._cache[source] = self._cache.pop(source)
+            return pickle.loads(data)
+
+        node = parse(source)
+        with self._lock:
+            self.misses += 1
+            if self.max_size:
+                self._cache.pop(source, None)
+                self._cache[source] = pickle.dumps(node, -1)
+                while len(self._cache) > self.max_size:
+                    self._cache.popitem(last=False)
+        return node
+
+    def info(self):
+        """
+        Returns the :class:`CacheInfo` of the cache, to help size it.
+        """
+        return CacheInfo(self.hits, self.misses, self.max_size,
+                         len(self._cache))
+
+    def clear(self):
+        """
+        Drops all entries and resets the statistics.
+        """
+        with self._lock:
+            self._cache.clear()
+            self.hits = 0
+            self.misses = 0
+
 
 class Parsers(object):
 
     def __init__(self):
         self._fpg = None
         self._fp = None
-        self._spg = None
         self._sp = None
+        self.python_expressions = PYTHON_EXPRESSIONS
+        self.expression_cache = ExpressionCache()
 
     @property
     def fpg(self):
         if self._fpg is None:
             self._fpg = rply.ParserGenerator(
                 [rule.name for rule in lexers.flg.rules],
-                precedence=[]
+                precedence=[],
+                cache_id=cache_id('filter')
             )
         return self._fpg
 
     @property
     def fp(self):
         if self._fp is None:
-            self._fp = self.fpg.build()
+            self._fp = build_parser(self.fpg)
         return self._fp
 
-    @property
-    def spg(self):
-        if self._spg is None:
-            self._spg = rply.ParserGenerator(
-                [rule.name for rule in lexers.slg.rules],
-                precedence=[]
-            )
-        return self._spg
-
     @property
     def sp(self):
         if self._sp is None:
-            self._sp = self.spg.build()
+            self._sp = StructureParser()
         return self._sp
 
+    def parse_expr(self, source):
+        """
+        Compiles the template expression ``source``, like the contents of
+        ``{{ }}``, into an :class:`ast.expr`.
+        """
+        return self.expression_cache.get(source, self._parse_expr)
+
+    def _parse_expr(self, source):
+        if self.python_expressions:
+            node = parse_expression(source)
+            if node is not None:
+                return node
+        return self.fp.parse(lexers.fl.lex(source))
+
 
 parsers = Parsers()
 
 # Load productions
 from .filter import fpg  # noqa
-from .structure import spg  # noqa
+from .expression import parse_expression  # noqa
+from .structure import StructureParser  # noqa
@@ -0,0 +1,372 @@
+"""
+Expression parser built on Python's own parser.
+
+Template expressions are close enough to Python that :func:`ast.parse` can
+do the parsing, which is much faster than the rply filter parser. The
+source is scanned once to rewrite filters, which Python has no syntax for,
+into calls of a placeholder function::
+
+    a + b|join:", "|upper   ->   _rattle_filter('upper', (_rattle_filter(
+                                      'join', (a + b), ", ")))
+
+A filter applies to everything on its left, up to the start of the
+enclosing brackets, argument or keyword argument, as in the filter grammar.
+The parsed expression is then converted node by node into the AST the
+filter parser's productions build.
+
+Only expressions both parsers agree on are converted. Anything else --
+syntax only Python knows, like ``not a`` or ``a[1:2]``, numbers and
+strings the filter lexer reads differently, or ``and`` mixed with ``or``,
+which the filter grammar gives the same precedence -- makes
+:func:`parse_expression` return ``None``, and the filter parser takes over,
+so both parsers compile and reject the same templates. The one exception
+are names starting with a keyword, like ``index`` or ``order``, which the
+filter lexer splits in two, failing to parse.
+"""
+import ast
+import re
+
+from rattle import PY3
+from ..utils.parser import build_call, get_filter_func
+
+
+# Name of the function the filters are rewritten into. Expressions using
+# the name are left to the filter parser.
+FILTER = '_rattle_filter'
+
+# The filter lexer's tokens. Strings with backslashes are left to the filter
+# parser, which does not unescape them.
+TOKENS = re.compile(r'''
+    (\s+)
+  | ('[^'\\\n]*'|"[^"\\\n]*")
+  | (\d+(?:\.\d+|[eE]-?\d+)?)
+  | ([a-zA-Z_][a-zA-Z0-9_]*)
+  | (==|!=|<=|>=|[-+*/%<>=.,:()\[\]|])
+''', re.VERBOSE)
+
+SPACE, STRING, NUMBER, NAME, OPERATOR = range(1, 6)
+
+LITERALS = (NAME, NUMBER, STRING)
+
+# Variables and their attributes, with a chain of filters taking no or one
+# argument, are by far the most common expressions. They are built without
+# parsing.
+SIMPLE = re.compile(r"""
+    \s*({name}(?:\.{name})*)\s*
+    ((?:\|\s*{name}(?:\s*\.\s*{name})*\s*(?::\s*{literal}\s*)?)*)
+    \Z
+""".format(
+    name=r'[a-zA-Z_][a-zA-Z0-9_]*',
+    literal=r"""(?:[a-zA-Z_][a-zA-Z0-9_]*|\d+(?:\.\d+|[eE]-?\d+)?
+                  |'[^'\n]*'|"[^"\n]*")""",
+), re.VERBOSE)
+
+SIMPLE_FILTER = re.compile(r"""
+    \|\s*([a-zA-Z_][a-zA-Z0-9_]*(?:\s*\.\s*[a-zA-Z_][a-zA-Z0-9_]*)*)\s*
+    (?::\s*(?:
+        ([a-zA-Z_][a-zA-Z0-9_]*)
+      | (\d+(?:\.\d+|[eE]-?\d+)?)
+      | ('[^'\n]*'|"[^"\n]*")
+    )\s*)?
+""", re.VERBOSE)
+
+# Keywords to the filter lexer, which never reads them as names
+KEYWORDS = {'and', 'or', 'in', 'is'}
+
+FILTER_NAME = re.compile(
+    r'\s*([a-zA-Z_][a-zA-Z0-9_]*(?:\s*\.\s*[a-zA-Z_][a-zA-Z0-9_]*)*)\s*')
+
+
+class Unsupported(Exception):
+    """
+    Raised for expressions left to the filter parser.
+    """
+
+
+def rewrite(source):
+    """
+    Rewrites the filters of the template expression ``source`` into calls,
+    so the result is a Python expression.
+
+    :raises Unsupported: if the filter parser may read ``source`` differently.
+    """
+    out = []
+    # Index in ``out`` where the operand a filter applies to starts, and
+    # the same for each enclosing bracket
+    start = 0
+    stack = []
+    keywords = set()
+    last = None
+    pos = 0
+    size = len(source)
+    while pos < size:
+        match = TOKENS.match(source, pos)
+        if match is None:
+            raise Unsupported(source[pos])
+        kind = match.lastindex
+        token = match.group(kind)
+        pos = match.end()
+        if kind == SPACE:
+            out.append(' ')
+            continue
+        if kind == STRING:
+            # String prefixes, or implicit concatenation
+            if last is not None and last[0] in (NAME, STRING):
+                raise Unsupported(token)
+        elif kind == NUMBER:
+            # ".5", "1_000", "1j", "0x1", "1.real", "012"...
+            following = source[pos:pos + 1]
+            if following and (following.isalnum() or following in '_.'):
+                raise Unsupported(token)
+            if last == (OPERATOR, '.') or token[:1] == '0' and \
+                    token[1:2].isdigit():
+                raise Unsupported(token)
+        elif kind == NAME:
+            if token == FILTER:
+                raise Unsupported(token)
+            if token in ('and', 'or'):
+                keywords.add(token)
+        elif token in '([':
+            stack.append(start)
+            out.append(token)
+            start = len(out)
+            last = (kind, token)
+            continue
+        elif token in ')]':
+            if not stack:
+                raise Unsupported(token)
+            start = stack.pop()
+        elif token in ',=':
+            out.append(token)
+            start = len(out)
+            last = (kind, token)
+            continue
+        elif token == '|':
+            pos, start = rewrite_filter(source, pos, out, start, stack)
+            last = (OPERATOR, ')')
+            continue
+        out.append(token)
+        last = (kind, token)
+    if stack or len(keywords) > 1:
+        raise Unsupported(source)
+    return ''.join(out)
+
+
+def rewrite_filter(source, pos, out, start, stack):
+    """
+    Replaces the operand of the filter starting at ``pos``, right after the
+    ``|``, with the filter's call. Returns the position after the filter
+    name and argument, or after the ``(`` opening its arguments, and the
+    start of the operand there.
+    """
+    operand = ''.join(out[start:]).strip()
+    match = FILTER_NAME.match(source, pos)
+    if not operand or match is None:
+        raise Unsupported('|')
+    del out[start:]
+    name = ''.join(match.group(1).split())
+    pos = match.end()
+    char = source[pos:pos + 1]
+    if char == '(':
+        # The arguments are scanned as those of any call
+        stack.append(start)
+        out.append('%s(%r, (%s), ' % (FILTER, name, operand))
+        return pos + 1, len(out)
+    if char == ':':
+        literal = TOKENS.match(source, pos + 1)
+        if literal is not None and literal.lastindex == SPACE:
+            literal = TOKENS.match(source, literal.end())
+        if literal is None or literal.lastindex not in LITERALS or \
+                literal.group(NAME) == FILTER:
+            raise Unsupported(':')
+        out.append('%s(%r, (%s), %s)' % (
+            FILTER, name, operand, literal.group(literal.lastindex)))
+        return literal.end(), start
+    out.append('%s(%r, (%s))' % (FILTER, name, operand))
+    return pos, start
+
+
+def lookup(name):
+    return ast.Subscript(
+        value=ast.Name(id='context', ctx=ast.Load()),
+        slice=ast.Index(value=ast.Str(s=name), ctx=ast.Load()),
+        ctx=ast.Load(),
+    )
+
+
+def constant(value):
+    if value is None or value is True or value is False:
+        # Names to the filter parser, looked up in the context
+        return lookup(str(value))
+    if not PY3 and isinstance(value, bytes):
+        value = value.decode('utf-8')
+    if isinstance(value, type(u'')):
+        return ast.Str(s=value)
+    if type(value) in (int, float):
+        return ast.Num(n=value)
+    raise Unsupported(value)
+
+
+def convert_name(node):
+    return lookup(node.id)
+
+
+def convert_constant(node):
+    return constant(node.value)
+
+
+def convert_num(node):
+    return constant(node.n)
+
+
+def convert_str(node):
+    return constant(node.s)
+
+
+def convert_attribute(node):
+    return ast.Attribute(
+        value=convert(node.value),
+        attr=node.attr,
+        ctx=ast.Load(),
+    )
+
+
+def convert_subscript(node):
+    index = node.slice
+    if type(index) is ast.Index:
+        index = index.value
+    return ast.Subscript(
+        value=convert(node.value),
+        slice=ast.Index(value=convert(index), ctx=ast.Load()),
+        ctx=ast.Load(),
+    )
+
+
+BINOPS = {ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Mod}
+
+
+def convert_binop(node):
+    op = type(node.op)
+    if op not in BINOPS:
+        raise Unsupported(op)
+    return ast.BinOp(
+        left=convert(node.left), op=op(), right=convert(node.right))
+
+
+def convert_boolop(node):
+    # The filter parser only builds binary operations, grouped to the left
+    op = type(node.op)
+    values = node.values
+    result = convert(values[0])
+    for value in values[1:]:
+        result = ast.BoolOp(op=op(), values=[result, convert(value)])
+    return result
+
+
+CMPOPS = {ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE,
+          ast.In, ast.NotIn, ast.IsNot, ast.Is}
+
+
+def convert_compare(node):
+    # Chained comparisons are grouped to the left by the filter parser
+    result = convert(node.left)
+    for op, right in zip(node.ops, node.comparators):
+        op = type(op)
+        if op not in CMPOPS:
+            raise Unsupported(op)
+        result = ast.Compare(
+            left=result, ops=[op()], comparators=[convert(right)])
+    return result
+
+
+def convert_call(node):
+    if getattr(node, 'starargs', None) or getattr(node, 'kwargs', None):
+        raise Unsupported(node)
+    args = [convert(arg) for arg in node.args]
+    kwargs = []
+    for keyword in node.keywords:
+        if keyword.arg is None:
+            raise Unsupported(keyword)
+        kwargs.append(
+            ast.keyword(arg=keyword.arg, value=convert(keyword.value)))
+    func = node.func
+    if type(func) is ast.Name and func.id == FILTER:
+        # Written by rewrite(): the filter name, then the operand
+        return build_call(get_filter_func(args[0]), args[1:], kwargs)
+    return build_call(convert(func), args, kwargs)
+
+
+CONVERTERS = {
+    ast.Name: convert_name,
+    ast.Attribute: convert_attribute,
+    ast.Subscript: convert_subscript,
+    ast.BinOp: convert_binop,
+    ast.BoolOp: convert_boolop,
+    ast.Compare: convert_compare,
+    ast.Call: convert_call,
+    ast.Num: convert_num,
+    ast.Str: convert_str,
+}
+for name, func in (('Constant', convert_constant),
+                   ('NameConstant', convert_constant)):
+    if hasattr(ast, name):
+        CONVERTERS[getattr(ast, name)] = func
+
+
+def convert(node):
+    """
+    Converts the Python expression ``node`` into the filter parser's AST.
+
+    :raises Unsupported: for nodes the filter parser does not build.
+    """
+    func = CONVERTERS.get(type(node))
+    if func is None:
+        raise Unsupported(node)
+    return func(node)
+
+
+def parse_simple(source, match):
+    """
+    Builds the AST of an expression matching :data:`SIMPLE`.
+    """
+    names = match.group(1).split('.')
+    if not KEYWORDS.isdisjoint(names):
+        return None
+    node = lookup(names[0])
+    for name in names[1:]:
+        node = ast.Attribute(value=node, attr=name, ctx=ast.Load())
+    for filter_match in SIMPLE_FILTER.finditer(
+            source, match.start(2), match.end(2)):
+        name, arg_name, number, string = filter_match.groups()
+        name = ''.join(name.split())
+        if not KEYWORDS.isdisjoint(name.split('.')) or arg_name in KEYWORDS:
+            return None
+        if arg_name is not None:
+            args = [lookup(arg_name)]
+        elif number is not None:
+            cast = int if number.isdigit() else float
+            args = [ast.Num(n=cast(number))]
+        elif string is not None:
+            args = [ast.Str(s=string[1:-1])]
+        else:
+            args = []
+        node = build_call(get_filter_func(ast.Str(s=name)), [node] + args)
+    return node
+
+
+def parse_expression(source):
+    """
+    Compiles the template expression ``source`` into the same AST as the
+    filter parser, or returns ``None`` if it is left to the filter parser.
+    """
+    match = SIMPLE.match(source)
+    if match is not None:
+        node = parse_simple(source, match)
+        if node is not None:
+            return node
+    try:
+        tree = compile(rewrite(source).strip(), '<expression>', 'eval',
+                       ast.PyCF_ONLY_AST)
+        return convert(tree.body)
+    except (Unsupported, SyntaxError):
+        return None
@@ -1,170 +1,468 @@
-import ast
-
-from . import parsers
-from ..lexer import lexers
-from ..utils.parser import (build_call, build_class, build_yield, production,
-    split_tag_args_string, update_source_pos)
-
-
-spg = parsers.spg
 """
-Structure parser generator.
+Structure parser.
 
-Used to tokenize and split the template at ``{{``, ``}}``, ``{%``, ``%}``,
-``{#`` and ``#}``.
+Compiles the tokens of the structure lexer into the body of the template's
+``root`` function, in a single pass. The structure is::
 
-The overall rules are::
+    doc      :  node*
 
-    doc      :  CONTENT
-             |  var
-             |  tag
-             |  comment
-             |  doc CONTENT
-             |  doc var
-             |  doc tag
-             |  doc comment
+    node     :  CONTENT
+             |  VS CONTENT VE
+             |  CS CONTENT? CE
+             |  TS <tag> ...
 
-    var      :  VS CONTENT VE
+    if       :  TS IF CONTENT TE node* [TS ELSE TE node*] TS ENDIF TE
 
-    tag      :  if
-             |  for
+    for      :  TS FOR CONTENT TE node* [TS (ELSE|EMPTY) TE node*]
+                TS ENDFOR TE
 
-    if       :  TS IF CONTENT TE inner TS ENDIF TE
-             |  TS IF CONTENT TE inner TS ELSE TE inner TS ENDIF TE
+    include  :  TS INCLUDE CONTENT TE
 
-    for      :  TS FOR CONTENT TE inner TS ENDFOR TE
-             |  TS FOR CONTENT TE inner TS ELSE TE inner TS ENDFOR TE
-             |  TS FOR CONTENT TE inner TS EMPTY TE inner TS ENDFOR TE
+    extends  :  TS EXTENDS CONTENT TE
 
-    comment  :  CS CONTENT CE
+    block    :  TS BLOCK CONTENT TE node* TS ENDBLOCK TE
 
-    inner    :  CONTENT
-             |  var
-             |  tag
-             |  comment
-             |  inner CONTENT
-             |  inner var
-             |  inner tag
-             |  inner comment
+    cache    :  TS CACHE CONTENT TE node* TS ENDCACHE TE
 
-"""
+    spaceless:  TS SPACELESS TE node* TS ENDSPACELESS TE
 
-spg.precedence = []
-
-
-@production(spg, 'doc : CONTENT')
-def doc__CONTENT(state, p):
-    klass, root_func = build_class()
-    state.blocks.append(root_func)
-    content = p[0]
-    content = update_source_pos(ast.Str(s=content.getstr()), content)
-    state.append_to_block(build_yield(content))
-    return klass
-
-
-@production(spg,
-            'doc : var',
-            'doc : tag',
-            'doc : comment')
-def doc__parsed(state, p):
-    klass, root_func = build_class()
-    state.blocks.append(root_func)
-    state.append_to_block(p[0])
-    return klass
-
-
-@production(spg, 'doc : doc CONTENT')
-def doc__doc_CONTENT(state, p):
-    doc, content = p
-    content = update_source_pos(ast.Str(s=content.getstr()), content)
-    state.append_to_block(build_yield(content))
-    return doc
-
-
-@production(spg,
-            'doc : doc var',
-            'doc : doc tag')
-def doc__doc_parsed(state, p):
-    doc, parsed = p
-    state.append_to_block(parsed)
-    return doc
-
-
-@production(spg, 'doc : doc comment')
-def doc__doc_comment(state, p):
-    doc, _ = p
-    return doc
-
-
-@production(spg, 'var : VS CONTENT VE')
-def var__varstart_CONTENT_varend(state, p):
-    content = parsers.fp.parse(lexers.fl.lex(p[1].getstr()))
-    return build_yield(build_call(
-        func=ast.Name(id='auto_escape', ctx=ast.Load()),
-        args=[
-            update_source_pos(content, p[1])
-        ]
-    ))
-
-
-@production(spg,
-            'tag : if',
-            'tag : for')
-def tag(state, p):
-    return p[0]
-
-
-@production(spg, 'if : TS IF CONTENT TE inner TS ENDIF TE')
-def if__impl(state, p):
-    ts, _, condition, _, body, _, _, _ = p
-    test = parsers.fp.parse(lexers.fl.lex(condition.getstr()))
-    return update_source_pos(ast.If(
-        test=test,
-        body=body,
-        orelse=[]
-    ), ts)
+Each tag is compiled by a function registered in :data:`TAGS` under the
+tag's name, which parses the rest of the tag and its body, so new tags do
+not change any grammar. Bodies are compiled without recursion, so nesting
+tags does not use up the stack.
 
+Templates included or extended by name are read through the loader and
+compiled into the including template, so rendering it never looks up other
+templates. A template extending another compiles to its parent's body, with
+its own blocks in place of the parent's; anything outside its blocks is
+left out. Names given by other expressions, and templates including
+themselves, are looked up when rendering instead, through the
+``include_template`` and ``extend_template`` functions of
+:class:`rattle.template.Template`.
 
-@production(spg, 'if : TS IF CONTENT TE inner TS ELSE TE inner TS ENDIF TE')
-def if__else_impl(state, p):
-    ts, _, condition, _, body, _, _, _, orelse, _, _, _ = p
-    test = parsers.fp.parse(lexers.fl.lex(condition.getstr()))
-    return update_source_pos(ast.If(
-        test=test,
-        body=body,
-        orelse=orelse,
-    ), ts)
+The output of a ``{% cache %}`` body is collected into a list instead of
+being yielded, and stored in the template's fragment cache; on a hit the
+body does not run at all. Fragments are kept apart by the template and the
+position of the tag, unless the tag ends in ``shared``.
 
+Templates compiled with ``collapse_whitespace``, and the bodies of
+``{% spaceless %}`` tags, have every run of whitespace in their text
+replaced with a single newline, if it contains one, or space, except in
+the elements of :data:`PRESERVED_ELEMENTS`. This happens at compile time,
+so it costs nothing when rendering.
+"""
+import ast
+import re
+from inspect import isgenerator
 
-@production(spg, 'for : TS FOR CONTENT TE inner TS ENDFOR TE')
-def for__impl(state, p):
-    ts, _, args, _, body, _, _, _ = p
-    target, in_, var = split_tag_args_string(args.getstr())
-    if in_ != 'in':
-        raise ValueError('"in" expected in for loop arguments')
-    iterator = parsers.fp.parse(lexers.fl.lex(var))
-    return update_source_pos(ast.For(
-        target=ast.Subscript(
-            value=ast.Name(id='context', ctx=ast.Load()),
-            slice=ast.Index(value=ast.Str(s=target)),
-            ctx=ast.Store()
-        ),
-        iter=iterator,
+from . import parsers
+from ..lexer import lexers
+from ..optimizer import build_constant
+from ..utils.parser import (build_call, build_class, build_scope,
+    build_str_join, build_yield, split_tag_args_string, update_source_pos)
+
+
+IDENTIFIER = re.compile(r'[a-zA-Z_][a-zA-Z0-9_]*\Z')
+
+#: Elements whose whitespace is significant, or may be inside string
+#: literals, and is never collapsed
+PRESERVED_ELEMENTS = ('pre', 'textarea', 'script', 'style')
+
+PRESERVED_TAG = re.compile(
+    r'<(/?)(%s)\b' % '|'.join(PRESERVED_ELEMENTS), re.IGNORECASE)
+
+WHITESPACE = re.compile(r'\s+')
+
+#: Tag compilers by tag name. Each is called as ``func(parser, stream,
+#: state, ts, name)`` with the ``TS`` and name tokens of the tag already
+#: consumed, and returns an :class:`ast.stmt` or a list of them.
+#:
+#: Tags with bodies are generators instead. ``body, end = yield ends``
+#: compiles the nodes up to the first tag named in the tuple ``ends``, and
+#: gives their statements and the name of the tag found; the compiled tag
+#: is yielded last.
+TAGS = {}
+
+
+def register_tag(name):
+    """
+    Registers the decorated function as the compiler of the tag ``name``.
+    """
+    def wrapper(func):
+        TAGS[name] = func
+        return func
+    return wrapper
+
+
+def unexpected(token):
+    error = ValueError('Unexpected token: %r' % token)
+    # Matches rply's own errors, so callers can report where parsing failed
+    error.source_pos = token.getsourcepos()
+    return error
+
+
+def unclosed(ts, name):
+    error = ValueError(
+        'Unexpected end of template, {%% %s %%} is not closed'
+        % name.getstr().strip())
+    error.source_pos = ts.getsourcepos()
+    return error
+
+
+def parse_expr(token):
+    return parsers.parse_expr(token.getstr())
+
+
+class DynamicParent(Exception):
+    """
+    Raised when a template compiled into another names its parent with an
+    expression.
+    """
+
+
+def static_name(node):
+    """
+    Returns the template name if ``node`` is a string literal, ``None``
+    otherwise.
+    """
+    if isinstance(node, ast.Str):
+        return node.s
+    return None
+
+
+def load_source(state, name, ts):
+    """
+    Returns the source and path of the template ``name``, read through the
+    loader of ``state``.
+    """
+    from ..loader import TemplateNotFound, loader as default_loader
+    loader = state.loader if state.loader is not None else default_loader
+    try:
+        return loader.get_source(name)
+    except TemplateNotFound:
+        error = TemplateNotFound('Template not found: %s' % name)
+        error.source_pos = ts.getsourcepos()
+        raise error
+
+
+def collapse_space(match):
+    return '\n' if '\n' in match.group() else ' '
+
+
+def collapse_whitespace(text, state):
+    """
+    Collapses the runs of whitespace in the template text ``text``, leaving
+    the contents of preserved elements as they are. Elements left open are
+    tracked in ``state``, as they may continue in the text after the next
+    variable or tag.
+    """
+    out = []
+    pos = 0
+    for match in PRESERVED_TAG.finditer(text):
+        closing, element = match.group(1), match.group(2).lower()
+        if state.preserved is None:
+            if closing:
+                continue
+            out.append(
+                WHITESPACE.sub(collapse_space, text[pos:match.start()]))
+            pos = match.start()
+            state.preserved = element
+        elif closing and element == state.preserved:
+            out.append(text[pos:match.end()])
+            pos = match.end()
+            state.preserved = None
+    if state.preserved is None:
+        out.append(WHITESPACE.sub(collapse_space, text[pos:]))
+    else:
+        out.append(text[pos:])
+    return ''.join(out)
+
+
+def build_render(func, args):
+    """
+    Constructs a loop yielding the output of the template rendering
+    function ``func`` called with ``args``.
+
+    This is equivalent to::
+
+        for chunk in func(*args):
+            yield chunk
+    """
+    return ast.For(
+        target=ast.Name(id='chunk', ctx=ast.Store()),
+        iter=build_call(ast.Name(id=func, ctx=ast.Load()), args),
+        body=[build_yield(ast.Name(id='chunk', ctx=ast.Load()))],
+        orelse=[],
+    )
+
+
+class OutputCollector(ast.NodeTransformer):
+    """
+    Replaces the ``yield`` statements of a body with calls appending the
+    values to the list ``buffer``.
+    """
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+
+    def visit_Expr(self, node):
+        if not isinstance(node.value, ast.Yield):
+            return node
+        return ast.copy_location(ast.Expr(value=build_call(
+            ast.Attribute(
+                value=ast.Name(id=self.buffer, ctx=ast.Load()),
+                attr='append',
+                ctx=ast.Load(),
+            ),
+            [node.value.value],
+        )), node)
+
+
+class TokenStream(object):
+    """
+    Wraps the lexer's tokens, so tokens can be inspected before they are
+    consumed.
+    """
+
+    def __init__(self, tokens):
+        self.tokens = iter(tokens)
+        self.current = next(self.tokens, None)
+
+    def next(self):
+        """
+        Returns and consumes the current token, or ``None`` at the end.
+        """
+        token = self.current
+        if token is not None:
+            self.current = next(self.tokens, None)
+        return token
+
+    def expect(self, name, ts=None, tag=None):
+        """
+        Consumes and returns the current token, which must be a ``name``
+        token. ``ts`` and ``tag`` are the tokens of the enclosing tag, for
+        the error at the end of the template.
+        """
+        token = self.current
+        if token is None:
+            if ts is not None:
+                raise unclosed(ts, tag)
+            raise ValueError('Unexpected end of template')
+        if token.name != name:
+            raise unexpected(token)
+        self.current = next(self.tokens, None)
+        return token
+
+
+class StructureParser(object):
+    """
+    Compiles a template's structure tokens into a module class. Has the same
+    interface as an rply parser.
+    """
+
+    def __init__(self, tags=TAGS):
+        self.tags = tags
+
+    def parse(self, tokens, state):
+        klass, root_func = build_class()
+        state.blocks.append(root_func)
+        root_func.body.extend(self.parse_template(tokens, state))
+        return klass
+
+    def parse_template(self, tokens, state):
+        """
+        Compiles the tokens of a whole template. If the template extends
+        another, the result is the parent's body, with this template's
+        blocks in place of the parent's.
+
+        :returns: The list of statements.
+        """
+        extends, blocks = state.extends, state.template_blocks
+        state.extends, state.template_blocks = None, {}
+        try:
+            body, _ = self.parse_body(TokenStream(tokens), state)
+            if state.extends is not None:
+                body = self.parse_parent(state)
+        finally:
+            state.extends, state.template_blocks = extends, blocks
+        return body
+
+    def parse_parent(self, state):
+        expr, ts = state.extends
+        name = static_name(expr)
+        if name is None:
+            if len(state.templates) > 1:
+                raise DynamicParent()
+            if state.parent is None:
+                return [update_source_pos(build_render(
+                    'extend_template',
+                    [expr, ast.Name(id='context', ctx=ast.Load())],
+                ), ts)]
+            name = state.parent
+        source, path = load_source(state, name, ts)
+        if path in state.templates:
+            error = ValueError('Template extends itself: %s' % name)
+            error.source_pos = ts.getsourcepos()
+            raise error
+        # Blocks of templates further down replace those of this one
+        overrides = state.overrides
+        state.overrides = dict(state.template_blocks, **overrides)
+        try:
+            return self.inline(name, source, path, state)
+        finally:
+            state.overrides = overrides
+
+    def inline(self, name, source, path, state):
+        """
+        Compiles the template ``name`` read from ``path`` into the current
+        one.
+        """
+        state.templates.append(path)
+        state.names.append(name)
+        state.dependencies.append((name, path, source))
+        try:
+            return self.parse_template(lexers.sl.lex(source), state)
+        finally:
+            state.templates.pop()
+            state.names.pop()
+
+    def locate(self, node, state):
+        """
+        Marks the statements of ``node`` that carry a source position, and
+        are not marked yet, as compiled from the current template, for
+        :mod:`rattle.profiler`.
+        """
+        template = state.templates[-1]
+        for child in ast.walk(node):
+            if isinstance(child, ast.stmt) and hasattr(child, 'lineno') and \
+                    not hasattr(child, 'rattle_template'):
+                child.rattle_template = template
+
+    def parse_body(self, stream, state, ends=(), ts=None, tag=None):
+        """
+        Compiles nodes up to the first tag named in ``ends``.
+
+        The compilers of tags with bodies are generators (see :data:`TAGS`).
+        They are run from here, with the tags being compiled kept on a stack
+        rather than by recursion, so the depth of nesting is not limited by
+        the parser.
+
+        :param ends: Names of the tags ending the body. If empty, the body
+            extends to the end of the template.
+        :param ts: The start token of the enclosing tag.
+        :param tag: The name token of the enclosing tag.
+        :returns: The list of statements, and the name of the end tag found.
+        """
+        body = []
+        # ``(compiler, body, ends, ts, tag)`` of the enclosing tags, with the
+        # body each is in
+        stack = []
+        try:
+            while True:
+                token = stream.next()
+                if token is None:
+                    if ends:
+                        raise unclosed(ts, tag)
+                    return body, None
+
+                kind = token.name
+                if kind == 'CONTENT':
+                    text = token.getstr()
+                    if state.collapse_whitespace:
+                        text = collapse_whitespace(text, state)
+                    body.append(build_yield(
+                        update_source_pos(ast.Str(s=text), token)))
+                elif kind == 'VS':
+                    content = stream.expect('CONTENT')
+                    stream.expect('VE')
+                    node = update_source_pos(build_yield(build_call(
+                        func=ast.Name(id='auto_escape', ctx=ast.Load()),
+                        args=[update_source_pos(parse_expr(content), content)]
+                    )), token)
+                    if state.instrument:
+                        self.locate(node, state)
+                    body.append(node)
+                elif kind == 'CS':
+                    if stream.current is not None and \
+                            stream.current.name == 'CONTENT':
+                        stream.next()
+                    stream.expect('CE')
+                elif kind == 'TS':
+                    name = stream.next()
+                    if name is None:
+                        raise ValueError('Unexpected end of template')
+                    tag_name = name.getstr().strip()
+                    if tag_name in ends:
+                        stream.expect('TE', ts, tag)
+                        if not stack:
+                            return body, tag_name
+                        result = stack[-1][0].send((body, tag_name))
+                    else:
+                        func = self.tags.get(tag_name)
+                        if func is None:
+                            raise unexpected(name)
+                        result = func(self, stream, state, token, name)
+                        if not isgenerator(result):
+                            self.append_tag(body, result, state)
+                            continue
+                        stack.append((result, body, ends, ts, tag))
+                        ts, tag = token, name
+                        result = next(result)
+                    if isinstance(result, tuple):
+                        # The tag asks for a body ending in one of these tags
+                        body, ends = [], result
+                        continue
+                    compiler, body, ends, ts, tag = stack.pop()
+                    compiler.close()
+                    self.append_tag(body, result, state)
+                else:
+                    raise unexpected(token)
+        finally:
+            # Lets the tags being compiled clean up after an error
+            for compiler, _, _, _, _ in reversed(stack):
+                compiler.close()
+
+    def append_tag(self, body, node, state):
+        """
+        Appends the statement or list of statements ``node`` compiled from
+        a tag to ``body``.
+        """
+        if not isinstance(node, list):
+            node = [node]
+        if state.instrument:
+            for stmt in node:
+                self.locate(stmt, state)
+        body.extend(node)
+
+
+@register_tag('if')
+def if_tag(parser, stream, state, ts, name):
+    condition = stream.expect('CONTENT')
+    stream.expect('TE')
+    body, end = yield ('else', 'endif')
+    orelse = []
+    if end == 'else':
+        orelse, _ = yield ('endif',)
+    yield update_source_pos(ast.If(
+        test=parse_expr(condition),
         body=body,
-        orelse=[]
+        orelse=orelse,
     ), ts)
 
 
-@production(spg,
-            'for : TS FOR CONTENT TE inner TS ELSE TE inner TS ENDFOR TE',
-            'for : TS FOR CONTENT TE inner TS EMPTY TE inner TS ENDFOR TE')
-def for__else_impl(state, p):
-    ts, _, args, _, body, _, _, _, orelse, _, _, _ = p
+@register_tag('for')
+def for_tag(parser, stream, state, ts, name):
+    args = stream.expect('CONTENT')
+    stream.expect('TE')
     target, in_, var = split_tag_args_string(args.getstr())
     if in_ != 'in':
         raise ValueError('"in" expected in for loop arguments')
-    iterator = parsers.fp.parse(lexers.fl.lex(var))
-    return update_source_pos(ast.For(
+    iterator = parsers.parse_expr(var)
+    body, end = yield ('else', 'empty', 'endfor')
+    orelse = []
+    if end != 'endfor':
+        orelse, _ = yield ('endfor',)
+    loop = update_source_pos(ast.For(
         target=ast.Subscript(
             value=ast.Name(id='context', ctx=ast.Load()),
             slice=ast.Index(value=ast.Str(s=target)),
@@ -174,51 +472,137 @@ def for__else_impl(state, p):
         body=body,
         orelse=orelse
     ), ts)
-
-
-@production(spg, 'comment : CS CONTENT CE')
-def comment(state, p):
-    return build_yield(ast.Str(s=''))
-
-
-@production(spg, 'inner : CONTENT')
-def inner__CONTENT(state, p):
-    content = p[0]
-    content = update_source_pos(ast.Str(s=content.getstr()), content)
-    return [build_yield(content)]
-
-
-@production(spg,
-            'inner : var',
-            'inner : tag',
-            'inner : comment')
-def inner__parsed(state, p):
-    return p
-
-
-@production(spg, 'inner : inner CONTENT')
-def inner__inner_CONTENT(state, p):
-    inner, content = p
-    content = update_source_pos(ast.Str(s=content.getstr()), content)
-    inner.append(build_yield(content))
-    return inner
-
-
-@production(spg,
-            'inner : inner var',
-            'inner : inner tag')
-def inner__inner_parsed(state, p):
-    inner, parsed = p
-    inner.append(parsed)
-    return inner
-
-
-@production(spg, 'inner : inner comment')
-def inner__inner_comment(state, p):
-    inner, _ = p
-    return inner
-
-
-@spg.error
-def error(state, token):
-    raise ValueError('Unexpected token: %r' % token)
+    yield update_source_pos(build_scope([loop]), ts)
+
+
+@register_tag('include')
+def include_tag(parser, stream, state, ts, name):
+    arg = stream.expect('CONTENT')
+    stream.expect('TE')
+    expr = parse_expr(arg)
+    template_name = static_name(expr)
+    if template_name is not None:
+        source, path = load_source(state, template_name, ts)
+        # Templates including themselves recurse at render time
+        if path not in state.templates:
+            # Included templates are not affected by the blocks of templates
+            # extending the including one
+            overrides, preserved = state.overrides, state.preserved
+            state.overrides = {}
+            try:
+                return parser.inline(template_name, source, path, state)
+            except DynamicParent:
+                # Included at render time, so its text leaves nothing open
+                state.preserved = preserved
+            finally:
+                state.overrides = overrides
+    return update_source_pos(build_render('include_template', [
+        expr,
+        ast.Name(id='context', ctx=ast.Load()),
+        # Filled in with the loop variables by the lookup hoister
+        ast.Dict(keys=[], values=[]),
+    ]), ts)
+
+
+@register_tag('extends')
+def extends_tag(parser, stream, state, ts, name):
+    arg = stream.expect('CONTENT')
+    stream.expect('TE')
+    if state.extends is not None:
+        raise unexpected(name)
+    state.extends = (parse_expr(arg), ts)
+    return []
+
+
+@register_tag('block')
+def block_tag(parser, stream, state, ts, name):
+    arg = stream.expect('CONTENT')
+    stream.expect('TE')
+    block_name = arg.getstr().strip()
+    if not IDENTIFIER.match(block_name) or \
+            block_name in state.template_blocks:
+        raise unexpected(arg)
+    body, _ = yield ('endblock',)
+    body = state.overrides.get(block_name, body)
+    state.template_blocks[block_name] = body
+    yield body
+
+
+@register_tag('cache')
+def cache_tag(parser, stream, state, ts, name):
+    arg = stream.expect('CONTENT')
+    stream.expect('TE')
+    args = split_tag_args_string(arg.getstr())
+    shared = len(args) > 1 and args[-1] == 'shared'
+    if shared:
+        args = args[:-1]
+    if not 1 <= len(args) <= 2:
+        raise unexpected(arg)
+    body, _ = yield ('endcache',)
+
+    # Locates the tag within the compiled template, see
+    # Template.fragment_key; shared fragments are stored under the key alone
+    scope = None
+    if not shared:
+        pos = ts.getsourcepos()
+        scope = '%d:%d' % (pos.lineno, pos.colno)
+        if state.names[-1] is not None:
+            scope = '%s:%s' % (state.names[-1], scope)
+
+    index = state.cache_tags
+    state.cache_tags += 1
+    key = 'cache_key_%d' % index
+    fragment = 'cache_fragment_%d' % index
+    buffer = 'cache_buffer_%d' % index
+
+    def load(local):
+        return ast.Name(id=local, ctx=ast.Load())
+
+    def store(local, value):
+        return ast.Assign(
+            targets=[ast.Name(id=local, ctx=ast.Store())], value=value)
+
+    collector = OutputCollector(buffer)
+    fill = [store(buffer, ast.List(elts=[], ctx=ast.Load()))]
+    fill.extend(collector.visit(stmt) for stmt in body)
+    fill.append(store(fragment, build_str_join(load(buffer))))
+    set_args = [build_constant(scope), load(key), load(fragment)]
+    set_args.extend(parsers.parse_expr(expr) for expr in args[1:])
+    fill.append(ast.Expr(value=build_call(load('set_fragment'), set_args)))
+
+    # cache_key = <key>
+    # cache_fragment = get_fragment(<scope>, cache_key)
+    # if cache_fragment is None:
+    #     cache_buffer = []
+    #     <body, appending to cache_buffer>
+    #     cache_fragment = ''.join(cache_buffer)
+    #     set_fragment(<scope>, cache_key, cache_fragment[, <ttl>])
+    # yield cache_fragment
+    yield [update_source_pos(stmt, ts) for stmt in (
+        store(key, parsers.parse_expr(args[0])),
+        store(fragment, build_call(
+            load('get_fragment'), [build_constant(scope), load(key)])),
+        ast.If(
+            test=ast.Compare(
+                left=load(fragment),
+                ops=[ast.Is()],
+                comparators=[build_constant(None)],
+            ),
+            body=fill,
+            orelse=[],
+        ),
+        build_yield(load(fragment)),
+    )]
+
+
+@register_tag('spaceless')
+def spaceless_tag(parser, stream, state, ts, name):
+    stream.expect('TE')
+    # Elements left open in the body do not carry on past it
+    collapse, preserved = state.collapse_whitespace, state.preserved
+    state.collapse_whitespace = True
+    try:
+        body, _ = yield ('endspaceless',)
+    finally:
+        state.collapse_whitespace, state.preserved = collapse, preserved
+    yield body
@@ -0,0 +1,284 @@
+"""
+Profiling of template rendering.
+
+A template compiled with a :class:`Profiler` times every variable and tag
+in its source: each statement of the ``root`` function carrying a source
+position is wrapped in a timer, and the time it took is added to the
+profiler's total for that position::
+
+    profiler = Profiler()
+    template = Template(source, profiler=profiler)
+    template.render(context)
+    print(profiler.report())
+
+Times are inclusive: the time of a ``{% for %}`` includes that of its body.
+The time the template spends suspended at a ``yield``, while the caller
+handles the output, is not counted.
+
+Templates compiled without a profiler are not changed in any way, so
+rendering them costs nothing extra.
+"""
+import ast
+import threading
+import time
+from collections import namedtuple
+
+from .utils.parser import build_call
+
+# Highest resolution clock available
+timer = getattr(time, 'perf_counter', time.time)
+
+#: Globals of instrumented templates, bound to the clock and
+#: :meth:`Profiler.record`
+TIMER_NAME = 'profile_timer'
+RECORD_NAME = 'profile_record'
+
+# Longest source excerpt shown for a location
+EXCERPT_LENGTH = 50
+
+
+class Location(namedtuple('Location', 'template line column excerpt')):
+    """
+    A variable or tag, by the origin of its template, and its line and
+    column there.
+    """
+
+    def __str__(self):
+        return '%s:%d:%d' % (
+            '<template>' if self.template is None else self.template,
+            self.line, self.column)
+
+
+class LocationStats(namedtuple('LocationStats', 'location calls time')):
+    """
+    The number of times a location ran, and the total time it took.
+    """
+
+    @property
+    def time_per_call(self):
+        return self.time / self.calls if self.calls else 0.0
+
+
+def excerpt(source, line, column):
+    """
+    Returns the variable or tag starting at ``line`` and ``column`` of the
+    template ``source``, cut short if it is long.
+    """
+    lines = source.splitlines()
+    if not 0 < line <= len(lines):
+        return ''
+    text = lines[line - 1][column - 1:]
+    for end in ('}}', '%}'):
+        pos = text.find(end)
+        if pos != -1:
+            text = text[:pos + 2]
+            break
+    if len(text) > EXCERPT_LENGTH:
+        text = text[:EXCERPT_LENGTH - 3] + '...'
+    return text
+
+
+class Profiler(object):
+    """
+    Collects the times of the templates compiled with it, by location.
+
+    Templates compiled with the same profiler add up into the same totals.
+    """
+
+    def __init__(self):
+        self.locations = []
+        self.calls = []
+        self.times = []
+        # Index of each location, so templates compiled again reuse it
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def add_location(self, template, line, column, source):
+        """
+        Returns the index the time of a location is recorded under.
+
+        :param template: The origin of the template the location is in.
+        :param source: The source of that template, for the excerpt shown in
+            reports.
+        """
+        key = (template, line, column)
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is None:
+                index = self._indexes[key] = len(self.locations)
+                self.locations.append(Location(
+                    template, line, column, excerpt(source, line, column)))
+                self.calls.append(0)
+                self.times.append(0.0)
+        return index
+
+    def record(self, index, elapsed):
+        """
+        Adds a run of the location ``index`` taking ``elapsed`` seconds. Not
+        thread safe, to keep it cheap; profile one render at a time.
+        """
+        self.calls[index] += 1
+        self.times[index] += elapsed
+
+    def reset(self):
+        """
+        Sets all counts and times back to zero.
+        """
+        with self._lock:
+            self.calls = [0] * len(self.locations)
+            self.times = [0.0] * len(self.locations)
+
+    def stats(self, sort='time', limit=None):
+        """
+        Returns the :class:`LocationStats` of the locations that ran,
+        hottest first.
+
+        :param str sort: ``'time'`` to sort by the total time, ``'calls'``
+            by the number of runs.
+        :param int limit: Only return this many.
+        """
+        if sort not in ('time', 'calls'):
+            raise ValueError('Unknown sort order: %s' % sort)
+        stats = [
+            LocationStats(location, calls, elapsed)
+            for location, calls, elapsed in zip(
+                self.locations, self.calls, self.times)
+            if calls
+        ]
+        if sort == 'time':
+            stats.sort(key=lambda s: (-s.time, -s.calls, str(s.location)))
+        else:
+            stats.sort(key=lambda s: (-s.calls, -s.time, str(s.location)))
+        return stats[:limit]
+
+    def report(self, sort='time', limit=20):
+        """
+        Returns a table of the hottest locations, as a string.
+
+        :param str sort: See :meth:`stats`.
+        :param int limit: Show this many locations.
+        """
+        lines = ['%10s %12s %12s  %s' % ('calls', 'total ms', 'per call us',
+                                         'location')]
+        for stat in self.stats(sort, limit):
+            lines.append('%10d %12.3f %12.3f  %s  %s' % (
+                stat.calls, stat.time * 1e3, stat.time_per_call * 1e6,
+                stat.location, stat.location.excerpt))
+        return '\n'.join(lines)
+
+
+def is_yield(stmt):
+    return isinstance(stmt, ast.Expr) and isinstance(stmt.value, ast.Yield)
+
+
+def name(id, store=False):
+    return ast.Name(id=id, ctx=ast.Store() if store else ast.Load())
+
+
+def assign(target, value):
+    return ast.Assign(targets=[name(target, True)], value=value)
+
+
+def active_time():
+    # profile_timer() - profile_paused
+    return ast.BinOp(
+        left=build_call(name(TIMER_NAME)),
+        op=ast.Sub(),
+        right=name('profile_paused'),
+    )
+
+
+class Instrumenter(object):
+    """
+    Wraps the statements of the ``root`` function that carry a source
+    position in timers.
+
+    The time the function spends suspended at ``yield`` statements is added
+    up in the local ``profile_paused`` and subtracted from all timers, so
+    each location is only charged for the time the template itself ran.
+    Runs of statements compiled from the same tag are timed as one.
+
+    :param profiler: The :class:`Profiler` to register the locations with.
+    :param dict sources: The source of each template compiled into the
+        function, by origin.
+    """
+
+    def __init__(self, profiler, sources):
+        self.profiler = profiler
+        self.sources = sources
+
+    def instrument(self, func):
+        """
+        Rewrites the body of the function definition ``func`` in place.
+        """
+        func.body = [
+            assign('profile_paused', ast.Num(n=0.0))
+        ] + self.block(func.body)
+        return func
+
+    def location(self, stmt):
+        if not hasattr(stmt, 'lineno'):
+            return None
+        return (getattr(stmt, 'rattle_template', None), stmt.lineno,
+                stmt.col_offset)
+
+    def block(self, stmts):
+        body = []
+        pos = 0
+        while pos < len(stmts):
+            key = self.location(stmts[pos])
+            if key is None:
+                body.extend(self.stmt(stmts[pos]))
+                pos += 1
+                continue
+            group = []
+            while pos < len(stmts) and self.location(stmts[pos]) == key:
+                group.extend(self.stmt(stmts[pos]))
+                pos += 1
+            template, line, column = key
+            index = self.profiler.add_location(
+                template, line, column, self.sources.get(template, ''))
+            start = 'profile_start_%d' % index
+            body.append(assign(start, active_time()))
+            body.extend(group)
+            body.append(ast.Expr(value=build_call(name(RECORD_NAME), [
+                ast.Num(n=index),
+                ast.BinOp(left=active_time(), op=ast.Sub(), right=name(start)),
+            ])))
+        return body
+
+    def stmt(self, stmt):
+        if isinstance(stmt, (ast.For, ast.If)):
+            stmt.body = self.block(stmt.body) or [ast.Pass()]
+            stmt.orelse = self.block(stmt.orelse)
+            return [stmt]
+        if not is_yield(stmt):
+            return [stmt]
+        # profile_value = <value>
+        # profile_pause = profile_timer()
+        # yield profile_value
+        # profile_paused = profile_paused + profile_timer() - profile_pause
+        body = []
+        value = stmt.value.value
+        if not isinstance(value, ast.Str):
+            body.append(assign('profile_value', value))
+            stmt.value.value = name('profile_value')
+        body.append(assign('profile_pause', build_call(name(TIMER_NAME))))
+        body.append(stmt)
+        body.append(assign('profile_paused', ast.BinOp(
+            left=name('profile_paused'),
+            op=ast.Add(),
+            right=ast.BinOp(
+                left=build_call(name(TIMER_NAME)),
+                op=ast.Sub(),
+                right=name('profile_pause'),
+            ),
+        )))
+        return body
+
+
+def instrument(func, profiler, sources):
+    """
+    Runs the :class:`Instrumenter` over the function definition ``func``.
+    """
+    return Instrumenter(profiler, sources).instrument(func)
@@ -1,15 +1,31 @@
 import ast
+import hashlib
 import os
+import time
 
-from .lexer import lexers
-from .parser import parsers
+from .context import Context
+from .metrics import measure_render, observe, sinks as metric_sinks
+from .optimizer import (MISSING_NAME, fold_constants, hoist_lookups, missing,
+    static_text)
 from .utils.astpp import dump as ast_dump
-from .utils.parser import ParserState, build_call, build_str_join
+from .utils.codegen import to_source
+from .utils.parser import ParserState, build_call
 
 
 AST_DEBUG = os.environ.get('RATTLE_AST_DEBUG', False)
 SHOW_CODE = os.environ.get('RATTLE_SHOW_CODE', False)
 
+# Highest resolution clock available
+timer = getattr(time, 'perf_counter', time.time)
+
+# Default number of characters collected before Template.stream yields
+DEFAULT_CHUNK_SIZE = 8192
+
+# Functions rendering templates included or extended at render time, and
+# reading and writing the fragment cache, bound to methods of the template
+RUNTIME_HELPERS = ('include_template', 'extend_template', 'get_fragment',
+                   'set_fragment')
+
 
 class TemplateSyntaxError(Exception):
     pass
@@ -22,6 +38,31 @@ class SafeData(str):
     pass
 
 
+# Types whose string form never contains characters that need escaping
+SAFE_TYPES = (int, float, bool, type(None))
+
+
+def escape_text(text):
+    """
+    Returns the given str with ampersands, quotes and angle brackets encoded
+    for use in HTML.
+
+    Each character is only replaced if a scan finds it, so text that needs
+    no escaping is returned unchanged without being copied.
+    """
+    if '&' in text:
+        text = text.replace('&', '&amp;')
+    if '<' in text:
+        text = text.replace('<', '&lt;')
+    if '>' in text:
+        text = text.replace('>', '&gt;')
+    if '"' in text:
+        text = text.replace('"', '&quot;')
+    if "'" in text:
+        text = text.replace("'", '&#39;')
+    return text
+
+
 def escape(text):
     """
     Returns the given text with ampersands, quotes and angle brackets encoded
@@ -29,17 +70,26 @@ def escape(text):
     """
     if isinstance(text, SafeData):
         return text
+    if type(text) in SAFE_TYPES:
+        return SafeData(text)
     if not isinstance(text, str):
         text = str(text)
-    return SafeData(
-        text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
-            .replace('"', '&quot;').replace("'", '&#39;')
-    )
+    return SafeData(escape_text(text))
 
 
 def auto_escape(s):
-    if isinstance(s, SafeData):
+    """
+    Escapes a value for output. This is called for every ``{{ }}``, so the
+    common types are dispatched on directly and the result is not wrapped
+    in :class:`SafeData`.
+    """
+    t = type(s)
+    if t is str:
+        return escape_text(s)
+    if t is SafeData:
         return s
+    if t in SAFE_TYPES:
+        return str(s)
     return escape(s)
 
 
@@ -99,58 +149,324 @@ class Library(object):
 library = Library()
 
 
+def source_digest(source):
+    """
+    Returns a digest of the template ``source``, to tell whether a template
+    changed.
+    """
+    if not isinstance(source, bytes):
+        source = source.encode('utf-8')
+    return hashlib.sha1(source).hexdigest()
+
+
+def func_name(func):
+    """
+    Returns the full name a function is registered in the :class:`Library`
+    under.
+    """
+    return '%s.%s' % (func.__module__, func.__name__)
+
+
+class FilterResolver(object):
+    """
+    Replaces the ``filters[name]`` placeholders emitted by the filter parser
+    with references to module globals bound to the filter functions, so a
+    filter application at render time is only a function call.
+
+    The tree is walked with a stack of its own rather than by recursion, so
+    the depth of nesting it takes is not limited by this pass.
+
+    :param dict filters: Available filters, by name.
+    """
+
+    def __init__(self, filters):
+        self.filters = filters
+        # Maps filter names to the global names holding the functions
+        self.names = {}
+        # Maps the global names to the filter functions
+        self.funcs = {}
+
+    def visit(self, tree):
+        """
+        Replaces the placeholders in ``tree`` in place, and returns it.
+        """
+        # ``(node, the innermost node containing it with a source position)``
+        stack = [(tree, None)]
+        while stack:
+            node, located = stack.pop()
+            if hasattr(node, 'lineno'):
+                located = node
+            children = []
+            for field, value in ast.iter_fields(node):
+                if isinstance(value, list):
+                    for i, child in enumerate(value):
+                        if is_filter(child):
+                            value[i] = self.resolve(child, located)
+                        elif isinstance(child, ast.AST):
+                            children.append(child)
+                elif is_filter(value):
+                    setattr(node, field, self.resolve(value, located))
+                elif isinstance(value, ast.AST):
+                    children.append(value)
+            # Filters are numbered in the order they appear
+            stack.extend((child, located) for child in reversed(children))
+        return tree
+
+    def resolve(self, node, located):
+        name = node.slice.value.s
+        if name not in self.names:
+            try:
+                func = self.filters[name]
+            except KeyError:
+                error = TemplateSyntaxError('Unknown filter: %s' % name)
+                if located is not None:
+                    from rply.token import SourcePosition
+                    error.source_pos = SourcePosition(
+                        None, located.lineno, located.col_offset)
+                raise error
+            global_name = 'filter_%d' % len(self.names)
+            self.names[name] = global_name
+            self.funcs[global_name] = func
+        return ast.copy_location(
+            ast.Name(id=self.names[name], ctx=ast.Load()),
+            node
+        )
+
+
+def is_filter(node):
+    """
+    Returns ``True`` if ``node`` is a ``filters[name]`` placeholder.
+    """
+    if not isinstance(node, ast.Subscript):
+        return False
+    value = node.value
+    return isinstance(value, ast.Name) and value.id == 'filters'
+
+
 class Template(object):
+    """
+    A compiled template.
 
-    def __init__(self, source, origin=None):
+    :param str source: The template source.
+    :param origin: Where the source was read from, like its path.
+    :param bytecode_cache: A :class:`rattle.cache.BytecodeCache` to load the
+        compiled template from, or store it in.
+    :param loader: The loader of the templates this one includes or extends.
+        Defaults to :data:`rattle.loader.loader`.
+    :param str parent: For a template naming its parent with an expression,
+        the parent to compile it with. Used by :meth:`extend_template`.
+    :param fragment_cache: The :class:`rattle.cache.FragmentCache` of the
+        ``{% cache %}`` tags. Defaults to :data:`rattle.cache.fragment_cache`.
+    :param bool collapse_whitespace: Collapse the runs of whitespace in the
+        template text, and that of the templates compiled into it, as in
+        ``{% spaceless %}``.
+    :param profiler: A :class:`rattle.profiler.Profiler` to time the
+        variables and tags of the template with. Instrumented templates are
+        never stored in or loaded from the bytecode cache.
+    """
+
+    def __init__(self, source, origin=None, bytecode_cache=None, loader=None,
+                 parent=None, fragment_cache=None, collapse_whitespace=False,
+                 profiler=None):
         self.source = source
         self.origin = origin
+        self.loader = loader
+        self.parent = parent
+        self.fragment_cache = fragment_cache
+        self.collapse_whitespace = collapse_whitespace
+        self.profiler = profiler
+        if profiler is not None:
+            # The code refers to the locations registered with the profiler
+            bytecode_cache = None
+
+        # ``(name, path, digest)`` of the templates compiled into this one
+        self.dependencies = []
+
+        # Compiled variants for parents named by an expression, by name
+        self._extended = {}
+
+        # Prefix of the keys of the fragments of the ``{% cache %}`` tags
+        self._fragment_prefix = None
 
         # A list of compiled tags
         self.compiled_tags = []
 
+        # Filter functions referenced by the compiled code, by global name
+        self.filter_funcs = {}
+
+        # The complete output, for templates without dynamic parts
+        self.static = None
+
+        self.func = None
+        if bytecode_cache is not None:
+            self.load_bytecode(bytecode_cache)
+        if self.func is None:
+            start = timer()
+            self.func = self.compile()
+            if metric_sinks:
+                observe('compile_time', self.origin, timer() - start)
+            if bytecode_cache is not None:
+                self.store_bytecode(bytecode_cache)
+
+        # Execute the compiled module once, keeping hold of the bound entry
+        # function so rendering is just a call into the generator.
+        global_ctx = self._make_globals()
+        exec(self.func, global_ctx)
+        self._bind(global_ctx['root'])
+
+    @classmethod
+    def from_module(cls, module, loader=None):
+        """
+        Returns the template precompiled into ``module`` by
+        :mod:`rattle.compiler`, without lexing or parsing its source.
+
+        Only the async variant is compiled from the source, on first use.
+        """
+        template = cls.__new__(cls)
+        template.source = module.source
+        template.origin = module.origin
+        template.loader = loader
+        template.parent = None
+        template.fragment_cache = None
+        template.collapse_whitespace = False
+        template.profiler = None
+        template.dependencies = []
+        template._extended = {}
+        template._fragment_prefix = None
+        template.compiled_tags = module.compiled_tags
+        template.filter_funcs = dict(module.filter_funcs)
+        template.static = module.static
+        template.func = None
+        for name in RUNTIME_HELPERS:
+            if hasattr(module, name):
+                setattr(module, name, getattr(template, name))
+        template._bind(module.root)
+        return template
+
+    def _bind(self, root):
+        self.default_context = {
+            'True': True,
+            'False': False,
+            'None': None,
+        }
+        self.root = root
+
+        # The async variant is only compiled on first use
+        self._async_root = None
+
+    def compile(self):
+        """
+        Parses and compiles the template.
+
+        :returns: The code object of the module built by :meth:`parse`.
+        """
         code = self.parse()
         ast.fix_missing_locations(code)
         if AST_DEBUG:
             print(ast_dump(code))
         if SHOW_CODE:
+            print(to_source(code))
+        return compile(code, filename="<template>", mode="exec")
+
+    def load_bytecode(self, bytecode_cache):
+        """
+        Loads the compiled template from ``bytecode_cache``, if it has an
+        entry for the source and all the filters it uses are still
+        registered.
+        """
+        cached = bytecode_cache.load(self.source, self.compile_options())
+        if cached is None:
+            return
+        func, static, filter_names, dependencies = cached
+        filter_funcs = {}
+        for global_name, name in filter_names.items():
+            if name not in library.filters:
+                return
+            filter_funcs[global_name] = library.filters[name]
+        # The templates compiled into this one must not have changed
+        loader = self.get_loader()
+        found = []
+        for name, digest in dependencies:
             try:
-                import codegen
-                print(codegen.to_source(code))
-            except ImportError:
-                pass
-        self.func = compile(code, filename="<template>", mode="exec")
+                source, path = loader.get_source(name)
+            except (ValueError, IOError, OSError):
+                return
+            if source_digest(source) != digest:
+                return
+            found.append((name, path, digest))
+        self.func, self.static, self.filter_funcs = func, static, filter_funcs
+        self.dependencies = found
 
-        self.default_context = {
-            'True': True,
-            'False': False,
-            'None': None,
-        }
+    def compile_options(self):
+        """
+        Returns the options changing the compiled code, as a string, to key
+        the bytecode cache by.
+        """
+        return 'collapse_whitespace' if self.collapse_whitespace else ''
+
+    def store_bytecode(self, bytecode_cache):
+        """
+        Stores the compiled template in ``bytecode_cache``.
+        """
+        filter_names = dict(
+            (global_name, func_name(func))
+            for global_name, func in self.filter_funcs.items()
+        )
+        dependencies = [
+            (name, digest) for name, path, digest in self.dependencies
+        ]
+        bytecode_cache.store(self.source, self.func, self.static, filter_names,
+                             dependencies, self.compile_options())
 
     def parse(self):
         """
-        Convert the parsed tokens into a list of expressions then join them
+        Convert the parsed tokens into a module defining the template class
+        and binding its entry function to ``root``.
+
+        Filters are resolved here, so an unknown filter raises a
+        :class:`TemplateSyntaxError`. Constant expressions are folded, and if
+        the template has no dynamic parts at all its output is kept in
+        :attr:`static`.
         """
+        # The parsers are only built when a template is first compiled, so
+        # precompiled templates never load rply.
+        from .lexer import lexers
+        from .parser import parsers
+
         tokens = lexers.sl.lex(self.source)
-        state = ParserState()
+        state = ParserState(self.loader, self.origin)
+        state.parent = self.parent
+        state.collapse_whitespace = self.collapse_whitespace
+        state.instrument = self.profiler is not None
         klass = parsers.sp.parse(tokens, state)
+        self.dependencies = [
+            (name, path, source_digest(source))
+            for name, path, source in state.dependencies
+        ]
+        resolver = FilterResolver(library.filters)
+        klass = resolver.visit(klass)
+        self.filter_funcs = resolver.funcs
+
+        root_func = state.blocks[0]
+        fold_constants(root_func, self._make_foldable())
+        self.static = static_text(root_func)
+        hoist_lookups(root_func)
+        if self.profiler is not None:
+            from .profiler import instrument
+            sources = dict(
+                (path, source) for _, path, source in state.dependencies)
+            sources[self.origin] = self.source
+            instrument(root_func, self.profiler, sources)
         body = [
             klass,
-            ast.Global(names=['rendered']),
             ast.Assign(
-                targets=[ast.Name(id='rendered', ctx=ast.Store())],
-                value=build_str_join(
-                    build_call(
-                        ast.Attribute(
-                            value=build_call(
-                                ast.Name(id='Template', ctx=ast.Load())
-                            ),
-                            attr='root',
-                            ctx=ast.Load()
-                        ),
-                        args=[
-                            ast.Name(id='context', ctx=ast.Load())
-                        ],
-                    )
+                targets=[ast.Name(id='root', ctx=ast.Store())],
+                value=ast.Attribute(
+                    value=build_call(
+                        ast.Name(id='Template', ctx=ast.Load())
+                    ),
+                    attr='root',
+                    ctx=ast.Load()
                 )
             )
         ]
@@ -158,18 +474,251 @@ class Template(object):
             body=body
         )
 
-    def render(self, context={}):
-        ctx = context.copy()
-        ctx.update(self.default_context)
+    def _make_foldable(self):
+        # Functions that may be called at compile time on constant arguments.
+        # Filters with a true ``volatile`` attribute are always left to
+        # render time.
+        foldable = {'auto_escape': auto_escape}
+        for name, func in self.filter_funcs.items():
+            if not getattr(func, 'volatile', False):
+                foldable[name] = func
+        return foldable
+
+    def _make_globals(self):
         global_ctx = {
-            'context': ctx,
             'compiled_tags': self.compiled_tags,
-            'filters': library.filters,
             'auto_escape': auto_escape,
-            'output': [],
-            'rendered': None
-        }
-        local_ctx = {
+            MISSING_NAME: missing,
         }
-        eval(self.func, global_ctx, local_ctx)
-        return global_ctx['rendered']
+        global_ctx.update(self.filter_funcs)
+        for name in RUNTIME_HELPERS:
+            global_ctx[name] = getattr(self, name)
+        if self.profiler is not None:
+            from .profiler import RECORD_NAME, TIMER_NAME, timer
+            global_ctx[TIMER_NAME] = timer
+            global_ctx[RECORD_NAME] = self.profiler.record
+        return global_ctx
+
+    def get_loader(self):
+        if self.loader is None:
+            from .loader import loader
+            return loader
+        return self.loader
+
+    def get_template(self, name):
+        """
+        Returns the template ``name`` from the loader, for templates included
+        or extended at render time. The loader keeps the compiled templates.
+        """
+        return self.get_loader().select_template(name)
+
+    def include_context(self, context, bindings):
+        # Loop variables of the including template live in locals
+        if bindings:
+            return Context(bindings, *context.maps)
+        return context
+
+    def include_template(self, name, context, bindings):
+        """
+        Renders the template ``name`` with ``context``, for ``{% include %}``
+        tags naming a template with an expression, or including themselves.
+
+        :param dict bindings: The loop variables of the including template.
+        :returns: A generator of strings.
+        """
+        return self.get_template(name).root(
+            self.include_context(context, bindings))
+
+    def extend_template(self, name, context):
+        """
+        Renders this template extending the template ``name``, for
+        ``{% extends %}`` tags naming the parent with an expression.
+
+        :returns: A generator of strings.
+        """
+        return self.get_extended(name).root(context)
+
+    def get_extended(self, name):
+        """
+        Returns this template compiled with the parent ``name``. The result
+        is kept until the loader compiles the parent again.
+        """
+        parent = self.get_template(name)
+        cached = self._extended.get(name)
+        if cached is None or cached[0] is not parent:
+            template = self.__class__(
+                self.source, self.origin, loader=self.loader, parent=name,
+                fragment_cache=self.fragment_cache,
+                collapse_whitespace=self.collapse_whitespace,
+                profiler=self.profiler)
+            cached = self._extended[name] = (parent, template)
+        return cached[1]
+
+    def get_fragment_cache(self):
+        if self.fragment_cache is None:
+            from .cache import fragment_cache
+            return fragment_cache
+        return self.fragment_cache
+
+    def fragment_key(self, scope, key):
+        """
+        Returns the key the fragment of a ``{% cache %}`` tag is stored
+        under: the tag's ``key``, prefixed with the origin of the template
+        (or a digest of its source, if it has none) and ``scope``, which
+        locates the tag in it, so tags of different templates, or in
+        different places, never share fragments.
+
+        Tags ending in ``shared``, like ``{% cache "nav" shared %}``, have no
+        ``scope`` and store their fragments under ``key`` alone, so all tags
+        with the same key share them.
+        """
+        if scope is None:
+            return key
+        prefix = self._fragment_prefix
+        if prefix is None:
+            origin = self.origin
+            if origin is None:
+                origin = source_digest(self.source)
+            prefix = self._fragment_prefix = '%s:' % origin
+        return '%s%s:%s' % (prefix, scope, key)
+
+    def get_fragment(self, scope, key):
+        """
+        Returns the fragment cached for a ``{% cache %}`` tag, or ``None``.
+        """
+        return self.get_fragment_cache().get(self.fragment_key(scope, key))
+
+    def set_fragment(self, scope, key, value, ttl=None):
+        """
+        Caches the output ``value`` of a ``{% cache %}`` tag.
+        """
+        self.get_fragment_cache().set(self.fragment_key(scope, key), value,
+                                      ttl)
+
+    def _make_context(self, context):
+        # Neither the caller's mapping nor the defaults are copied; writes go
+        # to the context's own render scope.
+        return Context(self.default_context, context)
+
+    def render(self, context={}):
+        if metric_sinks:
+            return ''.join(self._measured_chunks(context))
+        if self.static is not None:
+            return self.static
+        return ''.join(self.root(self._make_context(context)))
+
+    def _measured_chunks(self, context):
+        # The output, reported to the metrics sinks
+        if self.static is not None:
+            chunks = [self.static]
+        else:
+            chunks = self.root(self._make_context(context))
+        return measure_render(self.origin, chunks)
+
+    def stream(self, context={}, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Renders the template incrementally.
+
+        The many small strings produced by the template are merged into
+        chunks of at least ``chunk_size`` characters (only the final chunk
+        may be shorter), so the caller can start sending output before the
+        whole template has been rendered.
+
+        :param dict context: The template context.
+        :param int chunk_size: Minimum number of characters per chunk.
+        :returns: A generator of strings.
+        """
+        # Checked here, as the generator would only raise on first use
+        if chunk_size < 1:
+            raise ValueError('chunk_size must be a positive integer')
+        return self._stream(context, chunk_size)
+
+    def _stream(self, context, chunk_size):
+        if metric_sinks:
+            chunks = self._measured_chunks(context)
+        else:
+            chunks = self.root(self._make_context(context))
+        buf = []
+        size = 0
+        for s in chunks:
+            buf.append(s)
+            size += len(s)
+            if size >= chunk_size:
+                yield ''.join(buf)
+                buf = []
+                size = 0
+        if size:
+            yield ''.join(buf)
+
+    def render_to(self, fp, context={}, chunk_size=DEFAULT_CHUNK_SIZE,
+                  encoding=None):
+        """
+        Renders the template into the file-like object ``fp``.
+
+        The output is written in chunks as produced by :meth:`stream`, so the
+        rendered template is never held in memory as a whole.
+
+        :param fp: An object with a ``write`` method.
+        :param dict context: The template context.
+        :param int chunk_size: Minimum number of characters per write.
+        :param str encoding: If given, chunks are encoded before they are
+            written, for binary files and sockets.
+        """
+        write = fp.write
+        if self.static is not None and not metric_sinks:
+            chunks = [self.static] if self.static else []
+        else:
+            chunks = self.stream(context, chunk_size)
+        if encoding is None:
+            for chunk in chunks:
+                write(chunk)
+        else:
+            for chunk in chunks:
+                write(chunk.encode(encoding))
+
+    @property
+    def async_root(self):
+        """
+        The entry function of the async variant of this template, compiled
+        on first access. Requires Python 3.6 or newer.
+        """
+        if self._async_root is None:
+            from .asyncsupport import compile_async
+            self._async_root = compile_async(self)
+        return self._async_root
+
+    def render_async(self, context={}):
+        """
+        Renders the template on an asyncio event loop.
+
+        Awaitable values in the context, and awaitables returned by calls,
+        attribute and item lookups, are awaited. ``{% for %}`` accepts async
+        iterables as well as regular ones.
+
+        :param dict context: The template context.
+        :returns: A coroutine resolving to the rendered string.
+        """
+        from .asyncsupport import render_async
+        return render_async(self._measured_async_root(),
+                            self._make_context(context))
+
+    def stream_async(self, context={}, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Async counterpart of :meth:`stream`.
+
+        :param dict context: The template context.
+        :param int chunk_size: Minimum number of characters per chunk.
+        :returns: An async generator of strings.
+        """
+        if chunk_size < 1:
+            raise ValueError('chunk_size must be a positive integer')
+        from .asyncsupport import stream_async
+        return stream_async(self._measured_async_root(),
+                            self._make_context(context), chunk_size)
+
+    def _measured_async_root(self):
+        # The async entry function, reporting to the metrics sinks if any
+        if metric_sinks:
+            from .asyncsupport import measure_root
+            return measure_root(self.origin, self.async_root)
+        return self.async_root
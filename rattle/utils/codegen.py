@@ -0,0 +1,214 @@
+"""
+Turns the AST of a compiled template back into Python source.
+
+Only the node types the template compiler produces are supported. Compound
+expressions are always parenthesised, so the output does not depend on
+operator precedence, and the same AST always produces the same source.
+"""
+import ast
+
+
+INDENT = '    '
+
+BINOPS = {
+    ast.Add: '+',
+    ast.Sub: '-',
+    ast.Mult: '*',
+    ast.Div: '/',
+    ast.FloorDiv: '//',
+    ast.Mod: '%',
+    ast.Pow: '**',
+}
+
+BOOLOPS = {
+    ast.And: 'and',
+    ast.Or: 'or',
+}
+
+CMPOPS = {
+    ast.Eq: '==',
+    ast.NotEq: '!=',
+    ast.Lt: '<',
+    ast.LtE: '<=',
+    ast.Gt: '>',
+    ast.GtE: '>=',
+    ast.In: 'in',
+    ast.NotIn: 'not in',
+    ast.Is: 'is',
+    ast.IsNot: 'is not',
+}
+
+UNARYOPS = {
+    ast.Not: 'not ',
+    ast.USub: '-',
+    ast.UAdd: '+',
+}
+
+
+class SourceGenerator(object):
+
+    def __init__(self):
+        self.lines = []
+
+    def write(self, level, line):
+        self.lines.append(INDENT * level + line)
+
+    def visit_stmts(self, stmts, level):
+        for stmt in stmts:
+            method = getattr(self, 'visit_' + stmt.__class__.__name__, None)
+            if method is None:
+                raise TypeError(
+                    'Cannot generate source for %s' % stmt.__class__.__name__)
+            method(stmt, level)
+
+    def visit_Module(self, node, level):
+        self.visit_stmts(node.body, level)
+
+    def visit_ClassDef(self, node, level):
+        bases = ', '.join(self.expr(base) for base in node.bases)
+        self.write(level, 'class %s(%s):' % (node.name, bases))
+        self.write(0, '')
+        self.visit_stmts(node.body, level + 1)
+        self.write(0, '')
+
+    def visit_FunctionDef(self, node, level):
+        args = [
+            getattr(arg, 'arg', None) or getattr(arg, 'id')
+            for arg in node.args.args
+        ]
+        self.write(level, 'def %s(%s):' % (node.name, ', '.join(args)))
+        self.visit_stmts(node.body, level + 1)
+
+    def visit_Assign(self, node, level):
+        targets = ' = '.join(self.expr(target) for target in node.targets)
+        self.write(level, '%s = %s' % (targets, self.expr(node.value)))
+
+    def visit_Expr(self, node, level):
+        if isinstance(node.value, ast.Yield):
+            self.write(level, 'yield %s' % self.expr(node.value.value))
+        else:
+            self.write(level, self.expr(node.value))
+
+    def visit_Pass(self, node, level):
+        self.write(level, 'pass')
+
+    def visit_If(self, node, level):
+        self.write(level, 'if %s:' % self.expr(node.test))
+        self.visit_stmts(node.body, level + 1)
+        if node.orelse:
+            self.write(level, 'else:')
+            self.visit_stmts(node.orelse, level + 1)
+
+    def visit_For(self, node, level):
+        self.write(level, 'for %s in %s:' % (
+            self.expr(node.target), self.expr(node.iter)))
+        self.visit_stmts(node.body, level + 1)
+        if node.orelse:
+            self.write(level, 'else:')
+            self.visit_stmts(node.orelse, level + 1)
+
+    def visit_With(self, node, level):
+        items = getattr(node, 'items', None)
+        if items is None:
+            items = [node]
+        parts = []
+        for item in items:
+            part = self.expr(item.context_expr)
+            if item.optional_vars is not None:
+                part += ' as ' + self.expr(item.optional_vars)
+            parts.append(part)
+        self.write(level, 'with %s:' % ', '.join(parts))
+        self.visit_stmts(node.body, level + 1)
+
+    def expr(self, node):
+        method = getattr(self, 'expr_' + node.__class__.__name__, None)
+        if method is None:
+            raise TypeError(
+                'Cannot generate source for %s' % node.__class__.__name__)
+        return method(node)
+
+    def expr_Name(self, node):
+        return node.id
+
+    def expr_NameConstant(self, node):
+        return repr(node.value)
+
+    def expr_Str(self, node):
+        return repr(node.s)
+
+    def expr_Num(self, node):
+        return repr(node.n)
+
+    def expr_Attribute(self, node):
+        value = self.expr(node.value)
+        if not isinstance(node.value, (ast.Name, ast.Attribute, ast.Call,
+                                       ast.Subscript)):
+            value = '(%s)' % value
+        return '%s.%s' % (value, node.attr)
+
+    def expr_Subscript(self, node):
+        value = self.expr(node.value)
+        if not isinstance(node.value, (ast.Name, ast.Attribute, ast.Call,
+                                       ast.Subscript)):
+            value = '(%s)' % value
+        return '%s[%s]' % (value, self.expr(node.slice))
+
+    def expr_Index(self, node):
+        return self.expr(node.value)
+
+    def expr_Call(self, node):
+        func = self.expr(node.func)
+        if not isinstance(node.func, (ast.Name, ast.Attribute, ast.Call,
+                                      ast.Subscript)):
+            func = '(%s)' % func
+        args = [self.expr(arg) for arg in node.args]
+        args.extend(
+            '%s=%s' % (keyword.arg, self.expr(keyword.value))
+            for keyword in node.keywords
+        )
+        return '%s(%s)' % (func, ', '.join(args))
+
+    def expr_BinOp(self, node):
+        return '(%s %s %s)' % (
+            self.expr(node.left),
+            BINOPS[node.op.__class__],
+            self.expr(node.right),
+        )
+
+    def expr_BoolOp(self, node):
+        op = ' %s ' % BOOLOPS[node.op.__class__]
+        return '(%s)' % op.join(self.expr(value) for value in node.values)
+
+    def expr_Compare(self, node):
+        parts = [self.expr(node.left)]
+        for op, comparator in zip(node.ops, node.comparators):
+            parts.append(CMPOPS[op.__class__])
+            parts.append(self.expr(comparator))
+        return '(%s)' % ' '.join(parts)
+
+    def expr_UnaryOp(self, node):
+        return '(%s%s)' % (UNARYOPS[node.op.__class__], self.expr(node.operand))
+
+    def expr_List(self, node):
+        return '[%s]' % ', '.join(self.expr(elt) for elt in node.elts)
+
+    def expr_Dict(self, node):
+        return '{%s}' % ', '.join(
+            '%s: %s' % (self.expr(key), self.expr(value))
+            for key, value in zip(node.keys, node.values)
+        )
+
+    def expr_Tuple(self, node):
+        elts = [self.expr(elt) for elt in node.elts]
+        if len(elts) == 1:
+            return '(%s,)' % elts[0]
+        return '(%s)' % ', '.join(elts)
+
+
+def to_source(node):
+    """
+    Returns Python source for the module or statement ``node``.
+    """
+    generator = SourceGenerator()
+    generator.visit_stmts([node], 0)
+    return '\n'.join(generator.lines) + '\n'
@@ -8,9 +8,52 @@ class ParserState(object):
     Used to keep state information during template parsing, e.g. current block.
     """
 
-    def __init__(self):
+    def __init__(self, loader=None, origin=None):
         self.blocks = []
 
+        #: Loader of the templates included or extended at compile time.
+        #: Defaults to :data:`rattle.loader.loader`.
+        self.loader = loader
+
+        #: Origins of the templates being compiled, outermost first
+        self.templates = [origin]
+
+        #: Names of the templates being compiled, outermost first; the
+        #: outermost has none
+        self.names = [None]
+
+        #: ``(name, path, source)`` of every template inlined
+        self.dependencies = []
+
+        #: The expression naming the parent of the template being compiled,
+        #: and the start token of its ``{% extends %}``
+        self.extends = None
+
+        #: Bodies of the ``{% block %}`` tags of the template being compiled
+        self.template_blocks = {}
+
+        #: Bodies of the blocks of the templates extending the one being
+        #: compiled, replacing its own
+        self.overrides = {}
+
+        #: Parent template name of an outermost template that names its
+        #: parent with an expression
+        self.parent = None
+
+        #: Number of ``{% cache %}`` tags compiled, to name their locals
+        self.cache_tags = 0
+
+        #: Whether runs of whitespace in the template text are collapsed
+        self.collapse_whitespace = False
+
+        #: Whether statements are marked with the template they come from,
+        #: for :mod:`rattle.profiler`
+        self.instrument = False
+
+        #: The element whose text is kept as is while collapsing whitespace,
+        #: like ``pre``, if the text so far leaves one open
+        self.preserved = None
+
     def append_to_block(self, value):
         """
         Appends the given value to the body of the currently active block
@@ -124,6 +167,34 @@ def build_class():
     return klass, root_func
 
 
+def build_scope(body):
+    """
+    Constructs a :class:`ast.With` node that runs ``body`` in a new scope of
+    the template context.
+
+    This is equivalent to::
+
+        with context.push():
+            body
+
+    :param body: A list of :class:`ast.stmt` nodes.
+    :rtype: :class:`ast.With`
+    """
+    push = build_call(
+        func=ast.Attribute(
+            value=ast.Name(id='context', ctx=ast.Load()),
+            attr='push',
+            ctx=ast.Load()
+        )
+    )
+    if PY3:
+        return ast.With(
+            items=[ast.withitem(context_expr=push, optional_vars=None)],
+            body=body
+        )
+    return ast.With(context_expr=push, optional_vars=None, body=body)
+
+
 def build_str_join(l):
     """
     Constructs a :class:`ast.Call` that joins all elements of ``l`` with an
@@ -169,7 +240,10 @@ def get_filter_func(name):
 
         filters[name]
 
-    :param str name: The filter name.
+    The lookup is only a placeholder: when the template is compiled, it is
+    replaced by a reference to the filter function itself.
+
+    :param ast.Str name: The filter name.
     :returns: A filter function.
     :rtype: ast.Subscript
     """
@@ -182,7 +256,7 @@ def get_filter_func(name):
 
 def get_lookup_name(names):
     """
-    Joins all ``names`` by ``'.'``.
+    Joins all ``names`` by ``'.'`` at compile time.
 
     This is equivalent to::
 
@@ -192,19 +266,10 @@ def get_lookup_name(names):
         joined by a dot and will be used to find a filter or tag function /
         class.
     :type names: list of :class:`ast.Str`
-    :returns: ``'.'.join(names)``
-    :rtype: :class:`ast.Call`
+    :returns: The joined name as a constant.
+    :rtype: :class:`ast.Str`
     """
-    func = ast.Attribute(
-        value=ast.Str(s='.'),
-        attr='join',
-        ctx=ast.Load()
-    )
-    args = [ast.List(
-        elts=names,
-        ctx=ast.Load()
-    )]
-    return build_call(func, args)
+    return ast.Str(s='.'.join(name.s for name in names))
 
 
 def split_tag_args_string(s):
@@ -0,0 +1,19 @@
+"""
+Helpers for the async rendering tests. Requires Python 3.6 or newer.
+"""
+import asyncio
+
+
+async def value(v):
+    await asyncio.sleep(0)
+    return v
+
+
+async def agen(items):
+    for item in items:
+        await asyncio.sleep(0)
+        yield item
+
+
+async def collect(aiter):
+    return [s async for s in aiter]
@@ -1,4 +1,4 @@
-from rattle.template import library
+from rattle.template import SafeData, library
 
 
 @library.register_filter
@@ -21,3 +21,23 @@ def quote(value):
 @library.register_filter
 def squote(value):
     return "'%s'" % value
+
+
+@library.register_filter
+def length(value):
+    return len(value)
+
+
+@library.register_filter
+def tick(value):
+    tick.count += 1
+    return '%s%d' % (value, tick.count)
+
+
+tick.count = 0
+tick.volatile = True
+
+
+@library.register_filter
+def safe(value):
+    return SafeData(value)
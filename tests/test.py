@@ -1,3 +1,5 @@
+from rattle.template import Template
+
 from tests.utils import TemplateTestCase
 
 
@@ -5,3 +7,8 @@ class SpecialCaseTests(TemplateTestCase):
 
     def test_empty_template(self):
         self.assertRendered('', '')
+
+    def test_render_repeatedly(self):
+        tmpl = Template('{{ a }}')
+        self.assertEqual(tmpl.render({'a': 1}), '1')
+        self.assertEqual(tmpl.render({'a': 2}), '2')
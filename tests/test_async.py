@@ -0,0 +1,72 @@
+import sys
+from unittest import TestCase, skipIf
+
+from rattle.template import Template
+
+import tests.filters  # noqa: necessary to register test filters
+from tests.utils import Mock
+
+if sys.version_info >= (3, 6):
+    import asyncio
+    from tests.asyncutils import agen, collect, value
+
+
+@skipIf(sys.version_info < (3, 6), 'async rendering requires Python 3.6+')
+class AsyncRenderTest(TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def assertRenderedAsync(self, source, expected, context=None):
+        tmpl = Template(source)
+        rendered = self.loop.run_until_complete(
+            tmpl.render_async({} if context is None else context))
+        self.assertEqual(rendered, expected)
+
+    def test_plain_context(self):
+        self.assertRenderedAsync(
+            'Hello {{ a }}{% if b %}!{% endif %}', 'Hello world!',
+            {'a': 'world', 'b': True})
+
+    def test_awaitable_values(self):
+        TESTS = (
+            ('{{ a }}', {'a': value('x')}, 'x'),
+            ('{{ a }}{{ a }}', {'a': value('x')}, 'xx'),
+            ('{{ a.b }}', {'a': value(Mock(b=value(1)))}, '1'),
+            ('{{ a["b"] }}', {'a': value({'b': 'y'})}, 'y'),
+            ('{{ a() }}', {'a': lambda: value('z')}, 'z'),
+            ('{{ a|quote }}', {'a': value('q')}, '&quot;q&quot;'),
+            ('{% if a %}yes{% endif %}', {'a': value(False)}, ''),
+        )
+        for src, ctx, expect in TESTS:
+            self.assertRenderedAsync(src, expect, ctx)
+
+    def test_for_async_iterable(self):
+        self.assertRenderedAsync(
+            '{% for a in b %}{{ a }}{% endfor %}', '123',
+            {'b': agen([1, 2, 3])})
+
+    def test_for_awaitable_iterable(self):
+        self.assertRenderedAsync(
+            '{% for a in b %}{{ a }}{% endfor %}', '123',
+            {'b': value([1, 2, 3])})
+
+    def test_for_nested_async(self):
+        self.assertRenderedAsync(
+            '{% for a in b %}{% for c in a %}{{ c }}{% endfor %}-{% endfor %}',
+            '12-34-',
+            {'b': agen([agen([1, 2]), [3, value(4)]])})
+
+    def test_stream_async(self):
+        tmpl = Template('{% for a in b %}{{ a }}{% endfor %}')
+        chunks = self.loop.run_until_complete(collect(
+            tmpl.stream_async({'b': agen(range(10))}, chunk_size=4)))
+        self.assertEqual(chunks, ['0123', '4567', '89'])
+
+    def test_sync_render_unaffected(self):
+        tmpl = Template('{% for a in b %}{{ a }}{% endfor %}')
+        self.loop.run_until_complete(tmpl.render_async({'b': [1]}))
+        self.assertEqual(tmpl.render({'b': [1, 2]}), '12')
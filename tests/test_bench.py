@@ -0,0 +1,114 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+from unittest import TestCase
+
+from rattle import bench
+from rattle.template import Template, library
+
+if sys.version_info[0] == 3:
+    from io import StringIO
+else:
+    from io import BytesIO as StringIO
+
+
+class BenchTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.stdout = sys.stdout
+        sys.stdout = StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def main(self, *args):
+        return bench.main(['-k', 'render/small', '-r', '2',
+                           '--min-time', '0.001'] + list(args))
+
+    def test_templates(self):
+        with bench.bench_filters():
+            for name, (source, context) in bench.TEMPLATES.items():
+                self.assertTrue(Template(source).render(context), name)
+
+    def test_filters_not_shared(self):
+        self.assertNotIn('truncate', library.filters)
+        with bench.bench_filters():
+            self.assertIs(library.filters['truncate'], bench.truncate)
+        self.assertNotIn('truncate', library.filters)
+
+    def test_names(self):
+        with bench.bench_filters():
+            benchmarks = bench.build_benchmarks()
+        names = [name for name, _ in benchmarks]
+        self.assertEqual(names[0], 'import')
+        for stage in ('lex', 'parse', 'compile', 'render'):
+            for template in ('small', 'large', 'loops', 'filters'):
+                self.assertIn('%s/%s' % (stage, template), names)
+
+    def test_summarize(self):
+        self.assertEqual(bench.summarize([3, 1, 2], 10), (1, 2, 10, 3))
+        self.assertEqual(bench.summarize([4, 1, 2, 3], 1), (1, 2.5, 1, 4))
+
+    def test_measure(self):
+        result = bench.measure(lambda: None, 3, 0.001)
+        self.assertEqual(result.repeat, 3)
+        self.assertGreater(result.number, 1)
+        self.assertLessEqual(result.best, result.median)
+
+    def test_compare(self):
+        baseline = {'benchmarks': {
+            'a': {'best': 1.0}, 'b': {'best': 1.0}, 'gone': {'best': 1.0},
+        }}
+        results = {'benchmarks': {
+            'a': {'best': 1.05}, 'b': {'best': 1.2}, 'new': {'best': 1.0},
+        }}
+        changes = bench.compare(results, baseline, 10)
+        self.assertEqual([(name, regressed) for name, _, _, _, regressed
+                          in changes], [('a', False), ('b', True)])
+        self.assertAlmostEqual(changes[1][3], 20)
+
+    def test_output(self):
+        self.assertEqual(self.main('-o', self.path('out.json')), 0)
+        with open(self.path('out.json')) as f:
+            results = json.load(f)
+        self.assertEqual(results['format'], bench.FORMAT)
+        self.assertEqual(list(results['benchmarks']), ['render/small'])
+        self.assertEqual(
+            sorted(results['benchmarks']['render/small']),
+            ['best', 'median', 'number', 'repeat'])
+
+    def test_output_stdout(self):
+        stderr, sys.stderr = sys.stderr, StringIO()
+        try:
+            self.assertEqual(self.main('-o', '-'), 0)
+            self.assertIn('render/small', sys.stderr.getvalue())
+        finally:
+            sys.stderr = stderr
+        results = json.loads(sys.stdout.getvalue())
+        self.assertEqual(list(results['benchmarks']), ['render/small'])
+
+    def test_baseline(self):
+        def write(best):
+            with open(self.path('baseline.json'), 'w') as f:
+                json.dump({'benchmarks': {'render/small': {'best': best}}}, f)
+
+        write(1.0)
+        self.assertEqual(self.main('-b', self.path('baseline.json')), 0)
+        write(1e-12)
+        self.assertEqual(self.main('-b', self.path('baseline.json')), 1)
+        self.assertIn('REGRESSION', sys.stdout.getvalue())
+        self.assertEqual(
+            self.main('-b', self.path('baseline.json'), '-t', '1e20'), 0)
+
+    def test_list(self):
+        self.assertEqual(bench.main(['-l', '-k', 'lex/']), 0)
+        self.assertEqual(sys.stdout.getvalue().split(),
+                         ['lex/filters', 'lex/large', 'lex/loops',
+                          'lex/small'])
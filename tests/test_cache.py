@@ -0,0 +1,287 @@
+import os
+import shutil
+import sys
+import tempfile
+from unittest import TestCase, skipIf
+
+from rattle import cache
+from rattle.cache import (FileSystemBytecodeCache, FragmentCache,
+    MemoryFragmentCache)
+from rattle.loader import Loader
+from rattle.template import Template
+from tests.utils import Mock
+
+if sys.version_info >= (3, 6):
+    import asyncio
+
+import tests.filters  # noqa: necessary to register test filters
+
+
+class UncompilableTemplate(Template):
+
+    def parse(self):
+        raise AssertionError('Template was compiled instead of loaded')
+
+
+class FileSystemBytecodeCacheTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = FileSystemBytecodeCache(
+            os.path.join(self.directory, 'cache'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def entries(self):
+        return os.listdir(self.cache.directory)
+
+    def test_store_and_load(self):
+        src = '{% for a in b %}{{ a|quote }}{% endfor %}'
+        ctx = {'b': [1, 2]}
+        expected = Template(src).render(ctx)
+        Template(src, bytecode_cache=self.cache)
+        self.assertEqual(len(self.entries()), 1)
+        tmpl = UncompilableTemplate(src, bytecode_cache=self.cache)
+        self.assertEqual(tmpl.render(ctx), expected)
+
+    def test_static_template(self):
+        Template('static', bytecode_cache=self.cache)
+        tmpl = UncompilableTemplate('static', bytecode_cache=self.cache)
+        self.assertEqual(tmpl.static, 'static')
+        self.assertEqual(tmpl.render(), 'static')
+
+    def test_keyed_by_options(self):
+        Template('a  b', bytecode_cache=self.cache)
+        tmpl = Template('a  b', bytecode_cache=self.cache,
+                        collapse_whitespace=True)
+        self.assertEqual(len(self.entries()), 2)
+        self.assertEqual(tmpl.render(), 'a b')
+
+    def test_keyed_by_source(self):
+        Template('{{ a }}', bytecode_cache=self.cache)
+        Template('{{ b }}', bytecode_cache=self.cache)
+        self.assertEqual(len(self.entries()), 2)
+        with self.assertRaises(AssertionError):
+            UncompilableTemplate('{{ c }}', bytecode_cache=self.cache)
+
+    def test_corrupt_entry(self):
+        Template('{{ a }}', bytecode_cache=self.cache)
+        path = os.path.join(self.cache.directory, self.entries()[0])
+        with open(path, 'wb') as f:
+            f.write(self.cache.MAGIC + b'garbage')
+        self.assertEqual(
+            Template('{{ a }}', bytecode_cache=self.cache).render({'a': 1}),
+            '1')
+        with open(path, 'wb') as f:
+            f.write(b'garbage')
+        self.assertIsNone(self.cache.load('{{ a }}'))
+
+    def test_no_temporary_files_left(self):
+        for i in range(5):
+            Template('{{ a }}%d' % i, bytecode_cache=self.cache)
+        self.assertEqual(
+            [name for name in self.entries() if not name.endswith('.rattlec')],
+            [])
+
+    def test_clear(self):
+        Template('{{ a }}', bytecode_cache=self.cache)
+        self.cache.clear()
+        self.assertEqual(self.entries(), [])
+
+
+class DictFragmentCache(FragmentCache):
+
+    def __init__(self):
+        super(DictFragmentCache, self).__init__()
+        self.data = {}
+
+    def load(self, key):
+        return self.data.get(key, (None,))[0]
+
+    def dump(self, key, value, ttl):
+        self.data[key] = (value, ttl)
+
+    def clear(self):
+        self.data.clear()
+
+
+class MemoryFragmentCacheTest(TestCase):
+
+    def setUp(self):
+        self.now = 100.0
+        self.monotonic = cache.monotonic
+        cache.monotonic = lambda: self.now
+        self.cache = MemoryFragmentCache(max_size=2)
+
+    def tearDown(self):
+        cache.monotonic = self.monotonic
+
+    def test_get_and_set(self):
+        self.assertIsNone(self.cache.get('a'))
+        self.cache.set('a', 'x')
+        self.assertEqual(self.cache.get('a'), 'x')
+        self.assertEqual(self.cache.info(), (1, 1, 2, 1))
+
+    def test_eviction(self):
+        self.cache.set('a', 'x')
+        self.cache.set('b', 'y')
+        # Using "a" makes "b" the least recently used
+        self.cache.get('a')
+        self.cache.set('c', 'z')
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('a'), 'x')
+        self.assertEqual(self.cache.info().size, 2)
+
+    def test_ttl(self):
+        self.cache.set('a', 'x', 10)
+        self.now += 9
+        self.assertEqual(self.cache.get('a'), 'x')
+        self.now += 1
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.info().size, 0)
+
+    def test_default_ttl(self):
+        self.cache = MemoryFragmentCache(default_ttl=5)
+        self.cache.set('a', 'x')
+        self.cache.set('b', 'y', 50)
+        self.now += 10
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.get('b'), 'y')
+
+    def test_disabled(self):
+        self.cache = MemoryFragmentCache(max_size=0)
+        self.cache.set('a', 'x')
+        self.assertIsNone(self.cache.get('a'))
+
+    def test_clear(self):
+        self.cache.set('a', 'x')
+        self.cache.get('a')
+        self.cache.clear()
+        self.assertEqual(self.cache.info(), (0, 0, 2, 0))
+
+
+class CacheTagTest(TestCase):
+
+    def setUp(self):
+        self.cache = MemoryFragmentCache()
+        self.calls = 0
+
+    def render(self, source, context):
+        return Template(source, 'test.html',
+                        fragment_cache=self.cache).render(context)
+
+    def count(self):
+        self.calls += 1
+        return self.calls
+
+    def test_cache(self):
+        source = '<{% cache "nav" %}{{ count() }}{% endcache %}>'
+        context = {'count': self.count}
+        self.assertEqual(self.render(source, context), '<1>')
+        self.assertEqual(self.render(source, context), '<1>')
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.cache.info()[:2], (1, 1))
+
+    def test_key(self):
+        tmpl = Template(
+            '{% for user in users %}{% cache user.name %}{{ user.name }}'
+            '{{ count() }}{% endcache %}{% endfor %}',
+            fragment_cache=self.cache)
+        users = [Mock(name='a'), Mock(name='b'), Mock(name='a')]
+        self.assertEqual(tmpl.render({'users': users, 'count': self.count}),
+                         'a1b2a1')
+        self.assertEqual(self.cache.get(tmpl.fragment_key('1:24', 'a')), 'a1')
+
+    def test_ttl(self):
+        backend = self.cache = DictFragmentCache()
+        self.render('{% cache "a" ttl*5 %}x{% endcache %}'
+                    '{% cache "b" %}y{% endcache %}', {'ttl': 60})
+        self.assertEqual(backend.data, {'test.html:1:1:a': ('x', 300),
+                                        'test.html:1:37:b': ('y', None)})
+
+    def test_nested(self):
+        source = (
+            '{% cache "outer" %}[{% cache part %}{{ count() }}{% endcache %}'
+            ']{% endcache %}{% cache part %}{{ count() }}{% endcache %}'
+        )
+        context = {'count': self.count, 'part': 'p'}
+        self.assertEqual(self.render(source, context), '[1]2')
+        self.cache.set('test.html:1:1:outer', '-')
+        self.assertEqual(self.render(source, context), '-2')
+
+    def test_include(self):
+        self.cache.set('k', 'cached')
+        self.assertEqual(
+            self.render('{% cache "k" shared %}{% include name %}{% endcache %}',
+                        {'name': 'missing.html'}),
+            'cached')
+
+    def test_default_cache(self):
+        cache.fragment_cache.clear()
+        source = '{% cache "default" %}{{ count() }}{% endcache %}'
+        tmpl = Template(source)
+        tmpl.render({'count': self.count})
+        self.assertEqual(
+            cache.fragment_cache.get(tmpl.fragment_key('1:1', 'default')), '1')
+        cache.fragment_cache.clear()
+
+    def test_scope(self):
+        context = {'count': self.count}
+        source = '{% cache "k" %}{{ count() }}{% endcache %}'
+        for origin in ('a.html', 'b.html', 'a.html'):
+            Template(source, origin, fragment_cache=self.cache).render(context)
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(self.cache.get('a.html:1:1:k'), '1')
+        self.assertEqual(
+            self.render(source + source, context), '34')
+
+    def test_no_origin(self):
+        for text in ('A', 'B'):
+            tmpl = Template('{% cache "k" %}' + text + '{% endcache %}',
+                            fragment_cache=self.cache)
+            self.assertEqual(tmpl.render({}), text)
+
+    def test_shared(self):
+        context = {'count': self.count}
+        source = '{% cache "k" shared %}{{ count() }}{% endcache %}'
+        for origin in ('a.html', 'b.html'):
+            Template('-' + source, origin,
+                     fragment_cache=self.cache).render(context)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.cache.get('k'), '1')
+
+    def test_inlined_scope(self):
+        directory = tempfile.mkdtemp()
+        try:
+            for name in ('a.html', 'b.html'):
+                with open(os.path.join(directory, name), 'w') as f:
+                    f.write('{% cache "k" %}' + name + '{% endcache %}')
+            tmpl = Template(
+                '{% include "a.html" %}{% include "b.html" %}',
+                loader=Loader([directory]), fragment_cache=self.cache)
+            self.assertEqual(tmpl.render(), 'a.htmlb.html')
+            self.assertEqual(
+                self.cache.get(tmpl.fragment_key('b.html:1:1', 'k')), 'b.html')
+        finally:
+            shutil.rmtree(directory)
+
+    def test_syntax(self):
+        for source in ('{% cache %}{% endcache %}',
+                       '{% cache a b c %}{% endcache %}',
+                       '{% cache a %}'):
+            with self.assertRaises(ValueError):
+                Template(source)
+
+    @skipIf(sys.version_info < (3, 6), 'async rendering requires Python 3.6+')
+    def test_async(self):
+        tmpl = Template('{% cache "a" %}{{ count() }}{% endcache %}',
+                        fragment_cache=self.cache)
+        loop = asyncio.new_event_loop()
+        try:
+            for _ in range(2):
+                rendered = loop.run_until_complete(
+                    tmpl.render_async({'count': self.count}))
+        finally:
+            loop.close()
+        self.assertEqual(rendered, '1')
@@ -0,0 +1,208 @@
+import os
+import shutil
+import subprocess
+import sys
+
+from rattle import precompile
+from rattle.cache import FileSystemBytecodeCache, fragment_cache
+from rattle.compiler import CompileError, compile_dirs, module_name
+from rattle.loader import Loader, PrecompiledLoader, TemplateNotFound
+from rattle.template import Template
+
+import tests.filters  # noqa: necessary to register test filters
+from tests.utils import TempDirTestCase
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TEMPLATES = {
+    'static.html': 'Hello world',
+    'loop.html': '{% for a in b %}<{{ a|quote }}>{% endfor %}',
+    'sub/name.html': 'Hello {{ name }}',
+}
+
+
+class CompilerTest(TempDirTestCase):
+
+    package = 'rattle_compiled_test'
+
+    def setUp(self):
+        super(CompilerTest, self).setUp()
+        self.template_dir = os.path.join(self.directory, 'templates')
+        self.output = os.path.join(self.directory, self.package)
+        for name, src in TEMPLATES.items():
+            self.write(name, src)
+        sys.path.insert(0, self.directory)
+
+    def tearDown(self):
+        sys.path.remove(self.directory)
+        for name in list(sys.modules):
+            if name.split('.')[0] == self.package:
+                del sys.modules[name]
+        super(CompilerTest, self).tearDown()
+
+    def write(self, name, src):
+        return super(CompilerTest, self).write(
+            os.path.join('templates', name), src)
+
+    def read_output(self):
+        result = {}
+        for name in os.listdir(self.output):
+            if name.endswith('.py'):
+                with open(os.path.join(self.output, name)) as f:
+                    result[name] = f.read()
+        return result
+
+    def test_render(self):
+        names = compile_dirs([self.template_dir], self.output)
+        self.assertEqual(names, sorted(TEMPLATES))
+        loader = PrecompiledLoader(self.package)
+        ctx = {'b': ['x', 'y'], 'name': '<b>'}
+        for name, src in TEMPLATES.items():
+            self.assertEqual(
+                loader.select_template(name).render(ctx),
+                Template(src).render(ctx),
+            )
+
+    def test_fragment_cache(self):
+        self.write('cached.html', '{% cache key %}{{ name }}{% endcache %}')
+        compile_dirs([self.template_dir], self.output)
+        tmpl = PrecompiledLoader(self.package).select_template('cached.html')
+        fragment_cache.clear()
+        try:
+            tmpl.render({'key': 'compiled', 'name': 'a'})
+            self.assertEqual(tmpl.render({'key': 'compiled', 'name': 'b'}),
+                             'a')
+        finally:
+            fragment_cache.clear()
+
+    def test_dynamic_include(self):
+        self.write('row.html', '<{{ a }}>')
+        self.write('rows.html',
+                   '{% for a in b %}{% include name %}{% endfor %}')
+        compile_dirs([self.template_dir], self.output)
+        ctx = {'b': [1, 2], 'name': 'row.html'}
+        self.assertEqual(
+            PrecompiledLoader(self.package).select_template(
+                'rows.html').render(ctx),
+            Loader([self.template_dir]).select_template(
+                'rows.html').render(ctx),
+        )
+
+    def test_deterministic(self):
+        compile_dirs([self.template_dir], self.output)
+        first = self.read_output()
+        shutil.rmtree(self.output)
+        compile_dirs([self.template_dir], self.output)
+        self.assertEqual(self.read_output(), first)
+
+    def test_stale_modules_removed(self):
+        compile_dirs([self.template_dir], self.output)
+        os.remove(os.path.join(self.template_dir, 'static.html'))
+        compile_dirs([self.template_dir], self.output)
+        self.assertNotIn(
+            module_name('static.html') + '.py', os.listdir(self.output))
+
+    def test_first_dir_wins(self):
+        other = os.path.join(self.directory, 'other')
+        os.makedirs(other)
+        with open(os.path.join(other, 'static.html'), 'w') as f:
+            f.write('Overridden')
+        compile_dirs([other, self.template_dir], self.output)
+        loader = PrecompiledLoader(self.package)
+        self.assertEqual(
+            loader.select_template('static.html').render(), 'Overridden')
+
+    def test_not_found(self):
+        compile_dirs([self.template_dir], self.output)
+        loader = PrecompiledLoader(self.package)
+        with self.assertRaises(TemplateNotFound):
+            loader.select_template('missing.html')
+        self.assertEqual(
+            loader.select_template(['missing.html', 'static.html']).render(),
+            'Hello world')
+
+    def test_error(self):
+        self.write('broken.html', '{{ a|no_such_filter }}')
+        with self.assertRaises(CompileError) as cm:
+            compile_dirs([self.template_dir], self.output)
+        self.assertEqual(cm.exception.name, 'broken.html')
+        self.assertFalse(os.path.exists(self.output))
+
+    def test_cli_without_rply(self):
+        code = subprocess.call([
+            sys.executable, '-m', 'rattle', 'compile', '-q',
+            '-i', 'tests.filters', self.template_dir, '-o', self.output,
+        ], cwd=ROOT)
+        self.assertEqual(code, 0)
+
+        script = (
+            'import sys\n'
+            'from rattle.loader import PrecompiledLoader\n'
+            'loader = PrecompiledLoader(%r)\n'
+            'out = loader.select_template("loop.html").render({"b": [1]})\n'
+            'assert out == "<&quot;1&quot;>", out\n'
+            'assert "rply" not in sys.modules\n'
+        ) % (self.package,)
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join([self.directory, ROOT])
+        self.assertEqual(
+            subprocess.call([sys.executable, '-c', script], env=env), 0)
+
+
+class UncompilableTemplate(Template):
+
+    def parse(self):
+        raise AssertionError('Template was compiled instead of loaded')
+
+
+class PrecompileTest(TempDirTestCase):
+
+    def setUp(self):
+        super(PrecompileTest, self).setUp()
+        self.template_dir = os.path.join(self.directory, 'templates')
+        for name, src in [
+            ('a.html', 'Hello {{ name }}'),
+            ('b.html', '{% for a in b %}{{ a|quote }}{% endfor %}'),
+            ('c.html', 'ab {% endfor %}'),
+        ]:
+            self.write(os.path.join('templates', name), src)
+        self.cache = FileSystemBytecodeCache(
+            os.path.join(self.directory, 'cache'))
+
+    def path(self, name):
+        return os.path.join(self.template_dir, name)
+
+    def test_results(self):
+        results = precompile([self.template_dir], workers=2)
+        self.assertEqual(
+            sorted(result.path for result in results),
+            [self.path('a.html'), self.path('b.html'), self.path('c.html')])
+        times = [result.time for result in results]
+        self.assertEqual(times, sorted(times, reverse=True))
+
+    def test_error_position(self):
+        results = precompile([self.path('c.html')], workers=1)
+        self.assertEqual(len(results), 1)
+        result = results[0]
+        self.assertIn('ValueError', result.error)
+        self.assertEqual(result.line, 1)
+        self.assertEqual(result.column, 6)
+        self.assertTrue(result.location().endswith('c.html:1:6'))
+
+    def test_fills_cache(self):
+        precompile([self.path('a.html'), self.path('b.html')], workers=2,
+                   bytecode_cache=self.cache)
+        with open(self.path('b.html')) as f:
+            tmpl = UncompilableTemplate(f.read(), bytecode_cache=self.cache)
+        self.assertEqual(tmpl.render({'b': [1]}), '&quot;1&quot;')
+
+    def test_fills_loader(self):
+        loader = Loader([self.template_dir], bytecode_cache=self.cache)
+        results = precompile([self.template_dir], workers=2, loader=loader)
+        self.assertEqual(
+            [result.path for result in results if result.error],
+            [self.path('c.html')])
+        loader.template_class = UncompilableTemplate
+        self.assertEqual(
+            loader.select_template('a.html').render({'name': 'x'}),
+            'Hello x')
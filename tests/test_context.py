@@ -0,0 +1,69 @@
+from unittest import TestCase
+
+from rattle.context import Context
+from rattle.template import Template
+
+
+class ContextTest(TestCase):
+
+    def test_lookup_order(self):
+        ctx = Context({'a': 1}, {'a': 2, 'b': 3})
+        self.assertEqual(ctx['a'], 1)
+        self.assertEqual(ctx['b'], 3)
+        self.assertIn('b', ctx)
+        self.assertNotIn('c', ctx)
+        self.assertIsNone(ctx.get('c'))
+        with self.assertRaises(KeyError):
+            ctx['c']
+
+    def test_writes_do_not_touch_mappings(self):
+        defaults, data = {'a': 1}, {'b': 2}
+        ctx = Context(defaults, data)
+        ctx['a'] = 'x'
+        ctx['b'] = 'y'
+        self.assertEqual((ctx['a'], ctx['b']), ('x', 'y'))
+        self.assertEqual(defaults, {'a': 1})
+        self.assertEqual(data, {'b': 2})
+
+    def test_push_pop(self):
+        ctx = Context({'a': 1})
+        with ctx.push():
+            ctx['a'] = 2
+            ctx['b'] = 3
+            self.assertEqual(ctx.flatten(), {'a': 2, 'b': 3})
+        self.assertEqual(ctx['a'], 1)
+        self.assertNotIn('b', ctx)
+        with self.assertRaises(IndexError):
+            ctx.pop()
+
+    def test_replace(self):
+        data = {'a': 1}
+        ctx = Context(data)
+        ctx.replace('a', 2)
+        self.assertEqual(ctx['a'], 2)
+        self.assertEqual(data, {'a': 1})
+        with ctx.push():
+            ctx['b'] = 1
+            ctx.push()
+            ctx.replace('b', 2)
+            ctx.replace('a', 3)
+            ctx.pop()
+            self.assertEqual((ctx['a'], ctx['b']), (3, 2))
+
+
+class TemplateContextTest(TestCase):
+
+    def test_caller_context_untouched(self):
+        ctx = {'a': 'outer', 'b': [1, 2]}
+        tmpl = Template('{% for a in b %}{{ a }}{% endfor %}{{ a }}')
+        self.assertEqual(tmpl.render(ctx), '12outer')
+        self.assertEqual(ctx, {'a': 'outer', 'b': [1, 2]})
+
+    def test_nested_loop_scopes(self):
+        tmpl = Template(
+            '{% for a in b %}{% for a in a %}{{ a }}{% endfor %}{% endfor %}')
+        self.assertEqual(tmpl.render({'b': [[1, 2], [3]]}), '123')
+
+    def test_defaults(self):
+        tmpl = Template('{% if None %}x{% else %}{{ True }}{% endif %}')
+        self.assertEqual(tmpl.render(), 'True')
@@ -0,0 +1,44 @@
+from unittest import TestCase
+
+from rattle.template import SafeData, auto_escape, escape
+
+
+class EscapeTest(TestCase):
+
+    def test_escape(self):
+        TESTS = (
+            ('abc', 'abc'),
+            ('a & b', 'a &amp; b'),
+            ('<a href="x">it\'s</a>', '&lt;a href=&quot;x&quot;&gt;it&#39;s&lt;/a&gt;'),
+            ('&amp;', '&amp;amp;'),
+            (1, '1'),
+            (1.5, '1.5'),
+            (True, 'True'),
+            (None, 'None'),
+            (['<'], "[&#39;&lt;&#39;]"),
+        )
+        for value, expect in TESTS:
+            escaped = escape(value)
+            self.assertEqual(escaped, expect)
+            self.assertIsInstance(escaped, SafeData)
+
+    def test_escape_safe_data(self):
+        value = SafeData('<b>')
+        self.assertIs(escape(value), value)
+        self.assertIs(auto_escape(value), value)
+
+    def test_auto_escape(self):
+        TESTS = (
+            ('abc', 'abc'),
+            ('"a" < \'b\' & c > d', '&quot;a&quot; &lt; &#39;b&#39; &amp; c &gt; d'),
+            (42, '42'),
+            (False, 'False'),
+            (None, 'None'),
+            (['<'], "[&#39;&lt;&#39;]"),
+        )
+        for value, expect in TESTS:
+            self.assertEqual(auto_escape(value), expect)
+
+    def test_auto_escape_unchanged_text(self):
+        value = 'nothing to escape here'
+        self.assertIs(auto_escape(value), value)
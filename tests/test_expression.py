@@ -0,0 +1,107 @@
+import ast
+from unittest import TestCase
+
+from rattle.lexer import lexers
+from rattle.parser import parsers
+from rattle.parser.expression import parse_expression
+from tests import test_var
+from tests.utils import TemplateTestCase
+
+
+def dump(source):
+    return ast.dump(parsers.fp.parse(lexers.fl.lex(source)))
+
+
+class PythonExpressionTest(TestCase):
+
+    def assertSameAST(self, source):
+        node = parse_expression(source)
+        self.assertIsNotNone(node, source)
+        self.assertEqual(ast.dump(node), dump(source), source)
+
+    def test_literals(self):
+        for src in ('1', '1.5', '12e-1', '12E1', "'a'", '"it\'s"',
+                    'True', 'None'):
+            self.assertSameAST(src)
+
+    def test_lookups(self):
+        for src in ('a', ' a.b.c ', 'a[0]', 'a["k"].b', 'a.b(c)[d]', 'f(a)(b)',
+                    '_rattle_filter'):
+            self.assertSameAST(src)
+
+    def test_operators(self):
+        for src in ('a + b * c - d / e % f', '(a + b) * c', 'a and b and c',
+                    'a == b', 'a < b < c', 'a not in b',
+                    'a is not None', 'a in b'):
+            self.assertSameAST(src)
+
+    def test_calls(self):
+        for src in ('f()', 'f(a, b)', 'f(a, k=b)', 'f(k=1, j=2)'):
+            self.assertSameAST(src)
+
+    def test_filters(self):
+        for src in ('a|upper', 'a.b|f:1', 'a|f:"x, y"', 'a | f : b|g',
+                    'a|x.y.z', 'a|f()', 'a|f(1, k=2)', 'a|f:True',
+                    'a\n|f'):
+            self.assertSameAST(src)
+
+    def test_filter_operand(self):
+        # A filter applies to everything on its left
+        for src in ('a + b|f * c', 'a|f == b', 'b and a|f', '(a|f)',
+                    'a[b|f]', 'f(a|g, k=b|h)', 'a|f(b|g, k=c|h)|i',
+                    'a|f:x.y', 'a|f:x(1)'):
+            self.assertSameAST(src)
+
+    def test_left_to_filter_parser(self):
+        for src in ('not a', '-1', 'a[1:2]', '(a, b)', '[a]', 'a ** b',
+                    'a // b', 'f(*a)', 'f(**a)', 'x if y else z', 'lambda: 1',
+                    '.5', '1_0', '0x1', '012', '1.x', "r'x'", "'a' 'b'",
+                    "'a\\n'", 'a or b and c', '|f', 'a|', 'a|1', 'a|f:-1',
+                    '_rattle_filter(1)', 'and', 'a.or', 'a)', '(a'):
+            self.assertIsNone(parse_expression(src), src)
+
+
+class PythonExpressionsMixin(object):
+
+    def setUp(self):
+        super(PythonExpressionsMixin, self).setUp()
+        parsers.python_expressions = True
+        # Expressions cached by other tests would not be compiled again
+        parsers.expression_cache.clear()
+
+    def tearDown(self):
+        parsers.python_expressions = False
+        super(PythonExpressionsMixin, self).tearDown()
+
+
+class PythonExpressionTemplateTest(PythonExpressionsMixin, TemplateTestCase):
+
+    def test_render(self):
+        self.assertRendered(
+            '{% if a|length > 1 %}{% for x in a %}{{ x }}{% endfor %}'
+            '{{ a|join:"-" }}{% endif %}',
+            'xyx-y', {'a': ['x', 'y']})
+
+    def test_error(self):
+        with self.assertRaises(ValueError):
+            parsers.parse_expr('a or')
+
+
+class PythonVariableSyntaxTest(PythonExpressionsMixin,
+                               test_var.VariableSyntaxTest):
+    pass
+
+
+class PythonFilterLookupTest(PythonExpressionsMixin,
+                             test_var.FilterLookupTest):
+    pass
+
+
+class PythonBinaryOperatorsTest(PythonExpressionsMixin,
+                                test_var.BinaryOperatorsTest):
+    pass
+
+
+class PythonComparatorsTest(PythonExpressionsMixin,
+                            test_var.ComparatorsTest):
+    pass
@@ -0,0 +1,204 @@
+import os
+import sys
+from unittest import skipIf
+
+from rattle.cache import FileSystemBytecodeCache
+from rattle.loader import Loader, TemplateNotFound
+from rattle.template import Template
+from rattle.utils.codegen import to_source
+from tests.utils import Mock, TempDirTestCase
+
+if sys.version_info >= (3, 6):
+    import asyncio
+    from tests.asyncutils import value
+
+
+class TemplateDirTestCase(TempDirTestCase):
+
+    def setUp(self):
+        super(TemplateDirTestCase, self).setUp()
+        self.loader = Loader([self.directory])
+
+    def render(self, name, context=None):
+        return self.loader.select_template(name).render(context or {})
+
+    def template(self, source):
+        return Template(source, loader=self.loader)
+
+
+class IncludeTest(TemplateDirTestCase):
+
+    def test_include(self):
+        self.write('item.html', '<li>{{ item }}</li>')
+        self.write('list.html',
+                   '<ul>{% for item in items %}{% include "item.html" %}'
+                   '{% endfor %}</ul>')
+        self.assertEqual(self.render('list.html', {'items': [1, 2]}),
+                         '<ul><li>1</li><li>2</li></ul>')
+
+    def test_inlined(self):
+        self.write('a.html', 'a{% include "b.html" %}')
+        self.write('b.html', 'b{{ x }}')
+        tmpl = self.template('{% include "a.html" %}!')
+        self.assertEqual(tmpl.render({'x': 1}), 'ab1!')
+        code = to_source(tmpl.parse())
+        self.assertNotIn('include_template', code)
+        self.assertEqual([name for name, _, _ in tmpl.dependencies],
+                         ['a.html', 'b.html'])
+
+    def test_static(self):
+        self.write('a.html', 'static')
+        self.assertEqual(self.template('{% include "a.html" %}').static,
+                         'static')
+
+    def test_dynamic(self):
+        self.write('a.html', 'a{{ item }}')
+        self.write('b.html', 'b{{ item }}')
+        tmpl = self.template(
+            '{% for item in items %}{% include item %}{% endfor %}')
+        self.assertEqual(tmpl.render({'items': ['a.html', 'b.html']}),
+                         'aa.htmlbb.html')
+        self.assertEqual(tmpl.dependencies, [])
+
+    def test_recursive(self):
+        self.write('tree.html',
+                   '({{ node.name }}{% for node in node.children %}'
+                   '{% include "tree.html" %}{% endfor %})')
+        tree = Mock(name='a', children=[
+            Mock(name='b', children=[]),
+            Mock(name='c', children=[Mock(name='d', children=[])]),
+        ])
+        self.assertEqual(self.render('tree.html', {'node': tree}),
+                         '(a(b)(c(d)))')
+
+    def test_not_found(self):
+        with self.assertRaises(TemplateNotFound) as cm:
+            self.template('\n  {% include "missing.html" %}')
+        pos = cm.exception.source_pos
+        self.assertEqual((pos.lineno, pos.colno), (2, 3))
+
+    def test_blocks_not_overridden(self):
+        self.write('a.html', '{% block x %}a{% endblock %}')
+        self.write('base.html',
+                   '{% include "a.html" %}{% block x %}base{% endblock %}')
+        self.write('child.html',
+                   '{% extends "base.html" %}{% block x %}child{% endblock %}')
+        self.assertEqual(self.render('child.html'), 'achild')
+
+    @skipIf(sys.version_info < (3, 6), 'async rendering requires Python 3.6+')
+    def test_async(self):
+        self.write('a.html', '{{ x }}')
+        tmpl = self.template(
+            '{% include "a.html" %}{% for x in xs %}{% include name %}'
+            '{% endfor %}')
+        loop = asyncio.new_event_loop()
+        try:
+            rendered = loop.run_until_complete(tmpl.render_async({
+                'x': value('y'),
+                'xs': [value(1), 2],
+                'name': 'a.html',
+            }))
+        finally:
+            loop.close()
+        self.assertEqual(rendered, 'y12')
+
+
+class ExtendsTest(TemplateDirTestCase):
+
+    def setUp(self):
+        super(ExtendsTest, self).setUp()
+        self.write('base.html',
+                   '<title>{% block title %}Site{% endblock %}</title>'
+                   '{% block body %}<p>{% block content %}{% endblock %}</p>'
+                   '{% endblock %}')
+
+    def test_extends(self):
+        self.write('page.html',
+                   'ignored {% extends "base.html" %}ignored'
+                   '{% block content %}{{ text }}{% endblock %}')
+        self.assertEqual(self.render('page.html', {'text': 'Hi'}),
+                         '<title>Site</title><p>Hi</p>')
+
+    def test_multiple_levels(self):
+        self.write('section.html',
+                   '{% extends "base.html" %}'
+                   '{% block title %}Section{% endblock %}'
+                   '{% block content %}[{% block inner %}{% endblock %}]'
+                   '{% endblock %}')
+        self.write('page.html',
+                   '{% extends "section.html" %}'
+                   '{% block inner %}page{% endblock %}')
+        self.assertEqual(self.render('page.html'),
+                         '<title>Section</title><p>[page]</p>')
+        self.assertEqual(
+            [name for name, _, _ in
+             self.loader.select_template('page.html').dependencies],
+            ['section.html', 'base.html'])
+
+    def test_override_outer_block(self):
+        self.write('page.html',
+                   '{% extends "base.html" %}'
+                   '{% block body %}{% block content %}x{% endblock %}'
+                   '{% endblock %}')
+        self.assertEqual(self.render('page.html'), '<title>Site</title>x')
+
+    def test_dynamic(self):
+        self.write('other.html', '[{% block content %}{% endblock %}]')
+        tmpl = self.template(
+            '{% extends layout %}{% block content %}{{ x }}{% endblock %}')
+        self.assertEqual(tmpl.render({'layout': 'base.html', 'x': 1}),
+                         '<title>Site</title><p>1</p>')
+        self.assertEqual(tmpl.render({'layout': 'other.html', 'x': 2}),
+                         '[2]')
+        extended = tmpl.get_extended('other.html')
+        tmpl.render({'layout': 'other.html', 'x': 3})
+        self.assertIs(tmpl.get_extended('other.html'), extended)
+
+    def test_dynamic_in_included(self):
+        self.write('page.html',
+                   '{% extends layout %}{% block content %}x{% endblock %}')
+        tmpl = self.template('{% include "page.html" %}')
+        self.assertEqual(tmpl.render({'layout': 'base.html'}),
+                         '<title>Site</title><p>x</p>')
+
+    def test_dynamic_in_included_collapsed(self):
+        self.write('page.html',
+                   '<pre>{% extends layout %}{% block content %}x{% endblock %}')
+        tmpl = Template('{% include "page.html" %}  a  ', loader=self.loader,
+                        collapse_whitespace=True)
+        self.assertEqual(tmpl.render({'layout': 'base.html'}),
+                         '<title>Site</title><p>x</p> a ')
+
+    def test_extends_itself(self):
+        self.write('a.html', '{% extends "b.html" %}')
+        self.write('b.html', '{% extends "a.html" %}')
+        with self.assertRaises(ValueError):
+            self.render('a.html')
+
+    def test_duplicate_block(self):
+        with self.assertRaises(ValueError):
+            self.template('{% block a %}{% endblock %}{% block a %}'
+                          '{% endblock %}')
+
+    def test_block_without_parent(self):
+        tmpl = self.template('{% block a %}x{% endblock %}')
+        self.assertEqual(tmpl.render(), 'x')
+
+
+class DependencyTest(TemplateDirTestCase):
+
+    def test_loader_reloads(self):
+        self.write('base.html', 'old{% block a %}{% endblock %}')
+        self.write('page.html', '{% extends "base.html" %}')
+        self.assertEqual(self.render('page.html'), 'old')
+        self.write('base.html', 'new{% block a %}{% endblock %}')
+        self.assertEqual(self.render('page.html'), 'new')
+
+    def test_bytecode_cache(self):
+        cache = FileSystemBytecodeCache(os.path.join(self.directory, 'cache'))
+        self.write('a.html', 'old')
+        source = '{% include "a.html" %}'
+        Template(source, loader=self.loader, bytecode_cache=cache)
+        self.write('a.html', 'new')
+        tmpl = Template(source, loader=self.loader, bytecode_cache=cache)
+        self.assertEqual(tmpl.render(), 'new')
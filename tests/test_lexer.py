@@ -0,0 +1,102 @@
+from unittest import TestCase
+
+from rply.errors import LexingError
+
+from rattle.lexer import lexers
+from tests.utils import TemplateTestCase
+
+
+def lex(source):
+    return [(t.name, t.value) for t in lexers.sl.lex(source)]
+
+
+def positions(source):
+    return [
+        (t.value, t.source_pos.idx, t.source_pos.lineno, t.source_pos.colno)
+        for t in lexers.sl.lex(source)
+    ]
+
+
+class StructureLexerTest(TestCase):
+
+    def test_text(self):
+        self.assertEqual(lex(''), [])
+        self.assertEqual(lex('abc'), [('CONTENT', 'abc')])
+        self.assertEqual(lex('a\nb\n'), [('CONTENT', 'a\nb\n')])
+
+    def test_var(self):
+        self.assertEqual(lex('a{{ b }}c'), [
+            ('CONTENT', 'a'),
+            ('VS', '{{ '),
+            ('CONTENT', 'b'),
+            ('VE', ' }}'),
+            ('CONTENT', 'c'),
+        ])
+        self.assertEqual(lex('{{b}}'), [
+            ('VS', '{{'), ('CONTENT', 'b'), ('VE', '}}'),
+        ])
+
+    def test_tag(self):
+        self.assertEqual(lex('{% for x in y %}{% empty%}{% endfor %}'), [
+            ('TS', '{%'),
+            ('FOR', ' for '),
+            ('CONTENT', 'x in y'),
+            ('TE', ' %}'),
+            ('TS', '{%'),
+            ('EMPTY', ' empty'),
+            ('TE', '%}'),
+            ('TS', '{%'),
+            ('ENDFOR', ' endfor '),
+            ('TE', '%}'),
+        ])
+
+    def test_comment(self):
+        self.assertEqual(lex('{# a {{ b }} #}'), [
+            ('CS', '{# '), ('CONTENT', 'a {{ b }}'), ('CE', ' #}'),
+        ])
+
+    def test_braces_in_text(self):
+        src = 'function f() { return {a: {b: 1}}; }'
+        self.assertEqual(lex(src), [('CONTENT', src)])
+
+    def test_positions(self):
+        self.assertEqual(positions('ab\n{{ c }}\n\n  {% if d %}'), [
+            ('ab\n', 0, 1, 1),
+            ('{{ ', 3, 2, 1),
+            ('c', 6, 2, 4),
+            (' }}', 7, 2, 5),
+            ('\n\n  ', 10, 2, 8),
+            ('{%', 14, 4, 3),
+            (' if ', 16, 4, 5),
+            ('d', 20, 4, 9),
+            (' %}', 21, 4, 10),
+        ])
+
+    def test_tag_names(self):
+        self.assertEqual(lex('{% foo_bar %}'), [
+            ('TS', '{%'), ('FOO_BAR', ' foo_bar '), ('TE', '%}'),
+        ])
+
+    def test_invalid_tag(self):
+        with self.assertRaises(LexingError) as cm:
+            lex('\n{% 1 %}')
+        pos = cm.exception.getsourcepos()
+        self.assertEqual((pos.lineno, pos.colno), (2, 3))
+
+    def test_unclosed(self):
+        with self.assertRaises(LexingError) as cm:
+            lex('a\n  {{ b')
+        pos = cm.exception.getsourcepos()
+        self.assertEqual((pos.lineno, pos.colno), (2, 3))
+
+
+class MultilineTest(TemplateTestCase):
+
+    def test_multiline(self):
+        self.assertRendered(
+            '<ul>\n{% for a in b %}\n  <li>{{ a }}</li>\n{% endfor %}\n</ul>\n',
+            '<ul>\n\n  <li>1</li>\n\n  <li>2</li>\n\n</ul>\n',
+            {'b': [1, 2]})
+
+    def test_multiline_var(self):
+        self.assertRendered('{{\n  a\n}}', '1', {'a': 1})
@@ -1,9 +1,16 @@
 
 import os
-from unittest import TestCase
+import shutil
+import tempfile
+import threading
+import time
+from unittest import TestCase, skipUnless
 
 from rattle import Template
-from rattle.loader import select_template
+from rattle.loader import (INDEX_CHECK_INTERVAL, Loader, TemplateIndex,
+    TemplateNotFound, select_template)
+from rattle.template import TemplateSyntaxError
+from tests.utils import TempDirTestCase
 
 TEST_DIR = os.path.dirname(__file__)
 TEMPLATE_DIRS = [
@@ -24,3 +31,201 @@ class LoaderTest(TestCase):
     def test_suspicious(self):
         with self.assertRaises(ValueError):
             select_template('../test.html', TEMPLATE_DIRS)
+
+
+class CountingTemplate(Template):
+    compiles = 0
+
+    def compile(self):
+        CountingTemplate.compiles += 1
+        time.sleep(0.01)
+        return super(CountingTemplate, self).compile()
+
+
+class CountingLoader(Loader):
+    template_class = CountingTemplate
+
+
+class CachedLoaderTest(TempDirTestCase):
+
+    def setUp(self):
+        super(CachedLoaderTest, self).setUp()
+        CountingTemplate.compiles = 0
+
+    def test_cached(self):
+        self.write('a.html', '{{ a }}')
+        loader = CountingLoader([self.directory])
+        t = loader.select_template('a.html')
+        self.assertIs(loader.select_template(['missing.html', 'a.html']), t)
+        self.assertEqual(t.render({'a': 1}), '1')
+        self.assertEqual(CountingTemplate.compiles, 1)
+
+    def test_collapse_whitespace(self):
+        self.write('a.html', '<p>\n  {{ a }}\n</p>')
+        loader = Loader([self.directory], collapse_whitespace=True)
+        self.assertEqual(loader.select_template('a.html').render({'a': 1}),
+                         '<p>\n1\n</p>')
+
+    def test_not_found(self):
+        loader = CountingLoader([self.directory])
+        with self.assertRaises(TemplateNotFound):
+            loader.select_template('notfound.html')
+
+    def test_modified(self):
+        self.write('a.html', 'old', mtime=1000000000)
+        loader = CountingLoader([self.directory])
+        self.assertEqual(loader.select_template('a.html').render(), 'old')
+        self.write('a.html', 'new', mtime=1000000001)
+        self.assertEqual(loader.select_template('a.html').render(), 'new')
+        self.assertEqual(CountingTemplate.compiles, 2)
+
+    def test_check_interval(self):
+        self.write('a.html', 'old', mtime=1000000000)
+        loader = CountingLoader([self.directory], check_interval=None)
+        loader.select_template('a.html')
+        self.write('a.html', 'new', mtime=1000000001)
+        self.assertEqual(loader.select_template('a.html').render(), 'old')
+
+        loader = CountingLoader([self.directory], check_interval=3600)
+        loader.select_template('a.html')
+        self.write('a.html', 'newer', mtime=1000000002)
+        self.assertEqual(loader.select_template('a.html').render(), 'new')
+
+    def test_lru_eviction(self):
+        for name in 'abc':
+            self.write(name, name)
+        loader = CountingLoader([self.directory], max_size=2)
+        loader.select_template('a')
+        loader.select_template('b')
+        loader.select_template('a')
+        loader.select_template('c')
+        self.assertEqual(CountingTemplate.compiles, 3)
+        loader.select_template('a')
+        self.assertEqual(CountingTemplate.compiles, 3)
+        loader.select_template('b')
+        self.assertEqual(CountingTemplate.compiles, 4)
+
+    def test_concurrent_misses(self):
+        self.write('a.html', '{{ a }}')
+        loader = CountingLoader([self.directory])
+        results = []
+
+        def load():
+            results.append(loader.select_template('a.html'))
+
+        threads = [threading.Thread(target=load) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(CountingTemplate.compiles, 1)
+        self.assertEqual(len(results), 8)
+        self.assertTrue(all(t is results[0] for t in results))
+
+    def test_concurrent_errors(self):
+        self.write('a.html', '{{ a|no_such_filter }}')
+        loader = CountingLoader([self.directory])
+        errors = []
+
+        def load():
+            try:
+                loader.select_template('a.html')
+            except TemplateSyntaxError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=load) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(errors), 4)
+
+
+class TemplateIndexTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.dirs = []
+        for name in ('theme', 'plugin', 'base'):
+            path = os.path.join(self.directory, name)
+            os.makedirs(os.path.join(path, 'sub'))
+            self.dirs.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, tdir, name, content=''):
+        path = os.path.join(self.dirs[tdir], name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_resolution_order(self):
+        self.write(2, 'a.html')
+        winner = self.write(1, 'a.html')
+        nested = self.write(2, 'sub/b.html')
+        index = TemplateIndex(self.dirs)
+        self.assertEqual(index.find('a.html'), winner)
+        self.assertEqual(index.find('sub/b.html'), nested)
+        self.assertEqual(index.find('./sub/../sub/b.html'), nested)
+        self.assertEqual(index.find(['missing.html', 'sub/b.html']), nested)
+
+    def test_not_found(self):
+        index = TemplateIndex(self.dirs)
+        with self.assertRaises(TemplateNotFound):
+            index.find(['missing.html', 'sub'])
+
+    def test_suspicious(self):
+        index = TemplateIndex(self.dirs)
+        for name in ('../base/a.html', '/etc/passwd', 'sub/../../x'):
+            with self.assertRaises(ValueError):
+                index.find(name)
+
+    def test_refresh(self):
+        index = TemplateIndex(self.dirs, check_interval=0)
+        with self.assertRaises(TemplateNotFound):
+            index.find('sub/new.html')
+        path = self.write(0, 'sub/new.html')
+        # Directory mtimes may not change within the filesystem's resolution
+        for path_, mtime in list(index.dir_mtimes.items()):
+            index.dir_mtimes[path_] = mtime - 10
+        self.assertEqual(index.find('sub/new.html'), path)
+
+    def test_check_interval(self):
+        index = TemplateIndex(self.dirs)
+        self.write(0, 'new.html')
+        for path_, mtime in list(index.dir_mtimes.items()):
+            index.dir_mtimes[path_] = mtime - 10
+        with self.assertRaises(TemplateNotFound):
+            index.find('new.html')
+        index.checked -= INDEX_CHECK_INTERVAL
+        self.assertEqual(index.find('new.html'),
+                         os.path.join(self.dirs[0], 'new.html'))
+
+    @skipUnless(hasattr(os, 'symlink'), 'requires symlinks')
+    def test_symlinks(self):
+        self.write(2, 'sub/a.html')
+        os.symlink(os.path.join(self.dirs[2], 'sub'),
+                   os.path.join(self.dirs[0], 'linked'))
+        os.symlink(self.dirs[2], os.path.join(self.dirs[2], 'sub', 'loop'))
+        index = TemplateIndex(self.dirs)
+        self.assertEqual(index.find('linked/a.html'),
+                         os.path.join(self.dirs[0], 'linked', 'a.html'))
+        with self.assertRaises(TemplateNotFound):
+            index.find('sub/loop/sub/a.html')
+
+    def test_no_refresh(self):
+        index = TemplateIndex(self.dirs, check_interval=None)
+        self.write(0, 'new.html')
+        for path_, mtime in list(index.dir_mtimes.items()):
+            index.dir_mtimes[path_] = mtime - 10
+        with self.assertRaises(TemplateNotFound):
+            index.find('new.html')
+
+    def test_loader(self):
+        self.write(2, 'a.html', 'base')
+        self.write(0, 'a.html', 'theme')
+        loader = Loader(self.dirs, use_index=True)
+        self.assertEqual(loader.select_template('a.html').render(), 'theme')
+        with self.assertRaises(TemplateNotFound):
+            loader.select_template('missing.html')
@@ -0,0 +1,136 @@
+import io
+import os
+import shutil
+import sys
+import tempfile
+from unittest import TestCase, skipIf
+
+from rattle import metrics
+from rattle.loader import Loader
+from rattle.metrics import MemorySink, Sink, Summary
+from rattle.template import Template
+
+if sys.version_info >= (3, 6):
+    import asyncio
+    from tests.asyncutils import value
+
+
+def fail():
+    raise KeyError('fail')
+
+
+class MemorySinkTest(TestCase):
+
+    def test_aggregates(self):
+        sink = MemorySink()
+        sink.count('c', 1, 'a')
+        sink.count('c', 2, 'b')
+        sink.observe('h', 1.0, 'a')
+        sink.observe('h', 3.0, 'a')
+        sink.observe('h', 5.0, 'b')
+        self.assertEqual(sink.counter('c'), 3)
+        self.assertEqual(sink.counter('c', 'b'), 2)
+        self.assertEqual(sink.counter('x'), 0)
+        self.assertEqual(sink.histogram('h'), (3, 9.0, 1.0, 5.0))
+        self.assertEqual(sink.histogram('h', 'a').mean, 2.0)
+        self.assertEqual(sink.histogram('x'), (0, 0, None, None))
+        self.assertEqual(Summary(0, 0, None, None).mean, 0.0)
+        sink.clear()
+        self.assertEqual(sink.counter('c'), 0)
+
+
+class MetricsTest(TestCase):
+
+    def setUp(self):
+        self.sink = metrics.add_sink(MemorySink())
+
+    def tearDown(self):
+        metrics.remove_sink(self.sink)
+
+    def test_no_sinks(self):
+        metrics.remove_sink(self.sink)
+        self.assertEqual(metrics.sinks, [])
+        Template('{{ a }}', 'a.html').render({'a': 1})
+        self.assertEqual(self.sink.counters, {})
+        self.assertEqual(self.sink.samples, {})
+
+    def test_add_sink_once(self):
+        metrics.add_sink(self.sink)
+        self.assertEqual(metrics.sinks, [self.sink])
+
+    def test_base_sink(self):
+        metrics.add_sink(Sink())
+        try:
+            Template('{{ a }}').render({'a': 1})
+        finally:
+            del metrics.sinks[1:]
+
+    def test_compile_time(self):
+        Template('{{ a }}', 'a.html')
+        summary = self.sink.histogram('compile_time', 'a.html')
+        self.assertEqual(summary.count, 1)
+        self.assertGreater(summary.total, 0)
+
+    def test_render(self):
+        tmpl = Template('{% for x in xs %}{{ x }}{% endfor %}', 'a.html')
+        self.assertEqual(tmpl.render({'xs': [1, 2, 3]}), '123')
+        self.assertEqual(self.sink.histogram('render_time', 'a.html').count, 1)
+        self.assertEqual(self.sink.histogram('output_size', 'a.html').total, 3)
+
+    def test_static(self):
+        tmpl = Template('static', 'a.html')
+        self.assertEqual(tmpl.render(), 'static')
+        out = io.StringIO()
+        tmpl.render_to(out)
+        self.assertEqual(out.getvalue(), u'static')
+        self.assertEqual(self.sink.histogram('output_size'), (2, 12, 6, 6))
+
+    def test_stream(self):
+        tmpl = Template('{% for x in xs %}{{ x }}{% endfor %}')
+        self.assertEqual(list(tmpl.stream({'xs': 'abcd'}, chunk_size=2)),
+                         ['ab', 'cd'])
+        self.assertEqual(self.sink.histogram('output_size'), (1, 4, 4, 4))
+
+    def test_error(self):
+        tmpl = Template('{{ fail() }}', 'a.html')
+        with self.assertRaises(KeyError):
+            tmpl.render({'fail': fail})
+        self.assertEqual(self.sink.counter('render_error', 'a.html'), 1)
+        self.assertEqual(self.sink.histogram('render_time').count, 0)
+
+    @skipIf(sys.version_info < (3, 6), 'async rendering requires Python 3.6+')
+    def test_async(self):
+        tmpl = Template('{{ a }}{{ fail() }}', 'a.html')
+        loop = asyncio.new_event_loop()
+        try:
+            self.assertEqual(loop.run_until_complete(tmpl.render_async(
+                {'a': value('ok'), 'fail': lambda: ''})), 'ok')
+            with self.assertRaises(KeyError):
+                loop.run_until_complete(tmpl.render_async(
+                    {'a': 1, 'fail': fail}))
+        finally:
+            loop.close()
+        self.assertEqual(self.sink.histogram('output_size'), (1, 2, 2, 2))
+        self.assertEqual(self.sink.counter('render_error'), 1)
+
+
+class LoaderMetricsTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.sink = metrics.add_sink(MemorySink())
+
+    def tearDown(self):
+        metrics.remove_sink(self.sink)
+        shutil.rmtree(self.directory)
+
+    def test_hits_and_misses(self):
+        path = os.path.join(self.directory, 'a.html')
+        with open(path, 'w') as f:
+            f.write('{{ a }}')
+        loader = Loader([self.directory])
+        for _ in range(3):
+            loader.select_template('a.html')
+        self.assertEqual(self.sink.counter('loader_miss', path), 1)
+        self.assertEqual(self.sink.counter('loader_hit', path), 2)
+        self.assertEqual(self.sink.histogram('compile_time', path).count, 1)
@@ -0,0 +1,112 @@
+from unittest import TestCase
+
+from rattle.template import Template
+
+import tests.filters  # noqa: necessary to register test filters
+from tests.utils import Mock, TemplateTestCase
+
+
+class HoistLookupsTest(TemplateTestCase):
+
+    def test_hoisted_values(self):
+        ctx = {'rows': [Mock(a=1), Mock(a=2)], 'cur': '$', 'x': True}
+        TESTS = (
+            ('{% for r in rows %}{{ r.a }}{{ cur }}{% endfor %}{{ cur }}',
+             '1$2$$'),
+            ('{% for r in rows %}{% if x %}{{ cur }}{% endif %}{% endfor %}',
+             '$$'),
+            ('{{ x and cur }}{{ x or cur }}', '$True'),
+        )
+        for src, expect in TESTS:
+            self.assertRendered(src, expect, ctx)
+
+    def test_loop_targets(self):
+        ctx = {'a': 'outer', 'b': [[1, 2], [3]]}
+        TESTS = (
+            ('{% for a in b %}{% for a in a %}{{ a }}{% endfor %}|{% endfor %}'
+             '{{ a }}', '12|3|outer'),
+            ('{% for c in b %}{% for d in c %}{{ c|length }}{% endfor %}'
+             '{% endfor %}', '221'),
+        )
+        for src, expect in TESTS:
+            self.assertRendered(src, expect, ctx)
+
+    def test_empty_uses_outer_binding(self):
+        self.assertRendered(
+            '{% for a in b %}{{ a }}{% empty %}{{ a }}{% endfor %}',
+            'outer', {'a': 'outer', 'b': []})
+
+
+class MissingVariableTest(TestCase):
+    """
+    Hoisting must not look up variables that the template would not have
+    looked up.
+    """
+
+    def test_untaken_branch(self):
+        tmpl = Template('{% if x %}{{ nope }}{% else %}ok{% endif %}')
+        self.assertEqual(tmpl.render({'x': False}), 'ok')
+
+    def test_empty_loop(self):
+        tmpl = Template('{% for a in b %}{{ nope }}{% endfor %}ok')
+        self.assertEqual(tmpl.render({'b': []}), 'ok')
+
+    def test_short_circuit(self):
+        tmpl = Template('{{ x or nope }}')
+        self.assertEqual(tmpl.render({'x': 'ok'}), 'ok')
+
+    def test_used_variable_missing(self):
+        tmpl = Template('{% for a in b %}{{ nope }}{% endfor %}')
+        with self.assertRaises(KeyError):
+            tmpl.render({'b': [1]})
+
+
+class ConstantFoldingTest(TemplateTestCase):
+
+    def test_folded_output(self):
+        TESTS = (
+            ("{{ 'Hello ' }}{{ 'world!' }}", 'Hello world!'),
+            ('{{ 1 + 2 }}{{ 2 * 3 == 6 }}', '3True'),
+            ("{{ 'a<b' }}", 'a&lt;b'),
+            ("{{ 'x'|quote }}", '&quot;x&quot;'),
+            ("{{ '<b>'|safe }}", '<b>'),
+            ('{# a #}x{# b #}', 'x'),
+            ('{% if True %}yes{% else %}no{% endif %}', 'yes'),
+            ('{% if False or None %}yes{% else %}no{% endif %}', 'no'),
+            ('{% if False %}no{% endif %}', ''),
+        )
+        for src, expect in TESTS:
+            self.assertRendered(src, expect)
+            self.assertEqual(Template(src).static, expect)
+
+    def test_static_text_merged(self):
+        tmpl = Template("<p>{{ 'a' }}{# c #}</p>{{ b }}<br>{% if True %}!{% endif %}")
+        self.assertIsNone(tmpl.static)
+        self.assertEqual(list(tmpl.root({'b': 1})), ['<p>a</p>', '1', '<br>!'])
+
+    def test_errors_left_to_render_time(self):
+        tmpl = Template('{% if a %}{{ 1 / 0 }}{% endif %}')
+        self.assertEqual(tmpl.render({'a': False}), '')
+        with self.assertRaises(ZeroDivisionError):
+            tmpl.render({'a': True})
+
+    def test_large_repetition(self):
+        tmpl = Template("{% if False %}{{ 'ab' * 100000000 }}{% endif %}")
+        self.assertEqual(tmpl.static, '')
+        tmpl = Template("{{ 'ab' * 100000 }}")
+        self.assertIsNone(tmpl.static)
+        self.assertEqual(tmpl.render(), 'ab' * 100000)
+        tmpl = Template("{{ ('ab' * 3000) * 1000 }}")
+        self.assertIsNone(tmpl.static)
+        self.assertEqual(Template("{{ 3 * 'ab' }}").static, 'ababab')
+
+    def test_volatile_filter(self):
+        tmpl = Template("{{ 'x'|tick }}")
+        self.assertIsNone(tmpl.static)
+        self.assertNotEqual(tmpl.render(), tmpl.render())
+
+    def test_loop_body_kept(self):
+        tmpl = Template('{% for a in b %}{# x #}{% endfor %}')
+        self.assertEqual(tmpl.render({'b': [1]}), '')
+        with self.assertRaises(KeyError):
+            tmpl.render({})
@@ -0,0 +1,136 @@
+import ast
+import errno
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import rply
+from rply.parsergenerator import LRTable
+
+from rattle.parser import ExpressionCache, build_parser, parsers
+
+
+def make_generator():
+    pg = rply.ParserGenerator(['NUMBER'], cache_id='rattle-test')
+
+    @pg.production('main : NUMBER')
+    def main(p):
+        return int(p[0].getstr())
+
+    return pg
+
+
+class ParserTablesTest(TestCase):
+
+    def setUp(self):
+        # rply keeps the tables in the temporary directory or, from newer
+        # releases on, in the user's cache directory
+        self.tempdir = tempfile.tempdir
+        self.cache_home = os.environ.get('XDG_CACHE_HOME')
+        tempfile.tempdir = tempfile.mkdtemp()
+        os.environ['XDG_CACHE_HOME'] = tempfile.tempdir
+
+    def tearDown(self):
+        shutil.rmtree(tempfile.tempdir)
+        tempfile.tempdir = self.tempdir
+        if self.cache_home is None:
+            del os.environ['XDG_CACHE_HOME']
+        else:
+            os.environ['XDG_CACHE_HOME'] = self.cache_home
+
+    def parse(self, parser):
+        return parser.parse(iter([rply.Token('NUMBER', '42')]))
+
+    def test_cache_id(self):
+        self.assertTrue(parsers.fpg.cache_id.startswith('rattle-'))
+
+    def test_tables_reused(self):
+        self.assertEqual(self.parse(build_parser(make_generator())), 42)
+
+        from_grammar = LRTable.from_grammar
+
+        def fail(*args):
+            raise AssertionError('Tables were generated again')
+
+        LRTable.from_grammar = classmethod(fail)
+        try:
+            parser = build_parser(make_generator())
+        finally:
+            LRTable.from_grammar = from_grammar
+        self.assertEqual(self.parse(parser), 42)
+
+    def test_concurrent_build(self):
+        pg = make_generator()
+        build = pg.build
+        calls = []
+
+        def racing_build():
+            calls.append(True)
+            if len(calls) == 1:
+                # Another process created the file first
+                build()
+                raise OSError(errno.EEXIST, 'File exists')
+            return build()
+
+        pg.build = racing_build
+        self.assertEqual(self.parse(build_parser(pg)), 42)
+        self.assertEqual(len(calls), 2)
+
+
+class ExpressionCacheTest(TestCase):
+
+    def setUp(self):
+        self.cache = ExpressionCache(max_size=2)
+        self.parsed = []
+
+    def parse(self, source):
+        self.parsed.append(source)
+        return parsers._parse_expr(source)
+
+    def get(self, source):
+        return self.cache.get(source, self.parse)
+
+    def test_hit(self):
+        first = self.get('a.b|f')
+        second = self.get('a.b|f')
+        self.assertEqual(self.parsed, ['a.b|f'])
+        self.assertEqual(ast.dump(first), ast.dump(second))
+        info = self.cache.info()
+        self.assertEqual((info.hits, info.misses, info.size), (1, 1, 1))
+        self.assertEqual(info.hit_rate, 0.5)
+
+    def test_copies(self):
+        self.get('a.b').attr = 'c'
+        self.get('a.b').attr = 'd'
+        self.assertEqual(self.get('a.b').attr, 'b')
+
+    def test_evicts_least_recently_used(self):
+        self.get('a')
+        self.get('b')
+        self.get('a')
+        self.get('c')
+        self.assertEqual(self.cache.info().size, 2)
+        self.get('a')
+        self.get('b')
+        self.assertEqual(self.parsed, ['a', 'b', 'c', 'b'])
+
+    def test_disabled(self):
+        self.cache = ExpressionCache(max_size=0)
+        self.get('a')
+        self.get('a')
+        self.assertEqual(self.parsed, ['a', 'a'])
+        self.assertEqual(self.cache.info(), (0, 2, 0, 0))
+
+    def test_clear(self):
+        self.get('a')
+        self.get('a')
+        self.cache.clear()
+        self.assertEqual(self.cache.info(), (0, 0, 2, 0))
+        self.assertEqual(self.cache.info().hit_rate, 0.0)
+
+    def test_errors_not_cached(self):
+        for _ in range(2):
+            with self.assertRaises(ValueError):
+                self.get('a or')
+        self.assertEqual(self.parsed, ['a or', 'a or'])
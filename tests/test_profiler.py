@@ -0,0 +1,144 @@
+import shutil
+import sys
+import tempfile
+import time
+from unittest import TestCase, skipIf
+
+from rattle.cache import FileSystemBytecodeCache
+from rattle.loader import Loader
+from rattle.profiler import Profiler, excerpt
+from rattle.template import Template
+from rattle.utils.codegen import to_source
+
+import tests.filters  # noqa: necessary to register test filters
+from tests.utils import TempDirTestCase
+
+if sys.version_info >= (3, 6):
+    import asyncio
+
+
+SOURCE = (
+    '<ul>\n'
+    '{% for x in xs %}\n'
+    '  <li>{{ x|quote }}</li>{% if x > 1 %}!{% endif %}\n'
+    '{% endfor %}</ul>'
+)
+
+
+def calls(profiler):
+    return dict(
+        ((stat.location.line, stat.location.column), stat.calls)
+        for stat in profiler.stats()
+    )
+
+
+class ProfilerTest(TestCase):
+
+    def setUp(self):
+        self.profiler = Profiler()
+
+    def test_counts(self):
+        tmpl = Template(SOURCE, profiler=self.profiler)
+        self.assertEqual(tmpl.render({'xs': [1, 2, 3]}),
+                         Template(SOURCE).render({'xs': [1, 2, 3]}))
+        self.assertEqual(calls(self.profiler),
+                         {(2, 1): 1, (3, 7): 3, (3, 25): 3})
+        self.assertEqual(
+            [stat.location.excerpt for stat in self.profiler.stats('calls')],
+            ['{{ x|quote }}', '{% if x > 1 %}', '{% for x in xs %}'])
+
+    def test_inclusive(self):
+        tmpl = Template(SOURCE, profiler=self.profiler)
+        tmpl.render({'xs': list(range(100))})
+        stats = dict((stat.location.line, stat)
+                     for stat in self.profiler.stats())
+        self.assertEqual(self.profiler.stats()[0].location.line, 2)
+        self.assertGreaterEqual(stats[2].time, stats[3].time)
+
+    def test_paused_time_excluded(self):
+        tmpl = Template(SOURCE, profiler=self.profiler)
+        for _ in tmpl.stream({'xs': [1, 2]}, chunk_size=1):
+            time.sleep(0.02)
+        self.assertLess(self.profiler.stats()[0].time, 0.02)
+
+    def test_recompiled_template(self):
+        Template(SOURCE, profiler=self.profiler).render({'xs': [1]})
+        Template(SOURCE, profiler=self.profiler).render({'xs': [1]})
+        self.assertEqual(len(self.profiler.locations), 3)
+        self.assertEqual(calls(self.profiler)[(2, 1)], 2)
+
+    def test_reset(self):
+        Template(SOURCE, profiler=self.profiler).render({'xs': [1]})
+        self.profiler.reset()
+        self.assertEqual(self.profiler.stats(), [])
+
+    def test_report(self):
+        Template(SOURCE, origin='list.html', profiler=self.profiler).render(
+            {'xs': [1, 2]})
+        lines = self.profiler.report(sort='calls', limit=2).splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[1].endswith('list.html:3:7  {{ x|quote }}'))
+        with self.assertRaises(ValueError):
+            self.profiler.stats(sort='name')
+
+    def test_not_instrumented(self):
+        self.assertNotIn('profile', to_source(Template(SOURCE).parse()))
+
+    def test_bytecode_cache(self):
+        directory = tempfile.mkdtemp()
+        try:
+            cache = FileSystemBytecodeCache(directory)
+            Template(SOURCE, bytecode_cache=cache)
+            tmpl = Template(SOURCE, bytecode_cache=cache,
+                            profiler=self.profiler)
+            tmpl.render({'xs': [1]})
+            self.assertEqual(len(self.profiler.stats()), 3)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_excerpt(self):
+        self.assertEqual(excerpt('a\n {{ b }} c', 2, 2), '{{ b }}')
+        self.assertEqual(excerpt('{% if a %}', 1, 1), '{% if a %}')
+        self.assertEqual(excerpt('{{ %s }}' % ('x' * 60), 1, 1),
+                         '{{ ' + 'x' * 44 + '...')
+        self.assertEqual(excerpt('', 3, 1), '')
+
+    @skipIf(sys.version_info < (3, 6), 'async rendering requires Python 3.6+')
+    def test_async(self):
+        tmpl = Template(SOURCE, profiler=self.profiler)
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(tmpl.render_async({'xs': [1, 2, 3]}))
+        finally:
+            loop.close()
+        self.assertEqual(calls(self.profiler),
+                         {(2, 1): 1, (3, 7): 3, (3, 25): 3})
+
+
+class InlinedProfilerTest(TempDirTestCase):
+
+    def setUp(self):
+        super(InlinedProfilerTest, self).setUp()
+        self.profiler = Profiler()
+        self.loader = Loader([self.directory], profiler=self.profiler)
+
+    def test_locations(self):
+        base = self.write('base.html',
+                          '<h1>{{ title }}</h1>\n'
+                          '{% block body %}{% endblock %}')
+        item = self.write('item.html', '\n  {{ item }}')
+        page = self.write('page.html',
+                          '{% extends "base.html" %}{% block body %}'
+                          '{% for item in items %}{% include "item.html" %}'
+                          '{% endfor %}{% endblock %}')
+        self.loader.select_template('page.html').render(
+            {'title': 'T', 'items': [1, 2]})
+        self.assertEqual(
+            sorted((stat.location.template, stat.location.line,
+                    stat.location.column, stat.location.excerpt, stat.calls)
+                   for stat in self.profiler.stats()),
+            sorted([
+                (base, 1, 5, '{{ title }}', 1),
+                (item, 2, 3, '{{ item }}', 2),
+                (page, 1, 42, '{% for item in items %}', 1),
+            ]))
@@ -0,0 +1,75 @@
+import io
+from unittest import TestCase
+
+from rattle.template import Template
+
+
+class StreamTest(TestCase):
+
+    def test_stream_joins_to_render(self):
+        tmpl = Template('<ul>{% for a in b %}<li>{{ a }}</li>{% endfor %}</ul>')
+        ctx = {'b': list(range(100))}
+        self.assertEqual(''.join(tmpl.stream(ctx)), tmpl.render(ctx))
+        self.assertEqual(''.join(tmpl.stream(ctx, chunk_size=7)),
+                         tmpl.render(ctx))
+
+    def test_stream_chunk_size(self):
+        tmpl = Template('{% for a in b %}{{ a }}{% endfor %}')
+        chunks = list(tmpl.stream({'b': list(range(10))}, chunk_size=3))
+        self.assertEqual(chunks, ['012', '345', '678', '9'])
+
+    def test_stream_single_chunk(self):
+        tmpl = Template('Hello {{ a }}!')
+        self.assertEqual(list(tmpl.stream({'a': 'world'})), ['Hello world!'])
+
+    def test_stream_is_lazy(self):
+        def items():
+            yield 'a'
+            raise RuntimeError('consumed too far')
+
+        tmpl = Template('{% for a in b %}{{ a }}{% endfor %}')
+        chunks = tmpl.stream({'b': items()}, chunk_size=1)
+        self.assertEqual(next(chunks), 'a')
+        with self.assertRaises(RuntimeError):
+            next(chunks)
+
+    def test_stream_invalid_chunk_size(self):
+        tmpl = Template('abc')
+        with self.assertRaises(ValueError):
+            tmpl.stream({}, chunk_size=0)
+
+
+class Writer(object):
+
+    def __init__(self):
+        self.writes = []
+
+    def write(self, data):
+        self.writes.append(data)
+
+
+class RenderToTest(TestCase):
+
+    def test_render_to(self):
+        tmpl = Template('<ul>{% for a in b %}<li>{{ a }}</li>{% endfor %}</ul>')
+        ctx = {'b': list(range(100))}
+        fp = io.StringIO()
+        tmpl.render_to(fp, ctx)
+        self.assertEqual(fp.getvalue(), tmpl.render(ctx))
+
+    def test_render_to_chunked(self):
+        tmpl = Template('{% for a in b %}{{ a }}{% endfor %}')
+        fp = Writer()
+        tmpl.render_to(fp, {'b': list(range(10))}, chunk_size=4)
+        self.assertEqual(fp.writes, ['0123', '4567', '89'])
+
+    def test_render_to_encoding(self):
+        tmpl = Template('{{ a }} & {{ b }}')
+        fp = io.BytesIO()
+        tmpl.render_to(fp, {'a': u'é', 'b': '<'}, encoding='utf-8')
+        self.assertEqual(fp.getvalue(), u'é & &lt;'.encode('utf-8'))
+
+    def test_render_to_static(self):
+        fp = Writer()
+        Template('static').render_to(fp)
+        self.assertEqual(fp.writes, ['static'])
@@ -1,3 +1,6 @@
+from unittest import TestCase
+
+from rattle.template import Template
 from tests.utils import TemplateTestCase
 
 
@@ -230,3 +233,88 @@ class ForEmptyTest(TemplateTestCase):
         )
         for src, expect in TESTS:
             self.assertRendered(src, expect, ctx)
+
+
+class NestingTest(TemplateTestCase):
+
+    def test_empty_bodies(self):
+        ctx = {'a': False, 'b': [1]}
+        TESTS = (
+            ('{% if a %}{% endif %}x', 'x'),
+            ('{% if a %}{% else %}{% endif %}x', 'x'),
+            ('{% for i in b %}{% endfor %}x', 'x'),
+            ('{% if a %}{# c #}{% else %}x{% endif %}', 'x'),
+        )
+        for src, expect in TESTS:
+            self.assertRendered(src, expect, ctx)
+
+    def test_deep_nesting(self):
+        src = '{% if a %}<' * 500 + '{{ b }}' + '>{% endif %}' * 500
+        self.assertRendered(
+            src, '<' * 500 + 'x' + '>' * 500, {'a': True, 'b': 'x'})
+
+
+class WhitespaceTest(TestCase):
+
+    def render(self, source, context=None, **kwargs):
+        return Template(source, **kwargs).render(context or {})
+
+    def test_collapse(self):
+        self.assertEqual(
+            self.render('<ul>\n    {% for a in b %}\n    <li>{{ a }}  x</li>'
+                        '{% endfor %}\n</ul>  ', {'b': [1, 2]},
+                        collapse_whitespace=True),
+            '<ul>\n\n<li>1 x</li>\n<li>2 x</li>\n</ul> ')
+
+    def test_off_by_default(self):
+        self.assertEqual(self.render('a  \n  b'), 'a  \n  b')
+
+    def test_preserved(self):
+        self.assertEqual(
+            self.render('<p>  a</p>  <PRE class="{{ c }}">  x\n  {{ a }}  y'
+                        '</pre>  <textarea>  t  </textarea> <p>  b</p>',
+                        {'a': 1, 'c': 'c'}, collapse_whitespace=True),
+            '<p> a</p> <PRE class="c">  x\n  1  y</pre> '
+            '<textarea>  t  </textarea> <p> b</p>')
+        self.assertEqual(
+            self.render('<script>var a = "  ";</script>  <style>  </style>',
+                        collapse_whitespace=True),
+            '<script>var a = "  ";</script> <style>  </style>')
+
+    def test_spaceless(self):
+        self.assertEqual(
+            self.render('  {% spaceless %}  <p>\n\n  {{ a }}  </p>  '
+                        '{% endspaceless %}  ', {'a': 1}),
+            '   <p>\n1 </p>   ')
+        self.assertEqual(
+            self.render('{% spaceless %}<pre>  {% endspaceless %}  '
+                        '{% spaceless %}a  b{% endspaceless %}'),
+            '<pre>    a b')
+
+    def test_static(self):
+        tmpl = Template('<p>\n    a\n</p>', collapse_whitespace=True)
+        self.assertEqual(tmpl.static, '<p>\na\n</p>')
+
+
+class StructureErrorTest(TestCase):
+
+    def assertError(self, src, message, position):
+        with self.assertRaises(ValueError) as cm:
+            Template(src)
+        self.assertIn(message, str(cm.exception))
+        pos = cm.exception.source_pos
+        self.assertEqual((pos.lineno, pos.colno), position)
+
+    def test_unclosed(self):
+        self.assertError(
+            'a\n{% if a %}\n{% for x in y %}', '{% for %} is not closed', (3, 1))
+
+    def test_unknown_tag(self):
+        self.assertError('\n {% foo %}', "Token('FOO', ' foo ')", (2, 4))
+
+    def test_misplaced_end(self):
+        self.assertError(
+            '{% for a in b %}{% endif %}', "Token('ENDIF', ' endif ')", (1, 19))
+        self.assertError(
+            '{% if a %}{% else %}{% else %}{% endif %}',
+            "Token('ELSE', ' else ')", (1, 23))
@@ -1,4 +1,5 @@
 from rattle import PY3, library
+from rattle.template import Template, TemplateSyntaxError
 
 import tests.filters  # noqa: necessary to register test filters
 from tests.utils import Mock, TemplateTestCase
@@ -120,6 +121,33 @@ class FilterLookupTest(TemplateTestCase):
         library.unregister_filter('tests.test_var.bye_filter')
         library.unregister_filter('tests.test_var.hello_filter')
 
+    def test_unknown_filter(self):
+        TESTS = (
+            '{{ a|no_such_filter }}',
+            '{{ a|tests.filters.no_such_filter }}',
+            '{% if a|no_such_filter %}x{% endif %}',
+        )
+        for src in TESTS:
+            with self.assertRaises(TemplateSyntaxError):
+                Template(src)
+
+    def test_unknown_filter_position(self):
+        TESTS = (
+            ('a\n  {{ a|no_such_filter }}', (2, 6)),
+            ('a\n{% if a %}\n {% for x in a|no_such_filter %}{% endfor %}'
+             '{% endif %}', (3, 2)),
+        )
+        for src, position in TESTS:
+            with self.assertRaises(TemplateSyntaxError) as cm:
+                Template(src)
+            pos = cm.exception.source_pos
+            self.assertEqual((pos.lineno, pos.colno), position)
+
+    def test_filter_bound_at_compile_time(self):
+        tmpl = Template('{{ 42|hello_filter }}')
+        library.unregister_filter('tests.test_var.hello_filter')
+        self.assertEqual(tmpl.render(), 'Hello 42!')
+
     def test_pipe_precendence(self):
         # A list of (template, context, output)
         TESTS = (
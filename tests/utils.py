@@ -1,3 +1,7 @@
+import os
+import shutil
+import tempfile
+import time
 import unittest
 
 from rattle.template import Template
@@ -26,3 +30,28 @@ class TemplateTestCase(unittest.TestCase):
             msg = 'Failed rendering template %s:\n%s: %s' % (
                 source, e.__class__.__name__, standardMsg)
             self.fail(msg)
+
+
+class TempDirTestCase(unittest.TestCase):
+    """
+    Runs each test with a new empty directory, ``self.directory``.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, content, mtime=None):
+        path = os.path.join(self.directory, name)
+        if os.path.exists(path):
+            # Make sure the change is seen
+            time.sleep(0.01)
+        elif not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(content)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+        return path